@@ -1,15 +1,20 @@
 import streamlit as st
-import time
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 from askPostgres import (
     ask_oci_genai,
     panda_table_from_query,
+    table_chunks_from_query,
     plot_code_from_genai,
+    plot_spec_from_genai,
     ask_postgres,
 )
-from askPostgres import DB_MIGRATION, DB_SPOTIFY
+from askPostgres import get_db_migration, get_db_spotify, warm_up
+from constants import PLOT_MODE, WARM_UP
+from plot_executor import render_plot, PlotExecutionError
+from plot_spec import render_plot_spec_png
+from query_guard import QueryRejected
+from sql_validator import InvalidQuery
+from tracing import timing_breakdown, trace
 
 
 def display_table(df):
@@ -17,11 +22,122 @@ def display_table(df):
     st.write(df)
 
 
+def show_guard_notice(df):
+    """Avisa quando a guarda de custo limitou a query deste resultado."""
+    decision = df.attrs.get('guard') if df is not None else None
+    if decision and decision['action'] == 'limit':
+        st.warning(decision['reason'])
+
+
+def show_rollup_notice(df):
+    """Informa quando a resposta foi servida por um rollup pré-agregado."""
+    rollup = df.attrs.get('rollup') if df is not None else None
+    if rollup:
+        st.caption(f'Served from pre-aggregated rollup `{rollup}`.')
+
+
+def show_ask_metrics(metrics):
+    """Mostra por qual caminho a pergunta foi respondida e a que custo."""
+    if not metrics:
+        return
+    path = {
+        'cache': 'answer cache',
+        'fast': 'single-shot SQL',
+        'agent': 'SQL agent',
+    }.get(metrics['path'], metrics['path'])
+    st.caption(
+        f"Answered by the {path} with {metrics['llm_calls']} LLM call(s) "
+        f"in {metrics['latency_ms'] / 1000:.2f}s."
+    )
+
+
+def stream_table(query, db, schema=None):
+    """Exibe o resultado da query em blocos, à medida que chegam do banco."""
+    table = None
+    chunk = None
+    try:
+        for chunk in table_chunks_from_query(query, db=db, schema=schema):
+            if table is None:
+                table = st.dataframe(chunk)
+            else:
+                table.add_rows(chunk)
+    except QueryRejected as e:
+        st.error(f'Query blocked by the cost guard: {e}')
+        return True
+    except InvalidQuery as e:
+        st.error(f'Query failed the local SQL validation: {e}')
+        return True
+    show_guard_notice(chunk)
+    show_rollup_notice(chunk)
+    return table is not None
+
+
+def load_table(query, db, schema=None):
+    """Carrega o resultado inteiro da query, respeitando a guarda de custo."""
+    try:
+        df = panda_table_from_query(query, db=db, schema=schema)
+    except QueryRejected as e:
+        st.error(f'Query blocked by the cost guard: {e}')
+        return None
+    except InvalidQuery as e:
+        st.error(f'Query failed the local SQL validation: {e}')
+        return None
+    show_guard_notice(df)
+    show_rollup_notice(df)
+    return df
+
+
 def display_plot_code(code):
     """Exibe o código para plotagem em um bloco de código no Streamlit."""
     st.code(code, language='python')
 
 
+def display_plot(df):
+    """Gera o código de plotagem e exibe a imagem renderizada no pool."""
+    if PLOT_MODE == 'spec':
+        spec = plot_spec_from_genai(df)
+        if not spec:
+            st.warning('GenAI did not return a valid plot spec.')
+            return
+        st.json(spec)
+        try:
+            st.image(render_plot_spec_png(df, spec))
+        except PlotExecutionError as e:
+            st.error(str(e))
+        return
+
+    plot_code = plot_code_from_genai(df)
+    if not plot_code:
+        st.warning('GenAI did not return any plotting code.')
+        return
+
+    display_plot_code(plot_code)
+    try:
+        image = render_plot(plot_code, df)
+    except PlotExecutionError as e:
+        st.error(f'Error executing plot code: {e}')
+        return
+
+    if image:
+        st.image(image)
+    else:
+        st.warning('The generated code did not plot any data.')
+
+
+def display_timings(question_trace):
+    """Exibe quanto tempo cada etapa da pergunta levou."""
+    total = 1000 * question_trace.root.duration
+    with st.expander(f'Timing breakdown ({total:.0f} ms)'):
+        st.dataframe(
+            timing_breakdown(question_trace),
+            hide_index=True,
+            use_container_width=True,
+        )
+
+
+if WARM_UP:
+    warm_up()
+
 # Configurando a barra lateral
 st.sidebar.title("Histórico de Perguntas")
 history = st.sidebar.empty()
@@ -47,95 +163,77 @@ user_input = st.text_input('Write down your question:')
 
 
 if user_input:
-    st.session_state.questions_history.append(user_input)
-    history.write("\n".join(st.session_state.questions_history))
+    with trace('question', keep=True) as question_span:
+        st.session_state.questions_history.append(user_input)
+        history.write("\n".join(st.session_state.questions_history))
+
+        if ask_migration_db:
+            st.write('Consulting Migration DB...')
+            DB_MIGRATION = get_db_migration()
+            ask_metrics = {}
+            genai_response, query = ask_postgres(
+                user_input, DB_MIGRATION, 'public', metrics=ask_metrics
+            )
 
-    if ask_migration_db:
-        st.write('Consulting Migration DB...')
-        genai_response, query = ask_postgres(user_input, DB_MIGRATION)
+            col1, col2 = st.columns(2)
 
-        col1, col2 = st.columns(2)
+            with col1:
+                st.subheader('SQL Query')
+                st.code(query)
 
-        with col1:
-            st.subheader('SQL Query')
-            st.code(query)
+            with col2:
+                st.subheader('Query Explained')
+                st.write(genai_response)
+            show_ask_metrics(ask_metrics)
 
-        with col2:
-            st.subheader('Query Explained')
-            st.write(genai_response)
+            if st.button('Show DataFrame', key='show_dataframe_migration'):
+                if not stream_table(query, db=DB_MIGRATION, schema='public'):
+                    st.error('Error retrieving DataFrame from Migration DB.')
 
-        if st.button('Show DataFrame', key='show_dataframe_migration'):
-            df = panda_table_from_query(query, db=DB_MIGRATION)
-            if df is not None:
-                display_table(df)
-            else:
-                st.error('Error retrieving DataFrame from Migration DB.')
-
-        if st.button('Show Plot', key='show_plot_migration'):
-            df = panda_table_from_query(query, db=DB_MIGRATION)
-            if df is not None:
-                plot_code = plot_code_from_genai(df)
-                display_plot_code(plot_code)
-                try:
-                    exec(plot_code)
-                    st.pyplot(plt)
-                except Exception as e:
-                    st.error(f'Error executing plot code: {e}')
-            else:
-                st.error('Error generating DataFrame from Migration DB.')
+            if st.button('Show Plot', key='show_plot_migration'):
+                df = load_table(query, db=DB_MIGRATION, schema='public')
+                if df is not None:
+                    display_plot(df)
 
-    elif ask_spotify_db:
-        st.write('Consulting Spotify DB...')
-        genai_response, query = ask_postgres(
-            user_input, DB_SPOTIFY, 'public'
-        )
+        elif ask_spotify_db:
+            st.write('Consulting Spotify DB...')
+            DB_SPOTIFY = get_db_spotify()
+            ask_metrics = {}
+            genai_response, query = ask_postgres(
+                user_input, DB_SPOTIFY, 'public', metrics=ask_metrics
+            )
 
-        col1, col2 = st.columns(2)
+            col1, col2 = st.columns(2)
 
-        with col1:
-            st.subheader('SQL Query')
-            st.code(query)
+            with col1:
+                st.subheader('SQL Query')
+                st.code(query)
 
-        with col2:
-            st.subheader('Query Explained')
-            st.write(genai_response)
+            with col2:
+                st.subheader('Query Explained')
+                st.write(genai_response)
+            show_ask_metrics(ask_metrics)
 
-        if st.button('Show DataFrame', key='show_dataframe_spotify'):
-            df = panda_table_from_query(
-                query, db=DB_SPOTIFY, schema='public'
-            )
-            if df is not None:
-                display_table(df)
-            else:
-                st.error('Error retrieving DataFrame from Spotify DB.')
+            if st.button('Show DataFrame', key='show_dataframe_spotify'):
+                if not stream_table(query, db=DB_SPOTIFY, schema='public'):
+                    st.error('Error retrieving DataFrame from Spotify DB.')
 
-        if st.button('Show Plot', key='show_plot_spotify'):
-            df = panda_table_from_query(
-                query, db=DB_SPOTIFY, schema='public'
-            )
-            if df is not None:
-                plot_code = plot_code_from_genai(df)
-                display_plot_code(plot_code)
-                try:
-                    exec(plot_code)
-                    st.pyplot(plt)
-                except Exception as e:
-                    st.error(f'Error executing plot code: {e}')
-            else:
-                st.error('Error generating DataFrame from Spotify DB.')
-
-    else:
-        st.write('Consulting GenAI...')
-        genai_response = ask_oci_genai(user_input)
+            if st.button('Show Plot', key='show_plot_spotify'):
+                df = load_table(query, db=DB_SPOTIFY, schema='public')
+                if df is not None:
+                    display_plot(df)
 
-        if genai_response:
-            if hasattr(genai_response, 'content'):
-                response_text = genai_response.content
-            else:
-                response_text = str(genai_response)
+        else:
+            st.write('Consulting GenAI...')
+            metrics = {}
+            st.write_stream(
+                ask_oci_genai(user_input, stream=True, metrics=metrics)
+            )
 
-            for chunk in response_text.split('. '):
-                st.write(chunk)
-                st.text('...')
-                time.sleep(0.5)
+            if metrics and metrics['time_to_first_token'] is not None:
+                st.caption(
+                    f"First token in {metrics['time_to_first_token']:.2f}s, "
+                    f"full answer in {metrics['total_latency']:.2f}s."
+                )
 
+    display_timings(question_span.trace)
@@ -0,0 +1,170 @@
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from caching import PersistentCache
+from constants import (
+    CACHE_DIR,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_SIMILARITY,
+)
+
+
+NGRAM_SIZE = 3
+
+
+def normalize_question(question: str) -> str:
+    text = unicodedata.normalize('NFKD', question)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r'[^\w]+', ' ', text.lower())
+    return ' '.join(text.split())
+
+
+def _ngrams(normalized):
+    padded = f' {normalized} '
+    return Counter(
+        padded[i : i + NGRAM_SIZE]
+        for i in range(max(1, len(padded) - NGRAM_SIZE + 1))
+    )
+
+
+def _numbers(normalized):
+    return frozenset(re.findall(r'\d+', normalized))
+
+
+class AnswerCache:
+    """Cache pergunta -> SQL gerada, com match exato e por similaridade.
+
+    A chave é a pergunta normalizada mais um escopo (banco, schema e
+    fingerprint do schema), então uma mudança de schema nunca reaproveita
+    SQL antiga. O match por similaridade usa TF-IDF de trigramas de
+    caracteres calculado localmente, sem chamadas de rede.
+    """
+
+    def __init__(
+        self,
+        name='answer_cache',
+        path=None,
+        ttl=ANSWER_CACHE_TTL,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        similarity=ANSWER_CACHE_SIMILARITY,
+    ):
+        self.similarity = similarity
+        self._cache = PersistentCache(
+            name, ttl=ttl, path=path, max_entries=max_entries
+        )
+        self._ngrams = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _vector(self, normalized):
+        vector = self._ngrams.get(normalized)
+        if vector is None:
+            if len(self._ngrams) > 4 * (self._cache.max_entries or 1000):
+                self._ngrams.clear()
+            vector = self._ngrams[normalized] = _ngrams(normalized)
+        return vector
+
+    def _most_similar(self, normalized, scope):
+        candidates = [
+            key[0]
+            for key in self._cache.keys()
+            if key[1] == scope and key[0] != normalized
+        ]
+        if not candidates:
+            return None, 0.0
+
+        # Perguntas que diferem em números ("top 5" x "top 10") nunca
+        # compartilham SQL, por mais parecido que seja o resto do texto.
+        numbers = _numbers(normalized)
+        candidates = [c for c in candidates if _numbers(c) == numbers]
+        if not candidates:
+            return None, 0.0
+
+        documents = [self._vector(c) for c in candidates]
+        query = self._vector(normalized)
+        df = Counter()
+        for vector in documents + [query]:
+            df.update(vector.keys())
+        n_docs = len(documents) + 1
+
+        def weigh(vector):
+            weights = {
+                gram: count * (math.log((1 + n_docs) / (1 + df[gram])) + 1)
+                for gram, count in vector.items()
+            }
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            return weights, norm
+
+        query_weights, query_norm = weigh(query)
+        best, best_score = None, 0.0
+        for candidate, vector in zip(candidates, documents):
+            weights, norm = weigh(vector)
+            dot = sum(
+                w * weights.get(gram, 0.0) for gram, w in query_weights.items()
+            )
+            score = dot / (query_norm * norm)
+            if score > best_score:
+                best, best_score = candidate, score
+        return best, best_score
+
+    def get(self, question, scope):
+        normalized = normalize_question(question)
+        value = self._cache.get((normalized, scope))
+        if value is not None:
+            with self._lock:
+                self.exact_hits += 1
+            return value
+
+        if self.similarity:
+            candidate, score = self._most_similar(normalized, scope)
+            if candidate is not None and score >= self.similarity:
+                value = self._cache.get((candidate, scope))
+                if value is not None:
+                    logging.info(
+                        f'Cache de respostas: "{normalized}" ~ "{candidate}" '
+                        f'(similaridade {score:.2f}).'
+                    )
+                    with self._lock:
+                        self.semantic_hits += 1
+                    return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, question, scope, value):
+        self._cache.put((normalize_question(question), scope), value)
+        self._cache.save()
+
+    def clear(self):
+        self._cache.clear()
+        self._ngrams.clear()
+        self._cache.save()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            hits = self.exact_hits + self.semantic_hits
+            stats = dict(
+                exact_hits=self.exact_hits,
+                semantic_hits=self.semantic_hits,
+                misses=self.misses,
+                hit_rate=hits / lookups if lookups else 0.0,
+            )
+        cache_stats = self._cache.stats()
+        stats.update(
+            entries=cache_stats['entries'],
+            evictions=cache_stats['evictions'],
+        )
+        return stats
+
+
+ANSWER_CACHE = AnswerCache(path=os.path.join(CACHE_DIR, 'answer_cache.pkl'))
@@ -1,12 +1,17 @@
 import streamlit as st
 import logging
+import oracledb
+import pandas as pd
 from askDB import (
-    generate_query,
+    generate_sql,
+    generate_pandas_chunks,
+    remember_sql,
     generate_chat_response,
     generate_plot,
     PROFILE,
     ACTIONS,
 )
+from query_guard import QueryRejected
 
 logging.basicConfig(
     level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s'
@@ -29,15 +34,48 @@ if st.button('Enviar'):
 
     if ask_db:
         st.write('Consultando o banco de dados...')
-        result = generate_query(user_input, ACTIONS[0], PROFILE)
-
-        if result:
-            query_generated, df = result
-            st.session_state['query_generated'] = query_generated
-            st.session_state['df'] = df
+        query_generated = generate_sql(user_input, ACTIONS[0], PROFILE)
 
+        if query_generated:
             st.markdown('**Query gerada pela GenAI:**')
             st.code(query_generated)
+
+            # Mostra o primeiro bloco assim que ele chega e anexa os demais.
+            table = None
+            chunks = []
+            failed = False
+            try:
+                for chunk in generate_pandas_chunks(query_generated):
+                    chunks.append(chunk)
+                    if table is None:
+                        st.write('**Tabela gerada pela consulta:**')
+                        table = st.dataframe(chunk)
+                    else:
+                        table.add_rows(chunk)
+            except QueryRejected as e:
+                st.error(e.decision['reason'])
+                failed = True
+            except oracledb.Error:
+                # Resultado parcial: não vai para a sessão nem para o cache.
+                st.error(
+                    'A leitura do resultado falhou; a tabela está incompleta.'
+                )
+                chunks = []
+                failed = True
+
+            # A guarda de custo pode ter limitado a query.
+            decision = chunks[-1].attrs.get('guard') if chunks else None
+            if decision and decision['action'] == 'limit':
+                st.warning(decision['reason'])
+
+            if chunks:
+                remember_sql(user_input, ACTIONS[0], PROFILE, query_generated)
+                st.session_state['query_generated'] = query_generated
+                st.session_state['df'] = pd.concat(chunks)
+                if st.session_state['df'].empty:
+                    st.warning('A consulta não retornou linhas.')
+            elif not failed:
+                st.warning('Nenhum resultado foi retornado para a consulta.')
         else:
             st.warning('Nenhum resultado foi retornado para a consulta.')
     else:
@@ -62,11 +100,11 @@ if 'df' in st.session_state:
     if st.button('Ver plot'):
         st.write('**Plot gerado pela consulta:**')
         if 'fig' not in st.session_state:
-            # Chama a função generate_plot e armazena a figura
+            # Chama a função generate_plot e armazena a imagem renderizada
             fig = generate_plot(PROFILE, st.session_state['df'])
             st.session_state['fig'] = fig
 
         if st.session_state['fig']:
-            st.pyplot(st.session_state['fig'])
+            st.image(st.session_state['fig'])
         else:
             st.warning('Nenhum gráfico foi gerado.')
@@ -0,0 +1,164 @@
+import io
+import logging
+
+import pandas as pd
+from sqlalchemy.exc import DBAPIError
+from constants import FETCH_MODE, FETCH_ARRAYSIZE
+from tracing import record_frame, span
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+    pa_csv = None
+
+
+TIMESTAMPTZ_OID = 1184
+
+# OIDs de tipos do Postgres -> tipos Arrow. NUMERIC vira float64 de forma
+# explícita (como no caminho antigo via pandas); o resto cai em string.
+if pa is not None:
+    POSTGRES_ARROW_TYPES = {
+        16: pa.bool_(),
+        20: pa.int64(),
+        21: pa.int16(),
+        23: pa.int32(),
+        700: pa.float32(),
+        701: pa.float64(),
+        1700: pa.float64(),
+        1082: pa.date32(),
+        1114: pa.timestamp('us'),
+    }
+else:
+    POSTGRES_ARROW_TYPES = {}
+
+
+def arrow_enabled():
+    return FETCH_MODE == 'arrow' and pa is not None
+
+
+def _to_pandas(table):
+    # split_blocks + self_destruct liberam cada coluna Arrow assim que ela é
+    # convertida, evitando manter as duas cópias inteiras ao mesmo tempo.
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def fetch_oracle_frame(connection, query, arraysize=FETCH_ARRAYSIZE):
+    # fetch_decimals=False: NUMBER com escala 0 e precisão <= 18 vira int64,
+    # os demais NUMBER viram float64, sem passar por objetos Decimal.
+    with span('sql.execute', fetch='arrow'):
+        odf = connection.fetch_df_all(
+            statement=query, arraysize=arraysize, fetch_decimals=False
+        )
+    with span('dataframe.build') as build_span:
+        table = pa.Table.from_arrays(
+            odf.column_arrays(), names=odf.column_names()
+        )
+        df = _to_pandas(table)
+        record_frame(build_span, df)
+    return df
+
+
+def iter_oracle_frames(connection, query, size=FETCH_ARRAYSIZE):
+    for odf in connection.fetch_df_batches(
+        statement=query, size=size, fetch_decimals=False
+    ):
+        table = pa.Table.from_arrays(
+            odf.column_arrays(), names=odf.column_names()
+        )
+        yield _to_pandas(table)
+
+
+def _postgres_columns(cursor, query):
+    # Quebra de linha antes do ')': um comentário '--' no fim da query não
+    # engole o resto do SQL.
+    cursor.execute(f'SELECT * FROM ({query}\n) AS _q LIMIT 0')
+    return [(col.name, col.type_code) for col in cursor.description]
+
+
+def fetch_postgres_frame(engine, query):
+    query = query.strip().rstrip(';')
+    with span('sql.execute', fetch='copy') as execute_span:
+        raw = engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            columns = _postgres_columns(cursor, query)
+            names = [name for name, _ in columns]
+            # Nomes posicionais evitam conflito com colunas repetidas.
+            positional = [f'c{i}' for i in range(len(columns))]
+
+            buffer = io.BytesIO()
+            cursor.copy_expert(
+                f'COPY ({query}\n) TO STDOUT WITH (FORMAT csv)', buffer
+            )
+            cursor.close()
+            raw.commit()
+        finally:
+            raw.close()
+        execute_span.set(bytes=buffer.tell())
+
+    with span('dataframe.build') as build_span:
+        df = _read_copy_csv(buffer, columns, positional, names)
+        record_frame(build_span, df)
+    return df
+
+
+def _read_copy_csv(buffer, columns, positional, names):
+    buffer.seek(0)
+    column_types = {
+        positional[i]: POSTGRES_ARROW_TYPES[oid]
+        for i, (_, oid) in enumerate(columns)
+        if oid in POSTGRES_ARROW_TYPES
+    }
+    string_type = {
+        name: pa.string() for name in positional if name not in column_types
+    }
+    table = pa_csv.read_csv(
+        buffer,
+        read_options=pa_csv.ReadOptions(column_names=positional),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={**string_type, **column_types},
+            null_values=[''],
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+            true_values=['t'],
+            false_values=['f'],
+        ),
+    )
+    df = _to_pandas(table)
+    # timestamptz sai do COPY com offset curto ("+00"), que o parser do
+    # Arrow não aceita; o pandas converte só essas colunas.
+    for i, (_, oid) in enumerate(columns):
+        if oid == TIMESTAMPTZ_OID:
+            df[positional[i]] = pd.to_datetime(
+                df[positional[i]], utc=True, format='ISO8601'
+            )
+    df.columns = names
+    return df
+
+
+def fetch_duckdb_frame(engine, query):
+    # O DuckDB já guarda os dados em colunas e converte o resultado direto
+    # para DataFrame, sem passar por tuplas Python.
+    with span('sql.execute', fetch='duckdb'):
+        with engine.connect() as conn:
+            df = conn.connection.driver_connection.execute(query).df()
+    return df
+
+
+def read_postgres_frame(engine, query):
+    if FETCH_MODE == 'arrow' and engine.dialect.name == 'duckdb':
+        return fetch_duckdb_frame(engine, query)
+    if arrow_enabled() and engine.dialect.name == 'postgresql':
+        try:
+            return fetch_postgres_frame(engine, query)
+        except (DBAPIError, engine.dialect.loaded_dbapi.Error):
+            # Erro do servidor (statement_timeout, sintaxe, conexão): o
+            # pd.read_sql rodaria a mesma query de novo só para falhar igual.
+            raise
+        except Exception as e:
+            logging.warning(
+                f'Leitura colunar falhou, usando pd.read_sql: {e}'
+            )
+    return pd.read_sql(query, engine)
@@ -1,17 +1,38 @@
 import re
+import time
 import logging
 import oracledb
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from constants import PROMPT, ACTIONS, PROFILE
-from wallet_credentials import (
-    username,
-    password,
-    config,
-    wallet_path,
-    wallet_password,
-    DSN,
+from constants import (
+    PROMPT,
+    ACTIONS,
+    PROFILE,
+    PLOT_MODE,
+    PLOT_SPEC_PROMPT,
+    STREAM_CHUNK_ROWS,
+    STREAM_MAX_ROWS,
+)
+from oracle_pool import acquire_connection
+from query_guard import QueryRejected, guard_oracle_query, oracle_call_timeout
+from query_log import record_query
+from schema_cache import get_oracle_catalog
+from sql_validator import InvalidQuery, check_oracle_query
+from tracing import record_frame, span, start_span, trace
+from answer_cache import ANSWER_CACHE
+from plot_cache import get_plot_code, put_plot_code, template_version
+from plot_executor import render_plot, PlotExecutionError
+from plot_spec import (
+    CHARTS,
+    describe_columns,
+    parse_plot_spec,
+    render_plot_spec_png,
+)
+from prompt_context import frame_preview
+from arrow_fetch import (
+    arrow_enabled,
+    fetch_oracle_frame,
+    iter_oracle_frames,
 )
 
 logging.basicConfig(
@@ -19,6 +40,23 @@ logging.basicConfig(
 )
 
 
+def _select_ai(cursor, query, prompt, profile_name, action):
+    # O Select AI não devolve contagem de tokens; o span guarda os tamanhos
+    # do prompt e da resposta.
+    with span(
+        'llm.call', model=profile_name, action=action, prompt_chars=len(prompt)
+    ) as llm_span:
+        cursor.execute(query, [prompt, profile_name, action])
+        response = cursor.fetchone()[0]
+
+        if isinstance(response, oracledb.LOB):
+            logging.debug('Response is a LOB, reading content.')
+            response = response.read()
+
+        llm_span.set(response_chars=len(response or ''))
+        return response
+
+
 def generate_chat_response(
     profile_name, action=ACTIONS[1], prompt=PROMPT[2], df=None
 ):
@@ -26,18 +64,10 @@ def generate_chat_response(
         df = df.dropna()
 
     column_names = df.columns
-    df_to_plot = df.head(10)
-    table_string = df_to_plot.to_string()
+    table_string = frame_preview(df, rows=10)
 
     try:
-        with oracledb.connect(
-            user=username,
-            password=password,
-            dsn=DSN,
-            config_dir=config,
-            wallet_location=wallet_path,
-            wallet_password=wallet_password,
-        ) as connection:
+        with acquire_connection() as connection:
             with connection.cursor() as cursor:
                 query = """
                 SELECT DBMS_CLOUD_AI.GENERATE(
@@ -56,23 +86,19 @@ def generate_chat_response(
                         f'Passing, profile name as {profile_name}, action as {action}'
                     )
                     logging.debug(f'Passing prompt as {prompt}')
-                    cursor.execute(
-                        query, [prompt_for_graph, profile_name, action]
+                    llm_response = _select_ai(
+                        cursor, query, prompt_for_graph, profile_name, action
                     )
-                    llm_response = cursor.fetchone()[0]
-                    logging.info('Prompt being sent to LLM: %s', llm_response)
+                    logging.debug('LLM response: %s', llm_response)
                 else:
                     logging.debug(
                         f'Passing, profile name as {profile_name}, action as {action}'
                     )
                     logging.debug(f'Passing prompt as {prompt}')
-                    cursor.execute(query, [prompt, profile_name, action])
-                    llm_response = cursor.fetchone()[0]
-                    logging.info('LLM response: %s', llm_response)
-
-                if isinstance(llm_response, oracledb.LOB):
-                    logging.debug('Response is a LOB, reading content.')
-                    llm_response = llm_response.read()
+                    llm_response = _select_ai(
+                        cursor, query, prompt, profile_name, action
+                    )
+                    logging.debug('LLM response: %s', llm_response)
 
                 return llm_response
     except oracledb.Error as e:
@@ -80,119 +106,348 @@ def generate_chat_response(
     return None
 
 
-def generate_pandas_table(query):
+def _fetch_rows_table(connection, query):
+    with connection.cursor() as cursor:
+        with span('sql.execute', fetch='rows') as execute_span:
+            cursor.execute(query)
+            columns = np.array([col[0] for col in cursor.description])
+            data = cursor.fetchall()
+            execute_span.set(rows=len(data))
+        with span('dataframe.build') as build_span:
+            df = pd.DataFrame(data, columns=columns)
+            record_frame(build_span, df)
+        return df
+
+
+def _fetch_pandas_table(connection, query):
+    # SQL do Select AI com objetos inexistentes é recusada aqui, sem ir ao ADB.
+    query = check_oracle_query(connection, query)
+    query, guard = guard_oracle_query(connection, query)
+    start = time.perf_counter()
+    with oracle_call_timeout(connection):
+        if arrow_enabled() and hasattr(connection, 'fetch_df_all'):
+            df = fetch_oracle_frame(connection, query)
+        else:
+            df = _fetch_rows_table(connection, query)
+    # Chave fixa, fora do index_advisor (que só lê os bancos via
+    # SQLAlchemy): o log do ADB serve de consulta e de histórico.
+    record_query(
+        'oracle-adb',
+        'oracle',
+        query,
+        latency_ms=1000 * (time.perf_counter() - start),
+        rows=len(df),
+        source='askDB.generate_query',
+    )
+
+    df.attrs['guard'] = guard
+    logging.info('Pandas DataFrame created successfully.')
+    return df
+
+
+def generate_pandas_table(query, connection=None):
     try:
         logging.info('Executing query to fetch data for pandas table.')
 
-        with oracledb.connect(
-            user=username,
-            password=password,
-            dsn=DSN,
-            config_dir=config,
-            wallet_location=wallet_path,
-            wallet_password=wallet_password,
-        ) as connection:
-            with connection.cursor() as cursor:
-                cursor.execute(query)
-                columns = np.array([col[0] for col in cursor.description])
-                data = cursor.fetchall()
-                df = pd.DataFrame(data, columns=columns)
+        with trace('askDB.generate_pandas_table'):
+            if connection is not None:
+                return _fetch_pandas_table(connection, query)
 
-                logging.info('Pandas DataFrame created successfully.')
-                return df
+            with acquire_connection() as connection:
+                return _fetch_pandas_table(connection, query)
 
+    except QueryRejected as e:
+        logging.error('Query rejected by the cost guard: %s', e)
+        return None
+    except InvalidQuery as e:
+        logging.error('Query rejected by the local validation: %s', e)
+        return None
     except oracledb.Error as e:
         logging.error('Error executing query for pandas table: %s', e)
         return None
 
 
-def generate_plot(profile_name, df, action=ACTIONS[1], prompt=PROMPT[2]):
-    logging.info('Generating plot suggested by GenAI.')
+def _iter_table_chunks(connection, query, chunk_size):
+    if arrow_enabled() and hasattr(connection, 'fetch_df_batches'):
+        empty = True
+        for frame in iter_oracle_frames(connection, query, chunk_size):
+            empty = False
+            yield frame
+        if empty:
+            # Sem lotes não há nomes de coluna; o filtro 1 = 0 só descreve.
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT * FROM ({query}\n) WHERE 1 = 0')
+                columns = [col[0] for col in cursor.description]
+            yield pd.DataFrame(columns=columns)
+        return
+
+    with connection.cursor() as cursor:
+        cursor.arraysize = chunk_size
+        cursor.execute(query)
+        columns = [col[0] for col in cursor.description]
+        data = cursor.fetchmany(chunk_size)
+        # Resultado vazio ainda sai como um bloco, com os nomes das colunas.
+        yield pd.DataFrame(data, columns=columns)
+        while data:
+            data = cursor.fetchmany(chunk_size)
+            if data:
+                yield pd.DataFrame(data, columns=columns)
+
+
+def generate_pandas_chunks(
+    query, chunk_size=STREAM_CHUNK_ROWS, max_rows=STREAM_MAX_ROWS
+):
+    """Gera o resultado da query em blocos de até chunk_size linhas.
+
+    Um erro do ADB depois do primeiro bloco é relançado: quem consome já
+    recebeu parte do resultado e não pode tratá-la como completa. A query
+    recusada pela guarda de custo também: a decisão vai em
+    QueryRejected.decision, e a de cada bloco em chunk.attrs['guard'].
+    """
+    logging.info('Streaming query results in chunks of %s rows.', chunk_size)
+    # Gerador: o span não entra no contexto do consumidor, então o erro é
+    # registrado aqui em vez de pelo span().
+    stream_span = start_span('sql.stream')
+    yielded = False
+    try:
+        with acquire_connection() as connection:
+            query = check_oracle_query(connection, query)
+            query, guard = guard_oracle_query(connection, query)
+            rows = 0
+            with oracle_call_timeout(connection):
+                chunks = _iter_table_chunks(connection, query, chunk_size)
+                for chunk in chunks:
+                    truncated = rows + len(chunk) > max_rows
+                    if truncated:
+                        chunk = chunk.iloc[: max_rows - rows]
+                    chunk.index = range(rows, rows + len(chunk))
+                    chunk.attrs['guard'] = guard
+                    rows += len(chunk)
+                    yielded = True
+                    yield chunk
+
+                    if rows >= max_rows:
+                        # Só há truncamento se vier algo além de max_rows.
+                        if truncated or next(chunks, None) is not None:
+                            logging.warning(
+                                'Result truncated at %s rows.', max_rows
+                            )
+                            stream_span.set(truncated=True)
+                        break
+        stream_span.set(rows=rows)
+
+    except QueryRejected as e:
+        stream_span.set(error=type(e).__name__)
+        logging.error('Query rejected by the cost guard: %s', e)
+        raise
+    except InvalidQuery as e:
+        stream_span.set(error=type(e).__name__)
+        logging.error('Query rejected by the local validation: %s', e)
+    except oracledb.Error as e:
+        stream_span.set(error=type(e).__name__)
+        logging.error('Error streaming query results: %s', e)
+        if yielded:
+            raise
+    except Exception as e:
+        stream_span.set(error=type(e).__name__)
+        raise
+    finally:
+        stream_span.finish()
+
+
+def _plot_code_from_response(llm_response):
+    python_code = re.search(r'```python(.*?)```', llm_response, re.DOTALL)
+    if not python_code:
+        return None
+
+    python_code = python_code.group(1).strip()
     logging.debug(
-        f'Profile name: {profile_name}, Action: {action}, Prompt: {prompt}'
+        f'Python code extracted from GenAI response:\n{python_code}'
     )
 
+    modified_code = re.sub(
+        r'dados\s*=\s*\{.*?}', 'df = df', python_code, flags=re.DOTALL
+    )
+    return modified_code.replace('plt.show()', '')
+
+
+def generate_plot_spec(profile_name, df, action=ACTIONS[1]):
+    scope = (
+        'oracle-adb-spec',
+        profile_name,
+        action,
+        template_version(PLOT_SPEC_PROMPT),
+    )
+    spec = get_plot_code(df, scope)
+    if spec is not None:
+        logging.info('Plot spec served from plot cache.')
+        return spec
+
+    prompt = PLOT_SPEC_PROMPT.format(
+        columns=describe_columns(df),
+        df_head=frame_preview(df, rows=5, index=False),
+        charts=CHARTS,
+    )
     llm_response = generate_chat_response(profile_name, action, prompt, df)
-    logging.debug('LLM Response:\n%s', llm_response)
+    if not llm_response:
+        logging.error('No GenAI answer for plot spec generation.')
+        return None
 
-    fig, ax = plt.subplots()
+    try:
+        spec = parse_plot_spec(llm_response, df)
+    except ValueError as e:
+        logging.error('Invalid plot spec from GenAI: %s', e)
+        return None
 
-    if llm_response:
-        python_code = re.search(r'```python(.*?)```', llm_response, re.DOTALL)
+    put_plot_code(df, scope, spec)
+    return spec
 
-        if python_code:
-            python_code = python_code.group(1).strip()
-            logging.debug(
-                f'Python code extracted from GenAI response:\n{python_code}'
-            )
 
-            modified_code = re.sub(
-                r'dados\s*=\s*\{.*?}', 'df = df', python_code, flags=re.DOTALL
-            )
+def generate_plot(
+    profile_name, df, action=ACTIONS[1], prompt=PROMPT[2], mode=PLOT_MODE
+):
+    with trace('askDB.generate_plot', mode=mode) as root:
+        return _generate_plot(profile_name, df, action, prompt, mode, root)
 
-            modified_code = modified_code.replace('plt.show()', '')
 
-            logging.debug('Modified code to execute:\n%s', modified_code)
+def _generate_plot(profile_name, df, action, prompt, mode, root):
+    logging.info('Generating plot suggested by GenAI.')
+    logging.debug(
+        f'Profile name: {profile_name}, Action: {action}, Prompt: {prompt}'
+    )
 
-            try:
-                exec(modified_code, globals(), locals())
-            except Exception as exec_error:
-                logging.error(f'Error in Python execution: {exec_error}')
+    if mode == 'spec':
+        spec = generate_plot_spec(profile_name, df, action)
+        if not spec:
+            return None
+        try:
+            return render_plot_spec_png(df, spec)
+        except PlotExecutionError as render_error:
+            logging.error(f'Error rendering plot spec: {render_error}')
+            return None
 
-            if plt.gca().has_data():
-                logging.info('Plot generation successful.')
-                # plt.show()
-                return fig
-            else:
-                logging.warning('No data plotted.')
-                plt.close(fig)
-                return None
-        else:
+    scope = ('oracle-adb', profile_name, action, template_version(prompt))
+    modified_code = get_plot_code(df, scope)
+
+    if modified_code is not None:
+        logging.info('Plot code served from plot cache.')
+        root.set(cache='hit')
+    else:
+        llm_response = generate_chat_response(profile_name, action, prompt, df)
+        logging.debug('LLM Response:\n%s', llm_response)
+
+        if not llm_response:
+            logging.error('No GenAI answer for plot generation.')
+            return None
+
+        modified_code = _plot_code_from_response(llm_response)
+        if modified_code is None:
             logging.warning('No Python code was found in GenAI response.')
-            plt.close(fig)
             return None
+
+        put_plot_code(df, scope, modified_code)
+
+    logging.debug('Modified code to execute:\n%s', modified_code)
+
+    try:
+        image = render_plot(modified_code, df)
+    except PlotExecutionError as exec_error:
+        logging.error(f'Error in Python execution: {exec_error}')
+        return None
+
+    if image:
+        logging.info('Plot generation successful.')
+        return image
     else:
-        logging.error('No GenAI answer for plot generation.')
-        plt.close(fig)
+        logging.warning('No data plotted.')
         return None
 
 
-def generate_query(prompt, action, profile_name):
+def _sql_scope(connection, action, profile_name):
+    # Com o fingerprint do catálogo, a SQL lembrada deixa de valer quando o
+    # schema do usuário muda. Sem catálogo não há como saber: None desliga
+    # o cache de perguntas para a chamada.
     try:
-        logging.info('Starting connection to Oracle-ADB.')
-
-        with oracledb.connect(
-            user=username,
-            password=password,
-            dsn=DSN,
-            config_dir=config,
-            wallet_location=wallet_path,
-            wallet_password=wallet_password,
-        ) as connection:
-            logging.info('Connection established.')
-            with connection.cursor() as cursor:
-                query = """
-                SELECT DBMS_CLOUD_AI.GENERATE(
-                    prompt => :prompt,
-                    profile_name => :profile_name,
-                    action => :action
-                )
-                FROM dual
-                """
+        fingerprint = get_oracle_catalog(connection)['fingerprint']
+    except Exception as e:
+        logging.warning('Catalog unavailable, answer cache skipped: %s', e)
+        return None
+    return ('oracle-adb', profile_name, action, fingerprint)
+
+
+def _call_generate(connection, prompt, action, profile_name):
+    with connection.cursor() as cursor:
+        query = """
+        SELECT DBMS_CLOUD_AI.GENERATE(
+            prompt => :prompt,
+            profile_name => :profile_name,
+            action => :action
+        )
+        FROM dual
+        """
+
+        logging.debug('Executing NL consult.')
+        nl_response = _select_ai(cursor, query, prompt, profile_name, action)
+        logging.info('NL consult done.')
+
+        logging.info('SQL query generated with success.')
+        return nl_response
+
+
+def _cached_generate(connection, prompt, action, profile_name, root):
+    scope = _sql_scope(connection, action, profile_name)
+    nl_response = None if scope is None else ANSWER_CACHE.get(prompt, scope)
+    if nl_response is not None:
+        logging.info('SQL query served from answer cache.')
+        root.set(cache='hit')
+        return nl_response
+
+    return _call_generate(connection, prompt, action, profile_name)
+
+
+def generate_sql(prompt, action, profile_name, connection=None):
+    with trace('askDB.generate_sql', action=action) as root:
+        if connection is not None:
+            return _cached_generate(
+                connection, prompt, action, profile_name, root
+            )
+
+        with acquire_connection() as connection:
+            return _cached_generate(
+                connection, prompt, action, profile_name, root
+            )
+
+
+def remember_sql(prompt, action, profile_name, nl_response, connection=None):
+    if connection is None:
+        with acquire_connection() as connection:
+            scope = _sql_scope(connection, action, profile_name)
+    else:
+        scope = _sql_scope(connection, action, profile_name)
+    if scope is not None:
+        ANSWER_CACHE.put(prompt, scope, nl_response)
 
-                logging.debug('Executing NL consult.')
-                cursor.execute(query, [prompt, profile_name, action])
-                nl_response = cursor.fetchone()[0]
-                logging.info('NL consult done.')
 
-                if isinstance(nl_response, oracledb.LOB):
-                    logging.debug('Response is type LOB.')
-                    nl_response = nl_response.read()
+def generate_query(prompt, action, profile_name):
+    try:
+        logging.info('Acquiring Oracle-ADB session from pool.')
+
+        with (
+            trace('askDB.generate_query', action=action),
+            acquire_connection() as connection,
+        ):
+            logging.info('Session acquired.')
+            nl_response = generate_sql(
+                prompt, action, profile_name, connection
+            )
+            df = generate_pandas_table(nl_response, connection)
 
-                logging.info('SQL query generated with success.')
-                df = generate_pandas_table(nl_response)
+            if df is not None:
+                remember_sql(
+                    prompt, action, profile_name, nl_response, connection
+                )
 
-                return nl_response, df
+            return nl_response, df
 
     except oracledb.Error as e:
         logging.error('Error in generating response: %s', e)
@@ -206,5 +461,8 @@ if __name__ == '__main__':
     logging.info('Resposta: %s', result)
 
     if df is not None:
-        generate_plot(PROFILE, df)
-        plt.show()
+        image = generate_plot(PROFILE, df)
+        if image:
+            with open('plot.png', 'wb') as f:
+                f.write(image)
+            logging.info('Plot salvo em plot.png.')
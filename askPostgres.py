@@ -1,13 +1,40 @@
 import logging
 import re
+import threading
+import time
+from collections import deque
 import pandas as pd
-from langchain_community.utilities import SQLDatabase
+from sqlalchemy import text
 from constants import (
     SQLALCHEMY_DATABASE_URI,
+    SPOTIFY_BACKEND,
     SPOTIFY_DATABASE_URI,
     PLOT_PROMPT,
+    PLOT_SPEC_PROMPT,
+    SQL_FAST_PATH,
+    STREAM_CHUNK_ROWS,
+    STREAM_MAX_ROWS,
+)
+from answer_cache import ANSWER_CACHE
+from arrow_fetch import read_postgres_frame
+from column_stats import start_stats_refresher
+from plot_cache import get_plot_code, put_plot_code, template_version
+from plot_spec import CHARTS, describe_columns, parse_plot_spec
+from prompt_context import frame_preview, schema_context
+from query_guard import guard_postgres_query, postgres_engine_args
+from query_log import record_query
+from result_cache import get_result, put_result
+from rollups import rewrite_query
+from schema_cache import database_key, get_schema_catalog
+from sql_validator import check_postgres_query
+from tracing import record_frame, span, start_span, trace
+from utils import (
+    get_llm_model,
+    get_sql_agent,
+    sql_system_message,
+    SQLHandler,
+    TracingHandler,
 )
-from utils import get_llm_model, my_sql_agent, SQLHandler
 
 
 logging.basicConfig(
@@ -17,38 +44,313 @@ logging.basicConfig(
 )
 
 
-# CHAMANDO O MODELO
-LLM = get_llm_model(OPENAI=True)
-logging.info(f'Tipo de LLM: {type(LLM)}')
+# LLM e bancos são criados sob demanda, na primeira vez que alguém os usa:
+# importar este módulo não abre conexões nem reflete schemas.
+_RESOURCES = {}
+_RESOURCES_LOCK = threading.Lock()
+_WARM_UP_THREAD = None
+
+
+def _resource(name, factory):
+    if name not in _RESOURCES:
+        with _RESOURCES_LOCK:
+            if name not in _RESOURCES:
+                _RESOURCES[name] = factory()
+    return _RESOURCES[name]
+
+
+def _create_llm():
+    # CHAMANDO O MODELO
+    llm = get_llm_model(OPENAI=True)
+    logging.info(f'Tipo de LLM: {type(llm)}')
+    return llm
+
+
+def _create_database(uri):
+    from langchain_community.utilities import SQLDatabase
+
+    return SQLDatabase.from_uri(
+        uri,
+        engine_args=postgres_engine_args(uri),
+        lazy_table_reflection=True,
+    )
+
+
+def get_llm():
+    return _resource('llm', _create_llm)
+
+
+def set_llm(llm):
+    # Troca o modelo usado por todas as funções deste módulo (benchmarks e
+    # testes manuais usam um modelo falso).
+    with _RESOURCES_LOCK:
+        _RESOURCES['llm'] = llm
+
 
 # DATABASES ACESSÍVEIS
-DB_MIGRATION = SQLDatabase.from_uri(SQLALCHEMY_DATABASE_URI)
-DB_SPOTIFY = SQLDatabase.from_uri(SPOTIFY_DATABASE_URI)
+def get_db_migration():
+    return _resource(
+        'db_migration', lambda: _create_database(SQLALCHEMY_DATABASE_URI)
+    )
+
+
+def _create_spotify_database():
+    if SPOTIFY_BACKEND == 'postgres':
+        return _create_database(SPOTIFY_DATABASE_URI)
+    # DuckDB/SQLite local montado a partir de spotify_data/: mesmo contrato
+    # de SQLDatabase, sem round-trip até o Postgres.
+    from embedded_db import create_embedded_database
+
+    return create_embedded_database(SPOTIFY_BACKEND)
+
+
+def get_db_spotify():
+    return _resource('db_spotify', _create_spotify_database)
 
 
-def ask_oci_genai(question: str):
+def __getattr__(name):
+    # Mantém LLM, DB_MIGRATION e DB_SPOTIFY acessíveis como antes.
+    getters = {
+        'LLM': get_llm,
+        'DB_MIGRATION': get_db_migration,
+        'DB_SPOTIFY': get_db_spotify,
+    }
+    if name in getters:
+        return getters[name]()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def _warm_up():
+    start = time.perf_counter()
+    databases = [
+        ('migration', get_db_migration, 'public'),
+        ('spotify', get_db_spotify, 'public'),
+    ]
     try:
-        llm_response = LLM.invoke(question)
+        llm = get_llm()
+        for name, get_db, schema in databases:
+            try:
+                db = get_db()
+                start_stats_refresher(db, schema)
+                get_sql_agent(llm, db, schema)
+            except Exception as e:
+                logging.warning(f'Warm-up do banco {name} falhou: {e}')
+
+        from plot_executor import warm_up as warm_up_plot_workers
+
+        warm_up_plot_workers()
+    except Exception as e:
+        logging.warning(f'Warm-up interrompido: {e}')
+    logging.info(f'Warm-up concluído em {time.perf_counter() - start:.2f}s.')
+
+
+def warm_up(background=True):
+    global _WARM_UP_THREAD
+    if not background:
+        _warm_up()
+        return None
+
+    with _RESOURCES_LOCK:
+        if _WARM_UP_THREAD is None:
+            _WARM_UP_THREAD = threading.Thread(
+                target=_warm_up, name='genbi-warm-up', daemon=True
+            )
+            _WARM_UP_THREAD.start()
+    return _WARM_UP_THREAD
+
+
+def ask_oci_genai(question: str, stream: bool = False, metrics=None):
+    """Com stream=True devolve um gerador de trechos da resposta; ao fim
+    dele, o dict metrics (se passado) recebe time_to_first_token,
+    total_latency e chunks, como em ask_postgres."""
+    if stream:
+        return _stream_oci_genai(question, metrics)
+
+    try:
+        with trace('ask_oci_genai', question_chars=len(question)):
+            llm_response = get_llm().invoke(
+                question, config={'callbacks': [TracingHandler()]}
+            )
         return llm_response
     except Exception as e:
         logging.error(f'Erro ao consultar GenAI: {e}')
         raise e
 
 
-def panda_table_from_query(query: str, db, schema: str = None):
+def _stream_oci_genai(question: str, metrics=None):
+    start = time.perf_counter()
+    first_token = None
+    chunks = 0
+    # Gerador: o span é aberto sem tocar no contexto, já que o consumidor
+    # roda entre um chunk e outro.
+    stream_span = start_span('llm.stream', question_chars=len(question))
     try:
-        if schema:
-            query = query.replace('FROM ', f'FROM {schema}.')
-        df = pd.read_sql(query, db._engine)
-        return df
+        for chunk in get_llm().stream(question):
+            if not chunk.content:
+                continue
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            chunks += 1
+            yield chunk.content
+    except Exception as e:
+        logging.error(f'Erro ao consultar GenAI: {e}')
+        raise e
+    finally:
+        total = time.perf_counter() - start
+        stream_span.set(
+            chunks=chunks,
+            time_to_first_token_ms=round(1000 * (first_token or total), 1),
+        )
+        stream_span.finish()
+        if metrics is not None:
+            metrics.update(
+                time_to_first_token=first_token,
+                total_latency=total,
+                chunks=chunks,
+            )
+        logging.info(
+            f'Streaming GenAI: primeiro token em '
+            f'{(first_token or total) * 1000:.0f}ms, '
+            f'total {total * 1000:.0f}ms.'
+        )
+
+
+def panda_table_from_query(
+    query: str, db, schema: str = None, ttl: int = None, use_cache=True
+):
+    with trace('panda_table_from_query', schema=schema) as root:
+        database = database_key(db)
+        if use_cache:
+            df = get_result(database, schema, query)
+            if df is not None:
+                logging.info('DataFrame servido pelo cache de resultados.')
+                root.set(cache='hit')
+                return df
+
+        try:
+            rewritten, rollup = rewrite_query(
+                db._engine, check_postgres_query(db, query, schema), schema
+            )
+            guarded, guard = guard_postgres_query(db._engine, rewritten)
+            start = time.perf_counter()
+            df = read_postgres_frame(db._engine, guarded)
+            _log_query(
+                db, schema, guarded, start, len(df), 'panda_table_from_query'
+            )
+            # Quem exibe a resposta informa se ela veio de um rollup ou foi
+            # limitada pela guarda; o cache de resultados guarda as duas
+            # informações junto com o frame.
+            df.attrs.update(rollup=rollup, guard=guard)
+            if use_cache:
+                put_result(database, schema, query, df, ttl=ttl)
+            root.set(rollup=rollup)
+            record_frame(root, df)
+            return df
+        except Exception as e:
+            logging.error(f'Erro ao executar a query SQL: {e}')
+            raise e
+
+
+def table_chunks_from_query(
+    query: str,
+    db,
+    schema: str = None,
+    chunk_size: int = STREAM_CHUNK_ROWS,
+    max_rows: int = STREAM_MAX_ROWS,
+):
+    database = database_key(db)
+    df = get_result(database, schema, query)
+    if df is not None:
+        logging.info('DataFrame servido pelo cache de resultados.')
+        for start in range(0, min(len(df), max_rows), chunk_size):
+            yield df.iloc[start : min(start + chunk_size, max_rows)]
+        return
+
+    chunks = []
+    rows = 0
+    truncated = False
+    rollup = None
+    guard = None
+    stream_span = start_span('sql.stream', schema=schema)
+    try:
+        rewritten, rollup = rewrite_query(
+            db._engine, check_postgres_query(db, query, schema), schema
+        )
+        guarded, guard = guard_postgres_query(db._engine, rewritten)
+        start = time.perf_counter()
+        # stream_results usa um cursor nomeado (server-side) no psycopg2:
+        # o Postgres entrega as linhas aos poucos em vez de materializar
+        # o resultado inteiro na memória do cliente.
+        with db._engine.connect().execution_options(
+            stream_results=True, max_row_buffer=chunk_size
+        ) as conn:
+            result = conn.execute(text(guarded))
+            columns = list(result.keys())
+            for partition in result.partitions(chunk_size):
+                if rows + len(partition) > max_rows:
+                    partition = partition[: max_rows - rows]
+                    truncated = True
+                chunk = pd.DataFrame.from_records(
+                    partition,
+                    columns=columns,
+                    index=range(rows, rows + len(partition)),
+                )
+                chunk.attrs.update(rollup=rollup, guard=guard)
+                rows += len(chunk)
+                chunks.append(chunk)
+                yield chunk
+                if rows >= max_rows:
+                    # Uma linha além do limite decide se o resultado foi
+                    # mesmo cortado ou tinha exatamente max_rows linhas.
+                    truncated = truncated or result.fetchone() is not None
+                    break
+            if not rows:
+                chunk = pd.DataFrame(columns=columns)
+                chunk.attrs.update(rollup=rollup, guard=guard)
+                yield chunk
     except Exception as e:
         logging.error(f'Erro ao executar a query SQL: {e}')
         raise e
+    finally:
+        stream_span.set(rows=rows, truncated=truncated, rollup=rollup)
+        stream_span.finish()
+
+    _log_query(db, schema, guarded, start, rows, 'table_chunks_from_query')
+    if truncated:
+        logging.warning(f'Resultado truncado em {max_rows} linhas.')
+    elif chunks:
+        df = pd.concat(chunks)
+        df.attrs.update(rollup=rollup, guard=guard)
+        put_result(database, schema, query, df)
+
+
+def _log_query(db, schema, query, start, rows, source):
+    record_query(
+        database_key(db),
+        db._engine.dialect.name,
+        query,
+        latency_ms=1000 * (time.perf_counter() - start),
+        rows=rows,
+        source=source,
+        schema=schema,
+    )
 
 
 def plot_code_from_genai(df: pd.DataFrame):
+    with trace('plot_code_from_genai') as root:
+        return _plot_code_from_genai(df, root)
+
+
+def _plot_code_from_genai(df, root):
+    scope = ('genai', template_version(PLOT_PROMPT))
+    modified_code = get_plot_code(df, scope)
+    if modified_code is not None:
+        logging.info('Código de plotagem servido pelo cache.')
+        root.set(cache='hit')
+        return modified_code
+
     try:
-        head = df.head(10).to_string(index=False)
+        head = frame_preview(df, rows=10, index=False)
         PLOT_LIST = [
             'histogram',
             'lineplot',
@@ -58,10 +360,12 @@ def plot_code_from_genai(df: pd.DataFrame):
         ]
 
         prompt = PLOT_PROMPT.format(df_head=head, plots=PLOT_LIST)
-        logging.info(f'O prompt passado à LLM: {prompt}')
+        logging.debug(f'O prompt passado à LLM: {prompt}')
 
-        response = LLM.invoke(prompt)
-        logging.info(f'A resposta da LLM: {response}')
+        response = get_llm().invoke(
+            prompt, config={'callbacks': [TracingHandler()]}
+        )
+        logging.debug(f'A resposta da LLM: {response}')
 
         if response:
             python_code = re.search(
@@ -81,6 +385,7 @@ def plot_code_from_genai(df: pd.DataFrame):
                 )
                 # modified_code = modified_code.replace("plt.show()", "")
                 logging.debug('Modified code to execute:\n%s', modified_code)
+                put_plot_code(df, scope, modified_code)
 
         return modified_code
     except Exception as e:
@@ -88,18 +393,197 @@ def plot_code_from_genai(df: pd.DataFrame):
         raise e
 
 
-def ask_postgres(question: str, db, schema='public'):
+def plot_spec_from_genai(df: pd.DataFrame):
+    with trace('plot_spec_from_genai') as root:
+        return _plot_spec_from_genai(df, root)
+
+
+def _plot_spec_from_genai(df, root):
+    scope = ('genai-spec', template_version(PLOT_SPEC_PROMPT))
+    spec = get_plot_code(df, scope)
+    if spec is not None:
+        logging.info('Spec de plotagem servida pelo cache.')
+        root.set(cache='hit')
+        return spec
+
+    try:
+        prompt = PLOT_SPEC_PROMPT.format(
+            columns=describe_columns(df),
+            df_head=frame_preview(df, rows=5, index=False),
+            charts=CHARTS,
+        )
+        response = get_llm().invoke(
+            prompt, config={'callbacks': [TracingHandler()]}
+        )
+        logging.debug(f'A resposta da LLM: {response}')
+
+        spec = parse_plot_spec(response.content, df)
+        put_plot_code(df, scope, spec)
+        return spec
+    except ValueError as e:
+        logging.error(f'Spec de plotagem inválida: {e}')
+        return None
+    except Exception as e:
+        logging.error(f'Erro ao gerar spec de plotagem: {e}')
+        raise e
+
+
+ASK_METRICS = deque(maxlen=100)
+
+
+def ask_postgres(
+    question: str,
+    db,
+    schema='public',
+    fast_path=SQL_FAST_PATH,
+    metrics: dict = None,
+):
+    """Devolve (resposta, query). `metrics`, se passado, recebe o caminho
+    usado (cache, fast ou agent), as chamadas ao LLM e a latência total."""
+    with trace('ask_postgres', schema=schema) as root:
+        return _ask_postgres(question, db, schema, root, fast_path, metrics)
+
+
+def _finish_ask(root, metrics, path, llm_calls, start, fallback=False):
+    entry = dict(
+        path=path,
+        llm_calls=llm_calls,
+        latency_ms=round(1000 * (time.perf_counter() - start), 3),
+        fallback=fallback,
+    )
+    ASK_METRICS.append(entry)
+    root.set(**entry)
+    if metrics is not None:
+        metrics.update(entry)
+    logging.info(
+        f'Pergunta respondida pelo caminho {path} com {llm_calls} chamadas '
+        f'ao LLM em {entry["latency_ms"]:.0f}ms.'
+    )
+
+
+def ask_metrics_summary():
+    """{caminho: perguntas, média de chamadas ao LLM e p50 de latência}
+    das últimas perguntas."""
+    summary = {}
+    for path in ('cache', 'fast', 'agent'):
+        entries = [e for e in ASK_METRICS if e['path'] == path]
+        if not entries:
+            continue
+        latencies = sorted(e['latency_ms'] for e in entries)
+        summary[path] = dict(
+            questions=len(entries),
+            avg_llm_calls=sum(e['llm_calls'] for e in entries) / len(entries),
+            p50_ms=latencies[len(latencies) // 2],
+        )
+    return summary
+
+
+def _extract_sql(text):
+    """SQL da resposta do LLM, sem cercas de markdown; None quando a
+    resposta não é uma única consulta."""
+    match = re.search(r'```(?:sql)?\s*(.*?)```', text, re.DOTALL | re.I)
+    if match:
+        text = match.group(1)
+    query = text.strip().rstrip(';').strip()
+    if not re.match(r'(select|with)\b', query, re.I) or ';' in query:
+        return None
+    return query
+
+
+def _describe_result(df):
+    # Sem a volta final do agente não há explicação do LLM: a resposta é
+    # uma amostra do próprio resultado.
+    if df.empty:
+        return 'The query returned no rows.'
+    preview = frame_preview(df, rows=10, index=False)
+    return f'{len(df)} rows returned.\n\n```\n{preview}\n```'
+
+
+def _fast_path(question, db, schema):
+    """Uma chamada ao LLM com o mesmo prompt do agente e execução direta da
+    SQL; devolve ((resposta, query) ou None para o agente assumir, chamadas
+    ao LLM)."""
+    from langchain_core.messages import HumanMessage
+
+    with span('sql.fast_path') as fast_span:
+        tracer = TracingHandler()
+        try:
+            table_info, _ = schema_context(db, schema, question)
+            response = get_llm().invoke(
+                [
+                    sql_system_message(schema, table_info),
+                    HumanMessage(content=question),
+                ],
+                config={'callbacks': [tracer]},
+            )
+            query = _extract_sql(response.content)
+            if query is None:
+                logging.info('Caminho rápido sem SQL, usando o agente.')
+                fast_span.set(outcome='no_sql')
+                return None, tracer.llm_calls
+            # Executa pelo mesmo caminho do app: o "Show DataFrame" seguinte
+            # sai do cache de resultados.
+            df = panda_table_from_query(query, db, schema)
+            answer = _describe_result(df)
+        except Exception as e:
+            logging.warning(f'Caminho rápido falhou, usando o agente: {e}')
+            fast_span.set(outcome='error', error=type(e).__name__)
+            return None, tracer.llm_calls
+        fast_span.set(outcome='ok', rows=len(df))
+    return (answer, query), tracer.llm_calls
+
+
+def _ask_postgres(question, db, schema, root, fast_path, metrics):
+    start = time.perf_counter()
     handler = SQLHandler()
+    llm_calls = 0
     logging.info(f'Consultando SQL agent com a pergunta: {question}')
-    SQL_AGENT = my_sql_agent(LLM, db, schema)
+    start_stats_refresher(db, schema)
+
+    fingerprint = get_schema_catalog(db, schema)['fingerprint']
+    scope = (database_key(db), schema, fingerprint)
+    cached = ANSWER_CACHE.get(question, scope)
+    if cached is not None:
+        logging.info('Resposta servida pelo cache de perguntas.')
+        root.set(cache='hit')
+        _finish_ask(root, metrics, 'cache', 0, start)
+        return cached
+
+    if fast_path:
+        answer, llm_calls = _fast_path(question, db, schema)
+        if answer is not None:
+            ANSWER_CACHE.put(question, scope, answer)
+            _finish_ask(root, metrics, 'fast', llm_calls, start)
+            return answer
+
+    SQL_AGENT = get_sql_agent(get_llm(), db, schema, question)
 
     try:
         # agent_response = SQL_AGENT.invoke(question, return_query=True, callbacks=[handler])
-        agent_response = SQL_AGENT.run(
-            {'input': question}, callbacks=[handler]
-        )
+        with span('agent.run'):
+            tracer = TracingHandler()
+            agent_response = SQL_AGENT.run(
+                {'input': question}, callbacks=[handler, tracer]
+            )
+        llm_calls += tracer.llm_calls
         sql_queries = handler.sql_result[-1]
+        for execution in handler.executions:
+            record_query(
+                database_key(db),
+                db._engine.dialect.name,
+                execution['query'],
+                latency_ms=execution['latency_ms'],
+                source='ask_postgres',
+                schema=schema,
+                error=execution['error'],
+            )
 
+        ANSWER_CACHE.put(
+            question, scope, (agent_response, sql_queries['query'])
+        )
+        _finish_ask(
+            root, metrics, 'agent', llm_calls, start, fallback=fast_path
+        )
         return agent_response, sql_queries['query']
 
     except Exception as e:
@@ -111,7 +595,7 @@ if __name__ == '__main__':
     try:
         response_data, sql_queries = ask_postgres(
             'mostre os artistas por streams diárias com menos colaborações, i.e., as_features',
-            DB_SPOTIFY,
+            get_db_spotify(),
             'public'
         )
         print('Resposta: ', response_data)
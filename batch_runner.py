@@ -0,0 +1,481 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from constants import (
+    BATCH_CONCURRENCY,
+    BATCH_OPENAI_RPM,
+    BATCH_SELECT_AI_RPM,
+)
+
+
+# Colunas de cada registro de saída, na ordem do JSONL e do Parquet.
+RECORD_FIELDS = (
+    ('id', 'string'),
+    ('question', 'string'),
+    ('backend', 'string'),
+    ('database', 'string'),
+    ('schema', 'string'),
+    ('status', 'string'),
+    ('answer', 'string'),
+    ('sql', 'string'),
+    ('path', 'string'),
+    ('llm_calls', 'int64'),
+    ('rows', 'int64'),
+    ('columns', 'string'),
+    ('rollup', 'string'),
+    ('plot', 'string'),
+    ('error', 'string'),
+    ('trace_id', 'string'),
+    ('started_at', 'float64'),
+    ('generate_ms', 'float64'),
+    ('fetch_ms', 'float64'),
+    ('plot_ms', 'float64'),
+    ('total_ms', 'float64'),
+)
+
+PROVIDER_RPM = {
+    'openai': BATCH_OPENAI_RPM,
+    'select-ai': BATCH_SELECT_AI_RPM,
+}
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+# ------------------------------------------------------------------------
+# Limite de chamadas por provedor
+# ------------------------------------------------------------------------
+
+
+def get_rate_limiter(provider):
+    """Limitador compartilhado por todas as perguntas que usam o provedor,
+    ou None quando o provedor não tem limite configurado."""
+    from langchain_core.rate_limiters import InMemoryRateLimiter
+
+    rpm = PROVIDER_RPM.get(provider)
+    if not rpm:
+        return None
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(provider)
+        if limiter is None:
+            limiter = _LIMITERS[provider] = InMemoryRateLimiter(
+                requests_per_second=rpm / 60,
+                check_every_n_seconds=0.05,
+                max_bucket_size=1,
+            )
+    return limiter
+
+
+def _limit_llm(llm, provider):
+    # O rate_limiter do modelo é consultado a cada chamada, então vale também
+    # para os vários passos do agente de uma mesma pergunta.
+    limiter = get_rate_limiter(provider)
+    if limiter is not None and getattr(llm, 'rate_limiter', None) is None:
+        llm.rate_limiter = limiter
+
+
+def _wait_for(provider):
+    limiter = get_rate_limiter(provider)
+    if limiter is not None:
+        limiter.acquire(blocking=True)
+
+
+# ------------------------------------------------------------------------
+# Pipeline de uma pergunta
+# ------------------------------------------------------------------------
+
+
+def _new_record(item, backend, database, schema):
+    record = dict.fromkeys(name for name, _ in RECORD_FIELDS)
+    record.update(
+        id=str(item['id']),
+        question=item['question'],
+        backend=backend,
+        database=database,
+        schema=schema,
+        started_at=time.time(),
+    )
+    return record
+
+
+def _elapsed_ms(start):
+    return round(1000 * (time.perf_counter() - start), 3)
+
+
+def _save_plot(image, plots_dir, record):
+    if not image:
+        return
+    os.makedirs(plots_dir, exist_ok=True)
+    path = os.path.join(plots_dir, f'{record["id"]}.png')
+    with open(path, 'wb') as f:
+        f.write(image)
+    record['plot'] = path
+
+
+def _postgres_plot(df):
+    from askPostgres import plot_code_from_genai, plot_spec_from_genai
+    from constants import PLOT_MODE
+
+    if PLOT_MODE == 'spec':
+        from plot_spec import render_plot_spec_png
+
+        spec = plot_spec_from_genai(df)
+        return render_plot_spec_png(df, spec) if spec else None
+
+    from plot_executor import render_plot
+
+    code = plot_code_from_genai(df)
+    return render_plot(code, df) if code else None
+
+
+def _run_postgres(record, db, plots_dir):
+    from askPostgres import ask_postgres, panda_table_from_query
+
+    start = time.perf_counter()
+    metrics = {}
+    answer, query = ask_postgres(
+        record['question'], db, record['schema'], metrics=metrics
+    )
+    record.update(
+        answer=answer,
+        sql=query,
+        path=metrics.get('path'),
+        llm_calls=metrics.get('llm_calls'),
+        generate_ms=_elapsed_ms(start),
+    )
+
+    start = time.perf_counter()
+    df = panda_table_from_query(query, db, record['schema'])
+    record['fetch_ms'] = _elapsed_ms(start)
+    if plots_dir is not None and df is not None and not df.empty:
+        start = time.perf_counter()
+        _save_plot(_postgres_plot(df), plots_dir, record)
+        record['plot_ms'] = _elapsed_ms(start)
+    return df
+
+
+def _run_oracle(record, plots_dir):
+    import askDB
+    from constants import ACTIONS, PROFILE
+    from oracle_pool import acquire_connection
+
+    with acquire_connection() as connection:
+        start = time.perf_counter()
+        _wait_for('select-ai')
+        query = askDB.generate_sql(
+            record['question'], ACTIONS[0], PROFILE, connection
+        )
+        record.update(sql=query, generate_ms=_elapsed_ms(start))
+        if not query:
+            raise RuntimeError('Select AI não gerou SQL.')
+
+        start = time.perf_counter()
+        df = askDB.generate_pandas_table(query, connection)
+        record['fetch_ms'] = _elapsed_ms(start)
+        if df is None:
+            raise RuntimeError('A query gerada falhou ou foi recusada.')
+        askDB.remember_sql(
+            record['question'], ACTIONS[0], PROFILE, query, connection
+        )
+
+    if plots_dir is not None and not df.empty:
+        start = time.perf_counter()
+        _wait_for('select-ai')
+        _save_plot(askDB.generate_plot(PROFILE, df), plots_dir, record)
+        record['plot_ms'] = _elapsed_ms(start)
+    return df
+
+
+def run_question(item, backend, database, schema, db=None, plots_dir=None):
+    """Roda uma pergunta pelo pipeline e devolve o registro de saída; erros
+    viram status='error' em vez de interromper o lote."""
+    from query_guard import QueryRejected
+    from sql_validator import InvalidQuery
+    from tracing import trace
+
+    record = _new_record(item, backend, database, schema)
+    start = time.perf_counter()
+    with trace('batch.question', backend=backend) as root:
+        if root.trace is not None:
+            record['trace_id'] = root.trace.trace_id
+        try:
+            if backend == 'oracle':
+                df = _run_oracle(record, plots_dir)
+            else:
+                df = _run_postgres(record, db, plots_dir)
+            record.update(
+                status='ok',
+                rows=len(df),
+                columns=','.join(map(str, df.columns)),
+                rollup=df.attrs.get('rollup'),
+            )
+        except (QueryRejected, InvalidQuery) as e:
+            record.update(status='rejected', error=str(e))
+        except Exception as e:
+            logging.error(f'Erro na pergunta {record["id"]}: {e}')
+            record.update(status='error', error=f'{type(e).__name__}: {e}')
+        root.set(status=record['status'])
+    record['total_ms'] = _elapsed_ms(start)
+    return record
+
+
+# ------------------------------------------------------------------------
+# Lote
+# ------------------------------------------------------------------------
+
+
+def read_questions(path):
+    """Lê o JSONL de entrada: {"question": ...} com "id" opcional (o número
+    da linha é usado quando falta)."""
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {'question': item}
+            item.setdefault('id', number)
+            yield item
+
+
+def _postgres_database(database, db=None):
+    import askPostgres
+
+    _limit_llm(askPostgres.get_llm(), 'openai')
+    if db is not None:
+        return db
+    getters = {
+        'spotify': askPostgres.get_db_spotify,
+        'migration': askPostgres.get_db_migration,
+    }
+    if database not in getters:
+        raise ValueError(
+            f'Banco desconhecido: {database} (use {", ".join(getters)}).'
+        )
+    return getters[database]()
+
+
+def run_batch(
+    questions,
+    backend='postgres',
+    database='spotify',
+    schema='public',
+    concurrency=BATCH_CONCURRENCY,
+    plots_dir=None,
+    db=None,
+):
+    """Gera um registro por pergunta, na ordem em que terminam.
+
+    No máximo `concurrency` perguntas rodam ao mesmo tempo, todas com o
+    mesmo LLM, os mesmos pools de conexão e os mesmos caches locais; a fila
+    de entrada é lida aos poucos, então o arquivo pode ser grande. `db` usa
+    um SQLDatabase já aberto no lugar de `database`.
+    """
+    if backend == 'postgres':
+        db = _postgres_database(database, db)
+    elif backend != 'oracle':
+        raise ValueError(f'Backend desconhecido: {backend}.')
+
+    questions = iter(questions)
+    concurrency = max(1, concurrency)
+    with ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix='genbi-batch'
+    ) as executor:
+        pending = set()
+
+        def submit_next():
+            item = next(questions, None)
+            if item is None:
+                return False
+            pending.add(
+                executor.submit(
+                    run_question, item, backend, database, schema, db,
+                    plots_dir,
+                )
+            )
+            return True
+
+        while len(pending) < concurrency and submit_next():
+            pass
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                submit_next()
+                yield future.result()
+
+
+# ------------------------------------------------------------------------
+# Saída
+# ------------------------------------------------------------------------
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """Grava os registros em row groups de `batch_size` (pyarrow opcional,
+    como no arrow_fetch)."""
+
+    def __init__(self, path, batch_size=100):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError(
+                'Saída Parquet requer pyarrow (pip install .[arrow]).'
+            ) from e
+
+        self._pa = pa
+        self._schema = pa.schema(
+            [pa.field(name, pa.type_for_alias(kind)) for name, kind in RECORD_FIELDS]
+        )
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._batch = []
+        self._batch_size = batch_size
+
+    def write(self, record):
+        self._batch.append(record)
+        if len(self._batch) >= self._batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._batch:
+            self._writer.write_table(
+                self._pa.Table.from_pylist(self._batch, schema=self._schema)
+            )
+            self._batch = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def open_writer(path):
+    if path.endswith('.parquet'):
+        return ParquetWriter(path)
+    return JsonlWriter(path)
+
+
+def summarize(records):
+    statuses = {}
+    for record in records:
+        statuses[record['status']] = statuses.get(record['status'], 0) + 1
+    return statuses
+
+
+def summarize_paths(records):
+    """{caminho do ask_postgres: perguntas, média de chamadas ao LLM e de
+    tempo de geração}."""
+    paths = {}
+    for record in records:
+        if record.get('path') is None:
+            continue
+        entry = paths.setdefault(
+            record['path'], dict(questions=0, llm_calls=0, generate_ms=0.0)
+        )
+        entry['questions'] += 1
+        entry['llm_calls'] += record['llm_calls'] or 0
+        entry['generate_ms'] += record['generate_ms'] or 0.0
+    return {
+        path: dict(
+            questions=entry['questions'],
+            avg_llm_calls=round(entry['llm_calls'] / entry['questions'], 2),
+            avg_generate_ms=round(
+                entry['generate_ms'] / entry['questions'], 1
+            ),
+        )
+        for path, entry in paths.items()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Roda um JSONL de perguntas pelo pipeline NL -> SQL -> '
+        'DataFrame (-> plot) e grava os resultados em JSONL ou Parquet.',
+        epilog='Para testar mudanças de prompt sem respostas em cache, '
+        'aponte GENBI_CACHE_DIR para um diretório vazio.',
+    )
+    parser.add_argument('questions', help='JSONL com {"id", "question"}')
+    parser.add_argument(
+        '-o', '--output', required=True, help='arquivo .jsonl ou .parquet'
+    )
+    parser.add_argument(
+        '--backend', choices=('postgres', 'oracle'), default='postgres'
+    )
+    parser.add_argument(
+        '--database',
+        default='spotify',
+        help='banco Postgres: spotify ou migration (ignorado no oracle)',
+    )
+    parser.add_argument('--schema', default='public')
+    parser.add_argument(
+        '-j', '--concurrency', type=int, default=BATCH_CONCURRENCY
+    )
+    parser.add_argument(
+        '--plots', metavar='DIR', help='gera os gráficos e salva PNGs em DIR'
+    )
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    records = []
+    writer = open_writer(args.output)
+    try:
+        for record in run_batch(
+            read_questions(args.questions),
+            backend=args.backend,
+            database=args.database,
+            schema=args.schema,
+            concurrency=args.concurrency,
+            plots_dir=args.plots,
+        ):
+            writer.write(record)
+            records.append(
+                {
+                    key: record[key]
+                    for key in (
+                        'id', 'status', 'path', 'llm_calls', 'generate_ms'
+                    )
+                }
+            )
+            logging.info(
+                f'Pergunta {record["id"]}: {record["status"]} '
+                f'em {record["total_ms"]:.0f}ms.'
+            )
+    finally:
+        writer.close()
+
+    logging.info(
+        f'{len(records)} perguntas em {time.perf_counter() - start:.1f}s: '
+        f'{summarize(records)}. Resultados em {args.output}.'
+    )
+    for path, entry in summarize_paths(records).items():
+        logging.info(
+            f'Caminho {path}: {entry["questions"]} perguntas, '
+            f'{entry["avg_llm_calls"]} chamadas ao LLM e '
+            f'{entry["avg_generate_ms"]:.0f}ms de geração em média.'
+        )
+    return 0 if all(r['status'] == 'ok' for r in records) else 1
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+    )
+    raise SystemExit(main())
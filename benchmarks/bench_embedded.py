@@ -0,0 +1,130 @@
+# Compara o caminho do Postgres com os bancos embarcados (DuckDB e SQLite)
+# nas mesmas queries, medidas por panda_table_from_query (guarda de custo,
+# leitura e montagem do DataFrame) com o cache de resultados desligado.
+#
+# O Postgres entra quando há SPOTIFY_DB_URI (ou --uri). --scale replica as
+# linhas dos arquivos de spotify_data/ N vezes antes de montar os bancos
+# embarcados, para medir volumes de milhões de linhas.
+#
+# Uso (a partir da raiz do repositório):
+#     python -m benchmarks.bench_embedded -n 20
+#     python -m benchmarks.bench_embedded --scale 1000 --backends duckdb sqlite
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault('GENBI_CACHE_DIR', tempfile.mkdtemp(prefix='genbi_'))
+os.environ.setdefault('GENBI_TRACE_EXPORT', 'none')
+os.environ.setdefault('COLUMN_STATS_REFRESH', '0')
+os.environ.setdefault('GENBI_QUERY_LOG', '0')
+os.environ.setdefault('GENBI_ROLLUPS', '0')
+
+import pandas as pd
+
+from benchmarks.bench_pipeline import percentile
+
+QUERIES = {
+    'scan': 'SELECT * FROM listeners',
+    'top_n': (
+        'SELECT "Artist", "Streams", "Daily" FROM artists '
+        'ORDER BY "Daily" DESC LIMIT 20'
+    ),
+    'group_by': (
+        'SELECT "Peak", COUNT(*) AS artists, AVG("Listeners") AS listeners '
+        'FROM listeners GROUP BY "Peak" ORDER BY artists DESC LIMIT 50'
+    ),
+    'filter_agg': (
+        'SELECT SUM("Streams") AS streams, MAX("Daily") AS daily '
+        'FROM most_streamed WHERE "Streams" > 1000000000'
+    ),
+}
+
+
+def scaled_data_dir(scale):
+    from embedded_db import SOURCES, find_sources
+
+    target = tempfile.mkdtemp(prefix='spotify_scaled_')
+    for table, source in find_sources().items():
+        if source.endswith('.parquet'):
+            df = pd.read_parquet(source)
+        else:
+            df = pd.read_csv(source, thousands=',')
+        df = pd.concat([df] * scale, ignore_index=True)
+        # Grava com o nome preferido da tabela (o primeiro candidato).
+        name = SOURCES[table][0]
+        if name.endswith('.parquet'):
+            df.to_parquet(os.path.join(target, name), index=False)
+        else:
+            df.to_csv(os.path.join(target, name), index=False)
+    return target
+
+
+def open_backend(backend, uri, data_dir):
+    import askPostgres
+    from embedded_db import create_embedded_database
+
+    start = time.perf_counter()
+    if backend == 'postgres':
+        db = askPostgres._create_database(uri)
+    else:
+        db = create_embedded_database(backend, data_dir)
+    return db, time.perf_counter() - start
+
+
+def measure(db, query, repeat):
+    from askPostgres import panda_table_from_query
+
+    panda_table_from_query(query, db, 'public', use_cache=False)
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = panda_table_from_query(query, db, 'public', use_cache=False)
+        timings.append(time.perf_counter() - start)
+        rows = len(df)
+    return dict(
+        rows=rows,
+        p50_ms=round(1000 * percentile(timings, 0.5), 2),
+        p95_ms=round(1000 * percentile(timings, 0.95), 2),
+    )
+
+
+if __name__ == '__main__':
+    from constants import SPOTIFY_DATA_DIR, SPOTIFY_DATABASE_URI
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--backends', nargs='+', default=['postgres', 'duckdb', 'sqlite'],
+        choices=['postgres', 'duckdb', 'sqlite'],
+    )
+    parser.add_argument('--uri', default=SPOTIFY_DATABASE_URI)
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('-n', '--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    backends = list(args.backends)
+    if 'postgres' in backends and not args.uri:
+        print('postgres ignorado: defina SPOTIFY_DB_URI ou use --uri.')
+        backends.remove('postgres')
+
+    data_dir = SPOTIFY_DATA_DIR
+    if args.scale > 1:
+        data_dir = scaled_data_dir(args.scale)
+
+    results = {}
+    for backend in backends:
+        db, seconds = open_backend(backend, args.uri, data_dir)
+        # Para os embarcados inclui a montagem do arquivo a partir dos dados.
+        print(f'{backend:<9} aberto em {1000 * seconds:8.1f}ms')
+        for name, query in QUERIES.items():
+            results[name, backend] = measure(db, query, args.repeat)
+
+    print(f'\n{"query":<12}{"backend":<10}{"rows":>9}{"p50":>11}{"p95":>11}')
+    for name in QUERIES:
+        for backend in backends:
+            r = results[name, backend]
+            print(
+                f'{name:<12}{backend:<10}{r["rows"]:>9}'
+                f'{r["p50_ms"]:>9.2f}ms{r["p95_ms"]:>9.2f}ms'
+            )
@@ -0,0 +1,127 @@
+# Compara a leitura linha a linha (pd.read_sql / cursor.fetchall) com a
+# leitura colunar via Arrow, em tempo e pico de memória alocada.
+#
+# O tracemalloc só enxerga o heap do Python: os buffers do Arrow (C++) são
+# medidos num memory pool próprio e o pico de RSS (amostrado em paralelo)
+# cobre o que nenhum dos dois vê, como os buffers do oracledb.
+#
+# Uso (a partir da raiz do repositório):
+#     python -m benchmarks.bench_fetch --query "SELECT * FROM artists"
+#     python -m benchmarks.bench_fetch --oracle --query "SELECT * FROM migration"
+import argparse
+import os
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import create_engine
+
+from arrow_fetch import fetch_oracle_frame, fetch_postgres_frame
+from constants import SPOTIFY_DATABASE_URI
+
+
+def _rss():
+    # Só Linux; em outros sistemas o pico de RSS fica de fora.
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None
+
+
+class RSSPeak:
+    """Amostra o RSS do processo a cada `interval` s enquanto ativo."""
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak = self.start = _rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss())
+
+    def __enter__(self):
+        if self.start is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, _rss())
+
+    @property
+    def growth(self):
+        return None if self.start is None else self.peak - self.start
+
+
+def measure_memory(fn):
+    """(pico do heap Python, pico do Arrow, pico de crescimento do RSS) de
+    uma chamada, numa rodada à parte: a instrumentação distorce o tempo."""
+    default_pool = pa.default_memory_pool()
+    pool = pa.proxy_memory_pool(default_pool)
+    pa.set_memory_pool(pool)
+    tracemalloc.start()
+    try:
+        with RSSPeak() as rss:
+            df = fn()
+        python_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        pa.set_memory_pool(default_pool)
+    del df
+    return python_peak, pool.max_memory(), rss.growth
+
+
+def measure(name, fn, repeat):
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = fn()
+        timings.append(time.perf_counter() - start)
+        rows = len(df)
+        del df
+    python_peak, arrow_peak, rss_peak = measure_memory(fn)
+    rss = f'{rss_peak / 2**20:8.1f}MiB' if rss_peak is not None else 'n/a'
+    print(
+        f'{name:<8} rows={rows:<9} best={1000 * min(timings):9.1f}ms '
+        f'python={python_peak / 2**20:8.1f}MiB '
+        f'arrow={arrow_peak / 2**20:8.1f}MiB rss={rss}'
+    )
+
+
+def bench_postgres(uri, query, repeat):
+    engine = create_engine(uri)
+    measure('rows', lambda: pd.read_sql(query, engine), repeat)
+    measure('arrow', lambda: fetch_postgres_frame(engine, query), repeat)
+
+
+def bench_oracle(query, repeat):
+    from askDB import _fetch_rows_table
+    from oracle_pool import acquire_connection
+
+    with acquire_connection() as connection:
+        measure('rows', lambda: _fetch_rows_table(connection, query), repeat)
+        measure(
+            'arrow', lambda: fetch_oracle_frame(connection, query), repeat
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--query', required=True)
+    parser.add_argument('--uri', default=SPOTIFY_DATABASE_URI)
+    parser.add_argument('--oracle', action='store_true')
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.oracle:
+        bench_oracle(args.query, args.repeat)
+    else:
+        bench_postgres(args.uri, args.query, args.repeat)
@@ -0,0 +1,62 @@
+# Mede o tempo de import a frio dos módulos do app, cada um num
+# interpretador novo, e lista os imports mais caros (python -X importtime).
+#
+# Uso (a partir da raiz do repositório):
+#     python -m benchmarks.bench_import -n 5
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+MODULES = ['constants', 'utils', 'askDB', 'askPostgres']
+
+
+def import_seconds(module):
+    code = (
+        'import time; start = time.perf_counter(); '
+        f'import {module}; print(time.perf_counter() - start)'
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(module, top):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, self_us, cumulative_us, name = line.replace(':', '|', 1).split('|')
+        # Só as dependências diretas do módulo (um nível de indentação
+        # abaixo dele), para não contar o mesmo custo duas vezes.
+        if len(name) - len(name.lstrip()) == 3:
+            rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5)
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        timings = [import_seconds(module) for _ in range(args.repeat)]
+        print(
+            f'{module:<12} median={1000 * statistics.median(timings):8.1f}ms '
+            f'min={1000 * min(timings):8.1f}ms'
+        )
+        for cumulative_us, name in slowest_imports(module, args.top):
+            print(f'    {cumulative_us / 1000:8.1f}ms  {name}')
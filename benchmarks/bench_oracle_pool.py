@@ -0,0 +1,69 @@
+# Compara o custo de abrir uma conexão Oracle-ADB por chamada (wallet + TLS)
+# com o de pegar uma sessão do pool compartilhado.
+#
+# Uso (a partir da raiz do repositório, com ./config e o .env configurados):
+#     python -m benchmarks.bench_oracle_pool -n 20
+import argparse
+import statistics
+import time
+
+import oracledb
+from oracle_pool import (
+    acquire_connection,
+    close_pool,
+    connect_params,
+    get_pool,
+    pool_stats,
+)
+
+
+PROBE_QUERY = 'SELECT 1 FROM dual'
+
+
+def _probe(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(PROBE_QUERY)
+        cursor.fetchone()
+
+
+def bench_connect(iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        with oracledb.connect(**connect_params()) as connection:
+            _probe(connection)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_pool(iterations):
+    get_pool()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        with acquire_connection() as connection:
+            _probe(connection)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(name, timings):
+    ordered = sorted(timings)
+    p95 = ordered[max(0, int(round(0.95 * len(ordered))) - 1)]
+    print(
+        f'{name:<10} n={len(ordered):<4} '
+        f'mean={1000 * statistics.mean(ordered):8.1f}ms '
+        f'p50={1000 * statistics.median(ordered):8.1f}ms '
+        f'p95={1000 * p95:8.1f}ms'
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    summarize('connect', bench_connect(args.iterations))
+    summarize('pool', bench_pool(args.iterations))
+    print('pool stats:', pool_stats())
+    close_pool()
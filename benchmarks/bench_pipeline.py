@@ -0,0 +1,205 @@
+# Benchmark de ponta a ponta do pipeline (pergunta -> SQL -> DataFrame ->
+# gráfico) sem rede: o LLM é um modelo falso com latência fixa e respostas
+# gravadas, o Postgres do Spotify é um SQLite carregado dos CSVs e o
+# Oracle-ADB é uma conexão falsa sobre o mesmo SQLite.
+#
+# Para cada etapa mede p50/p95 de latência, pico de memória alocada
+# (tracemalloc, numa rodada à parte) e vazão. Os baselines ficam em
+# benchmarks/baselines/ e entram no git, então regressões aparecem no diff.
+#
+# Uso (a partir da raiz do repositório):
+#     python -m benchmarks.bench_pipeline -n 20
+#     python -m benchmarks.bench_pipeline --warm --save
+#     python -m benchmarks.bench_pipeline --compare
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager, redirect_stdout
+
+# Os caches persistentes são lidos na importação dos módulos do app: aponta
+# para um diretório descartável antes de importar qualquer um deles.
+os.environ.setdefault('GENBI_CACHE_DIR', tempfile.mkdtemp(prefix='genbi_'))
+os.environ.setdefault('GENBI_TRACE_EXPORT', 'none')
+os.environ.setdefault('COLUMN_STATS_REFRESH', '0')
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+
+QUESTION = 'quais artistas têm mais streams diários?'
+ADB_SQL = 'SELECT "Artist", "Streams", "Daily" FROM artists LIMIT 500'
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q * (len(values) - 1))))
+    return values[index]
+
+
+def clear_caches():
+    from answer_cache import ANSWER_CACHE
+    from plot_cache import PLOT_CACHE
+    from result_cache import RESULT_CACHE
+    from utils import AGENT_REGISTRY
+
+    ANSWER_CACHE.clear()
+    PLOT_CACHE.clear()
+    RESULT_CACHE.clear()
+    AGENT_REGISTRY.clear()
+
+
+def measure(fn, repeat, cold):
+    fn()  # primeira chamada fora da conta: pool de processos, agente etc.
+
+    timings = []
+    for _ in range(repeat):
+        if cold:
+            clear_caches()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    if cold:
+        clear_caches()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return dict(
+        p50_ms=round(1000 * percentile(timings, 0.5), 2),
+        p95_ms=round(1000 * percentile(timings, 0.95), 2),
+        peak_mib=round(peak / 2**20, 2),
+        ops_per_s=round(len(timings) / sum(timings), 2),
+    )
+
+
+def build_stages(llm_latency):
+    import askDB
+    import askPostgres
+    from constants import PROFILE, ACTIONS
+    from benchmarks.fakes import FakeADBConnection, FakeChatModel
+    from benchmarks.fakes import AGENT_SQL, PLOT_CODE
+    from benchmarks.local_db import load_spotify_sqlite, create_local_engine
+    from langchain_community.utilities import SQLDatabase
+
+    path = load_spotify_sqlite()
+    db = SQLDatabase(
+        create_local_engine(path), schema='public', lazy_table_reflection=True
+    )
+    llm = FakeChatModel(responses=[PLOT_CODE], latency=llm_latency)
+    askPostgres.set_llm(llm)
+
+    adb = FakeADBConnection(path, ADB_SQL, PLOT_CODE, latency=llm_latency)
+
+    @contextmanager
+    def fake_acquire_connection():
+        yield adb
+
+    askDB.acquire_connection = fake_acquire_connection
+    df = askPostgres.panda_table_from_query(AGENT_SQL, db, 'public')
+
+    return {
+        'ask_postgres': lambda: askPostgres.ask_postgres(QUESTION, db),
+        'ask_postgres.agent': lambda: askPostgres.ask_postgres(
+            QUESTION, db, fast_path=False
+        ),
+        'panda_table_from_query': lambda: askPostgres.panda_table_from_query(
+            AGENT_SQL, db, 'public'
+        ),
+        'plot_code_from_genai': lambda: askPostgres.plot_code_from_genai(df),
+        'askDB.generate_query': lambda: askDB.generate_query(
+            QUESTION, ACTIONS[0], PROFILE
+        ),
+        'askDB.generate_plot': lambda: askDB.generate_plot(PROFILE, df),
+    }
+
+
+def baseline_path(cold):
+    name = 'pipeline_cold.json' if cold else 'pipeline_warm.json'
+    return os.path.join(BASELINE_DIR, name)
+
+
+def print_report(results, baseline=None):
+    print(
+        f'{"stage":<24} {"p50":>10} {"p95":>10} {"peak":>10} {"ops/s":>9}'
+    )
+    for stage, result in results.items():
+        line = (
+            f'{stage:<24} {result["p50_ms"]:8.1f}ms {result["p95_ms"]:8.1f}ms '
+            f'{result["peak_mib"]:7.2f}MiB {result["ops_per_s"]:9.1f}'
+        )
+        if baseline and stage in baseline:
+            before = baseline[stage]['p50_ms']
+            if before:
+                change = 100 * (result['p50_ms'] - before) / before
+                line += f'  p50 {change:+6.1f}% vs baseline'
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--repeat', type=int, default=10)
+    parser.add_argument(
+        '--warm',
+        action='store_true',
+        help='mantém os caches entre as rodadas (mede os acertos de cache)',
+    )
+    parser.add_argument(
+        '--llm-latency',
+        type=float,
+        default=0.05,
+        help='latência simulada de cada chamada ao LLM, em segundos',
+    )
+    parser.add_argument('--stage', action='append', help='roda só esta etapa')
+    parser.add_argument('--save', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    args = parser.parse_args()
+
+    import logging
+
+    logging.disable(logging.WARNING)
+    cold = not args.warm
+
+    with redirect_stdout(io.StringIO()):
+        stages = build_stages(args.llm_latency)
+    results = {}
+    for stage, fn in stages.items():
+        if args.stage and stage not in args.stage:
+            continue
+        # O agente é verbose e imprime o contexto do schema; só o relatório
+        # interessa aqui.
+        with redirect_stdout(io.StringIO()):
+            results[stage] = measure(fn, args.repeat, cold)
+
+    baseline = None
+    if args.compare:
+        try:
+            with open(baseline_path(cold)) as f:
+                baseline = json.load(f)['stages']
+        except FileNotFoundError:
+            print('Nenhum baseline salvo para este modo.', file=sys.stderr)
+
+    print_report(results, baseline)
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path(cold), 'w') as f:
+            json.dump(
+                dict(
+                    repeat=args.repeat,
+                    llm_latency=args.llm_latency,
+                    stages=results,
+                ),
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write('\n')
+
+    from plot_executor import shutdown
+
+    shutdown()
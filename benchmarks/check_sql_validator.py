@@ -0,0 +1,119 @@
+# Conferência rápida do validador de SQL (sql_validator) em formatos de
+# query que o LLM costuma gerar, contra um catálogo fixo no dialeto do
+# Postgres e do Oracle. Sai com código 1 se algum caso mudar de resultado.
+#
+# Uso (a partir da raiz do repositório):
+#     python -m benchmarks.check_sql_validator
+import sys
+
+from sql_validator import InvalidQuery, validate_query
+
+CATALOG = dict(
+    tables={
+        'artists': dict(
+            columns=[
+                ('Artist', 'text'),
+                ('Streams', 'double precision'),
+                ('Daily', 'double precision'),
+                ('As lead', 'double precision'),
+            ],
+        ),
+        'listeners': dict(
+            columns=[
+                ('Artist', 'text'),
+                ('Listeners', 'bigint'),
+                ('Peak', 'bigint'),
+            ],
+        ),
+    },
+)
+ORACLE_CATALOG = dict(
+    tables={
+        'SALES': dict(
+            columns=[('PROD_ID', 'number'), ('AMOUNT_SOLD', 'number')]
+        ),
+    },
+)
+
+# (dialeto, catálogo, schema, qualify, query, query esperada ou None se a
+# query deve ser recusada)
+CASES = [
+    # Top N por uma coluna: o ORDER BY recebe a correção da projeção.
+    (
+        'postgres', CATALOG, 'public', True,
+        'SELECT artist, streams FROM artists ORDER BY streams DESC LIMIT 10',
+        'SELECT "Artist", "Streams" FROM public.artists '
+        'ORDER BY "Streams" DESC LIMIT 10',
+    ),
+    (
+        'postgres', CATALOG, 'public', True,
+        'SELECT artist, daily FROM artists GROUP BY artist, daily '
+        'HAVING daily > 2 ORDER BY daily',
+        'SELECT "Artist", "Daily" FROM public.artists GROUP BY "Artist", '
+        '"Daily" HAVING "Daily" > 2 ORDER BY "Daily"',
+    ),
+    # Alias da projeção no ORDER BY não vira coluna da tabela.
+    (
+        'postgres', CATALOG, 'public', True,
+        'SELECT "Artist", SUM("Streams") AS streams FROM artists '
+        'GROUP BY "Artist" ORDER BY streams DESC',
+        'SELECT "Artist", SUM("Streams") AS streams FROM public.artists '
+        'GROUP BY "Artist" ORDER BY streams DESC',
+    ),
+    (
+        'postgres', CATALOG, 'public', True,
+        'SELECT Artist, As lead FROM artists',
+        'SELECT "Artist", "As lead" FROM public.artists',
+    ),
+    # Funções de tabela passam sem validação.
+    (
+        'postgres', CATALOG, 'public', True,
+        'SELECT g FROM generate_series(1, 3) AS g',
+        'SELECT g FROM GENERATE_SERIES(1, 3) AS g',
+    ),
+    (
+        'postgres', CATALOG, 'public', True,
+        'SELECT nope FROM artists', None,
+    ),
+    # Tabela de outro owner fica para o ADB conferir.
+    (
+        'oracle', ORACLE_CATALOG, 'ADMIN', False,
+        'SELECT c.cust_first_name FROM "SH"."CUSTOMERS" c',
+        'SELECT c.cust_first_name FROM "SH"."CUSTOMERS" c',
+    ),
+    (
+        'oracle', ORACLE_CATALOG, 'ADMIN', False,
+        'SELECT prod_id FROM sales ORDER BY amount_sold DESC '
+        'FETCH FIRST 5 ROWS ONLY',
+        'SELECT prod_id FROM sales ORDER BY amount_sold DESC '
+        'FETCH FIRST 5 ROWS ONLY',
+    ),
+    (
+        'oracle', ORACLE_CATALOG, 'ADMIN', False,
+        'SELECT nope FROM sales', None,
+    ),
+]
+
+
+def run():
+    failures = 0
+    for dialect, catalog, schema, qualify, query, expected in CASES:
+        try:
+            result, _ = validate_query(
+                query, catalog, dialect, schema, qualify
+            )
+        except InvalidQuery as e:
+            result = None
+            detail = f'InvalidQuery: {e}'
+        else:
+            detail = result
+        ok = result == expected
+        failures += not ok
+        print(f'{"ok " if ok else "FALHOU"} {query}')
+        if not ok:
+            print(f'       esperado: {expected}\n       obtido:   {detail}')
+    return failures
+
+
+if __name__ == '__main__':
+    sys.exit(1 if run() else 0)
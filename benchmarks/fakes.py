@@ -0,0 +1,220 @@
+# Dublês determinísticos para os benchmarks: um chat model que responde com
+# latência configurável e respostas gravadas, e uma conexão Oracle-ADB falsa
+# que responde DBMS_CLOUD_AI.GENERATE do mesmo jeito e repassa o resto do SQL
+# para um SQLite local.
+import itertools
+import json
+import re
+import sqlite3
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    SystemMessage,
+    ToolMessage,
+)
+from langchain_core.outputs import (
+    ChatGeneration,
+    ChatGenerationChunk,
+    ChatResult,
+)
+
+
+AGENT_SQL = (
+    'SELECT "Artist", "Daily", "As feature" FROM artists '
+    'ORDER BY "Daily" DESC LIMIT 10'
+)
+
+PLOT_CODE = """```python
+import matplotlib.pyplot as plt
+fig, ax = plt.subplots(figsize=(8, 5))
+ax.barh(df[df.columns[0]].astype(str), df[df.columns[1]])
+```"""
+
+
+def _asks_for_sql(messages):
+    # Caminho rápido do ask_postgres: o prompt de sistema do agente SQL,
+    # sem ferramentas.
+    first = messages[0] if messages else None
+    return isinstance(first, SystemMessage) and 'SQL query' in first.content
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model com latência fixa e respostas gravadas.
+
+    Sem ferramentas, devolve ``responses`` em ordem (em ciclo), ou
+    ``agent_sql`` quando o prompt de sistema é o do agente SQL. Quando o
+    agente SQL liga as ferramentas, a primeira chamada pede ``sql_db_query``
+    com ``agent_sql`` e a seguinte responde com o resultado da ferramenta.
+    """
+
+    responses: List[str] = [PLOT_CODE]
+    agent_sql: str = AGENT_SQL
+    latency: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-chat'
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[getattr(t, 'name', t) for t in tools])
+
+    def _reply(self, messages, tools) -> AIMessage:
+        time.sleep(self.latency)
+        self.calls += 1
+
+        if not tools and _asks_for_sql(messages):
+            message = AIMessage(content=self.agent_sql)
+        elif not tools:
+            message = AIMessage(
+                content=self.responses[(self.calls - 1) % len(self.responses)]
+            )
+        elif isinstance(messages[-1], ToolMessage):
+            message = AIMessage(content=f'Resultado: {messages[-1].content}')
+        else:
+            message = self._tool_call()
+
+        # Contagem aproximada (4 caracteres por token), para o tracing ter
+        # números de tokens como teria com um modelo real.
+        prompt_chars = sum(len(str(m.content)) for m in messages)
+        message.usage_metadata = dict(
+            input_tokens=prompt_chars // 4,
+            output_tokens=len(message.content) // 4,
+            total_tokens=(prompt_chars + len(message.content)) // 4,
+        )
+        return message
+
+    def _tool_call(self) -> AIMessage:
+        return AIMessage(
+            content='',
+            tool_calls=[
+                dict(
+                    name='sql_db_query',
+                    args={'query': self.agent_sql},
+                    id=f'call_{self.calls}',
+                )
+            ],
+        )
+
+    def _generate(
+        self,
+        messages,
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        tools=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = self._reply(messages, tools)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages,
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        tools=None,
+        **kwargs: Any,
+    ):
+        message = self._reply(messages, tools)
+        if message.tool_calls:
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content='',
+                    usage_metadata=message.usage_metadata,
+                    tool_call_chunks=[
+                        dict(
+                            name=call['name'],
+                            args=json.dumps(call['args']),
+                            id=call['id'],
+                            index=0,
+                        )
+                        for call in message.tool_calls
+                    ],
+                )
+            )
+            return
+        for token in re.split(r'(\s+)', message.content):
+            if token:
+                yield ChatGenerationChunk(
+                    message=AIMessageChunk(content=token)
+                )
+        yield ChatGenerationChunk(
+            message=AIMessageChunk(
+                content='', usage_metadata=message.usage_metadata
+            )
+        )
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self._connection = connection
+        self._cursor = connection.sqlite.cursor()
+        self._rows = None
+        self.arraysize = 100
+        self.description = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._cursor.close()
+
+    def execute(self, query, params=None):
+        if 'DBMS_CLOUD_AI.GENERATE' in query:
+            prompt, profile_name, action = params
+            time.sleep(self._connection.latency)
+            self._connection.calls += 1
+            self._rows = iter(
+                [(self._connection.respond(prompt, profile_name, action),)]
+            )
+            self.description = [('RESPONSE', None, None, None)]
+            return self
+
+        self._cursor.execute(query.strip().rstrip(';'), params or [])
+        self._rows = None
+        self.description = self._cursor.description
+        return self
+
+    def fetchone(self):
+        if self._rows is not None:
+            return next(self._rows, None)
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        if self._rows is not None:
+            return list(self._rows)
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        if self._rows is not None:
+            return list(itertools.islice(self._rows, size))
+        return self._cursor.fetchmany(size)
+
+
+class FakeADBConnection:
+    """Conexão Oracle-ADB falsa: o Select AI responde com ``showsql`` para
+    a action 'showsql' e com ``chat`` para as demais."""
+
+    def __init__(self, path, showsql, chat=PLOT_CODE, latency=0.0):
+        self.sqlite = sqlite3.connect(path, check_same_thread=False)
+        self.showsql = showsql
+        self.chat = chat
+        self.latency = latency
+        self.calls = 0
+
+    def respond(self, prompt, profile_name, action):
+        return self.showsql if action == 'showsql' else self.chat
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.sqlite.close()
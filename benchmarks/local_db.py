@@ -0,0 +1,50 @@
+# Banco local que substitui o Postgres do Spotify nos benchmarks: um SQLite
+# carregado a partir dos CSVs de spotify_data/, anexado com o nome "public"
+# para que queries qualificadas com schema (public.artists) funcionem.
+import os
+import sqlite3
+import tempfile
+
+import pandas as pd
+from sqlalchemy import create_engine, event
+
+
+DATA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'spotify_data',
+)
+
+TABLES = {
+    'artists': ('artists_preprocessed.csv', {}),
+    'listeners': ('listeners_preprocessed.csv', {}),
+    'most_streamed': ('spotify_most_streamed.csv', {'thousands': ','}),
+}
+
+
+def load_spotify_sqlite(path=None, data_dir=DATA_DIR):
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix='spotify_', suffix='.sqlite')
+        os.close(fd)
+
+    with sqlite3.connect(path) as conn:
+        for table, (filename, options) in TABLES.items():
+            df = pd.read_csv(os.path.join(data_dir, filename), **options)
+            df.to_sql(table, conn, if_exists='replace', index=False)
+    return path
+
+
+def create_local_engine(path):
+    engine = create_engine('sqlite://')
+
+    @event.listens_for(engine, 'connect')
+    def attach_public(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"ATTACH DATABASE '{path}' AS public")
+
+    return engine
+
+
+def local_spotify_database(path=None):
+    from langchain_community.utilities import SQLDatabase
+
+    engine = create_local_engine(load_spotify_sqlite(path))
+    return SQLDatabase(engine, schema='public', lazy_table_reflection=True)
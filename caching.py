@@ -0,0 +1,170 @@
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class PersistentCache:
+    """Cache LRU em memória, thread-safe, com TTL e persistência opcional.
+
+    As entradas guardam o instante de expiração em tempo de parede, então
+    um cache recarregado do disco após um restart continua respeitando o TTL.
+    Com max_bytes e sizeof, a evicção segue um orçamento total de bytes em
+    vez de (ou além de) um número máximo de entradas.
+    """
+
+    def __init__(
+        self,
+        name,
+        ttl=None,
+        path=None,
+        max_entries=None,
+        max_bytes=None,
+        sizeof=None,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        if path:
+            self.load()
+
+    def _expires_at(self, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else None
+
+    def get(self, key, default=None, allow_stale=False):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.time():
+                if allow_stale:
+                    self.stale_hits += 1
+                    return value
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        size = self.sizeof(value) if self.sizeof else 0
+        if self.max_bytes and size > self.max_bytes:
+            return False
+
+        with self._lock:
+            self._bytes -= self._sizes.pop(key, 0)
+            self._entries[key] = (self._expires_at(ttl), value)
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            self._bytes += size
+            self._evict()
+        return True
+
+    def _evict(self):
+        while self._entries and (
+            (self.max_entries and len(self._entries) > self.max_entries)
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            key, _ = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(key, 0)
+            self.evictions += 1
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def touch(self, key, ttl=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (self._expires_at(ttl), entry[1])
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._bytes -= self._sizes.pop(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                name=self.name,
+                entries=len(self._entries),
+                hits=self.hits,
+                misses=self.misses,
+                stale_hits=self.stale_hits,
+                evictions=self.evictions,
+                bytes=self._bytes,
+                hit_rate=self.hits / lookups if lookups else 0.0,
+            )
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                entries = pickle.load(f)
+            with self._lock:
+                for key, entry in entries.items():
+                    size = self.sizeof(entry[1]) if self.sizeof else 0
+                    self._bytes -= self._sizes.pop(key, 0)
+                    self._entries[key] = entry
+                    self._sizes[key] = size
+                    self._bytes += size
+                self._evict()
+            logging.info(
+                f'Cache {self.name} carregado de {self.path} '
+                f'({len(entries)} entradas).'
+            )
+        except Exception as e:
+            logging.warning(
+                f'Erro ao carregar o cache {self.name} de {self.path}: {e}'
+            )
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries = dict(self._entries)
+        try:
+            directory = os.path.dirname(self.path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.warning(
+                f'Erro ao salvar o cache {self.name} em {self.path}: {e}'
+            )
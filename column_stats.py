@@ -0,0 +1,344 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from caching import PersistentCache
+from constants import (
+    CACHE_DIR,
+    COLUMN_STATS_SAMPLE_ROWS,
+    COLUMN_STATS_REFRESH,
+)
+from schema_cache import database_key, get_schema_catalog
+from tracing import span
+
+
+TOP_K = 5
+HISTOGRAM_BINS = 10
+# Colunas com até este número de valores distintos listam os mais comuns
+# mesmo sendo numéricas (códigos, anos, flags).
+CATEGORICAL_MAX_DISTINCT = 20
+MAX_VALUE_CHARS = 60
+
+CHANGE_COUNTERS_QUERY = """
+SELECT relname, n_tup_ins + n_tup_upd + n_tup_del, n_live_tup
+FROM pg_stat_user_tables
+WHERE schemaname = :schema
+"""
+
+STATS_CACHE = PersistentCache(
+    'column_stats', path=os.path.join(CACHE_DIR, 'column_stats.pkl')
+)
+
+_REFRESH_LOCKS = {}
+_REFRESHERS = {}
+_LOCK = threading.Lock()
+
+
+# ------------------------------------------------------------------------
+# Perfil de uma coluna
+# ------------------------------------------------------------------------
+
+
+def _plain(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, str) and len(value) > MAX_VALUE_CHARS:
+        return value[: MAX_VALUE_CHARS - 1] + '…'
+    if isinstance(value, (int, float, bool, str)) or value is None:
+        return value
+    return str(value)
+
+
+def estimate_distinct(values: pd.Series, total_rows: int) -> int:
+    """Distintos da tabela a partir da amostra (estimador GEE de Charikar
+    et al.): valores vistos uma vez são escalados por sqrt(N/n)."""
+    counts = values.value_counts(dropna=True)
+    n = int(counts.sum())
+    if not n:
+        return 0
+    if total_rows <= n:
+        return int(len(counts))
+    singletons = int((counts == 1).sum())
+    estimate = math.sqrt(total_rows / n) * singletons + (len(counts) - singletons)
+    return int(min(total_rows, round(estimate)))
+
+
+def _as_numeric(series):
+    if pd.api.types.is_bool_dtype(series):
+        return None
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    if series.dtype == object:
+        # NUMERIC do Postgres chega como Decimal em colunas object.
+        converted = pd.to_numeric(series, errors='coerce')
+        if converted.notna().sum() == series.notna().sum():
+            return converted.astype(float)
+    return None
+
+
+def profile_column(series: pd.Series, dtype: str, total_rows: int) -> dict:
+    non_null = series.dropna()
+    profile = dict(
+        dtype=dtype,
+        null_ratio=round(1 - len(non_null) / len(series), 4)
+        if len(series)
+        else 0.0,
+        distinct=estimate_distinct(non_null, total_rows),
+        min=None,
+        max=None,
+        top=[],
+        histogram=None,
+    )
+    if non_null.empty:
+        return profile
+
+    numeric = _as_numeric(non_null)
+    if pd.api.types.is_datetime64_any_dtype(non_null):
+        values = non_null.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+        profile.update(
+            min=_plain(non_null.min()),
+            max=_plain(non_null.max()),
+            histogram=dict(
+                edges=[_plain(pd.Timestamp(int(e))) for e in edges],
+                counts=counts.tolist(),
+            ),
+        )
+    elif numeric is not None:
+        values = numeric.to_numpy()
+        values = values[np.isfinite(values)]
+        if len(values):
+            counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+            profile.update(
+                min=_plain(values.min()),
+                max=_plain(values.max()),
+                histogram=dict(
+                    edges=[round(float(e), 6) for e in edges],
+                    counts=counts.tolist(),
+                ),
+            )
+    else:
+        as_text = non_null.astype(str)
+        profile.update(min=_plain(as_text.min()), max=_plain(as_text.max()))
+
+    if numeric is None or profile['distinct'] <= CATEGORICAL_MAX_DISTINCT:
+        top = non_null.astype(str).value_counts().head(TOP_K)
+        profile['top'] = [
+            (_plain(value), round(count / len(series), 4))
+            for value, count in top.items()
+        ]
+    return profile
+
+
+def profile_frame(df, columns, total_rows):
+    return {
+        column: profile_column(df[column], dtype, total_rows)
+        for column, dtype in columns
+        if column in df.columns
+    }
+
+
+# ------------------------------------------------------------------------
+# Amostragem e detecção de mudança
+# ------------------------------------------------------------------------
+
+
+def _columns_signature(columns):
+    payload = ','.join(f'{name}:{dtype}' for name, dtype in columns)
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+
+def change_counters(conn, schema, tables):
+    """{tabela: (contador de mudanças, linhas estimadas)}."""
+    if conn.dialect.name == 'postgresql':
+        rows = conn.execute(text(CHANGE_COUNTERS_QUERY), {'schema': schema})
+        return {table: (int(changes), int(live)) for table, changes, live in rows}
+
+    quote = conn.dialect.identifier_preparer.quote
+    counters = {}
+    for table in tables:
+        count = conn.execute(
+            text(f'SELECT count(*) FROM {quote(schema)}.{quote(table)}')
+        ).scalar()
+        counters[table] = (int(count), int(count))
+    return counters
+
+
+def _sample_query(conn, schema, table, total_rows, sample_rows):
+    quote = conn.dialect.identifier_preparer.quote
+    source = f'{quote(schema)}.{quote(table)}'
+    if conn.dialect.name == 'postgresql' and total_rows > sample_rows:
+        # TABLESAMPLE SYSTEM lê só uma fração das páginas; pede o dobro da
+        # fração necessária para compensar páginas com poucas linhas.
+        percent = min(100.0, 200.0 * sample_rows / total_rows)
+        return (
+            f'SELECT * FROM {source} TABLESAMPLE SYSTEM ({percent:.4f}) '
+            f'LIMIT {int(sample_rows)}'
+        )
+    # total_rows é estimado e pode estar desatualizado: o LIMIT vale sempre.
+    return f'SELECT * FROM {source} LIMIT {int(sample_rows)}'
+
+
+def profile_table(conn, schema, table, columns, total_rows, sample_rows):
+    query = _sample_query(conn, schema, table, total_rows, sample_rows)
+    df = pd.read_sql(text(query), conn)
+    total_rows = max(total_rows, len(df))
+    return dict(
+        rows=total_rows,
+        sampled_rows=len(df),
+        columns=profile_frame(df, columns, total_rows),
+    )
+
+
+# ------------------------------------------------------------------------
+# Catálogo
+# ------------------------------------------------------------------------
+
+
+def get_column_stats(db, schema='public'):
+    """Perfis já calculados do schema, ou None; nunca consulta o banco."""
+    return STATS_CACHE.get((database_key(db), schema))
+
+
+def refresh_column_stats(
+    db, schema='public', sample_rows=COLUMN_STATS_SAMPLE_ROWS, force=False
+):
+    """Reperfila só as tabelas novas ou alteradas desde a última rodada."""
+    key = (database_key(db), schema)
+    with _LOCK:
+        lock = _REFRESH_LOCKS.setdefault(key, threading.Lock())
+
+    with lock, span('schema.column_stats', schema=schema) as stats_span:
+        start = time.perf_counter()
+        catalog = get_schema_catalog(db, schema)
+        previous = STATS_CACHE.get(key) or {'tables': {}}
+        tables = {}
+        profiled = []
+
+        with db._engine.connect() as conn:
+            counters = change_counters(conn, schema, list(catalog['tables']))
+            for table, info in catalog['tables'].items():
+                changes, total_rows = counters.get(table, (None, 0))
+                version = (_columns_signature(info['columns']), changes)
+                old = previous['tables'].get(table)
+                if not force and old is not None and old['version'] == version:
+                    tables[table] = old
+                    continue
+                try:
+                    profile = profile_table(
+                        conn, schema, table, info['columns'], total_rows,
+                        sample_rows,
+                    )
+                except Exception as e:
+                    logging.error(f'Erro ao perfilar a tabela {table}: {e}')
+                    if old is not None:
+                        tables[table] = old
+                    continue
+                profile.update(version=version, profiled_at=time.time())
+                tables[table] = profile
+                profiled.append(table)
+
+        stats = dict(
+            schema=schema,
+            fingerprint=catalog['fingerprint'],
+            tables=tables,
+            updated_at=time.time() if profiled else previous.get('updated_at'),
+        )
+        STATS_CACHE.put(key, stats)
+        STATS_CACHE.save()
+        stats_span.set(tables=len(tables), profiled=len(profiled))
+        logging.info(
+            f'Perfis de colunas do schema {schema}: {len(profiled)} de '
+            f'{len(tables)} tabelas atualizadas em '
+            f'{time.perf_counter() - start:.2f}s.'
+        )
+        return stats
+
+
+def _refresh_loop(db, schema, interval):
+    while True:
+        try:
+            refresh_column_stats(db, schema)
+        except Exception as e:
+            logging.error(f'Erro no job de perfis do schema {schema}: {e}')
+        time.sleep(interval)
+
+
+def start_stats_refresher(db, schema='public', interval=COLUMN_STATS_REFRESH):
+    """Inicia (uma vez por banco e schema) o job que mantém os perfis."""
+    if not interval:
+        return None
+    key = (database_key(db), schema)
+    with _LOCK:
+        thread = _REFRESHERS.get(key)
+        if thread is None:
+            thread = threading.Thread(
+                target=_refresh_loop,
+                args=(db, schema, interval),
+                name=f'genbi-column-stats-{schema}',
+                daemon=True,
+            )
+            _REFRESHERS[key] = thread
+            thread.start()
+    return thread
+
+
+# ------------------------------------------------------------------------
+# Formatação para prompts
+# ------------------------------------------------------------------------
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return f'{value:.6g}'
+    return str(value)
+
+
+def format_column_profile(column, profile):
+    parts = [f'- {column} {profile["dtype"]}']
+    if profile['null_ratio']:
+        parts.append(f'nulls {100 * profile["null_ratio"]:.1f}%')
+    parts.append(f'distinct ~{profile["distinct"]}')
+    if profile['histogram'] is not None:
+        parts.append(
+            f'range {_format_number(profile["min"])} .. '
+            f'{_format_number(profile["max"])}'
+        )
+    if profile['top']:
+        label = (
+            'top' if profile['distinct'] <= CATEGORICAL_MAX_DISTINCT else 'e.g.'
+        )
+        parts.append(
+            f'{label} ' + ', '.join(repr(value) for value, _ in profile['top'])
+        )
+    return ' | '.join(parts)
+
+
+def format_table_profile(table, table_stats):
+    lines = [f'Tabela: {table} (~{table_stats["rows"]} rows)']
+    for column, profile in table_stats['columns'].items():
+        lines.append(format_column_profile(column, profile))
+    lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    from askPostgres import get_db_migration, get_db_spotify
+
+    for get_db in (get_db_migration, get_db_spotify):
+        stats = refresh_column_stats(get_db(), 'public')
+        for table, table_stats in stats['tables'].items():
+            print(format_table_profile(table, table_stats))
@@ -1,5 +1,5 @@
 import os
-import oci
+from functools import lru_cache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -47,10 +47,24 @@ SQLALCHEMY_DATABASE_URI: str = get_sqlalchemy_database_uri()
 SPOTIFY_DATABASE_URI: str = os.environ.get('SPOTIFY_DB_URI', None)
 SCHEMA: str = os.environ.get('DB_SCHEMA')
 OCI_CREDENTIALS = get_oci_credentials_from_env()
-IS_OCI_CREDENTIALS_VALID = all(
-    OCI_CREDENTIALS.get(k)
-    for k in ('user', 'key_content', 'fingerprint', 'tenancy', 'region')
-) and not oci.config.validate_config(OCI_CREDENTIALS)
+
+
+@lru_cache(maxsize=None)
+def is_oci_credentials_valid():
+    # O SDK da OCI é pesado de importar; só é carregado quando alguém
+    # realmente precisa validar as credenciais.
+    import oci
+
+    return all(
+        OCI_CREDENTIALS.get(k)
+        for k in ('user', 'key_content', 'fingerprint', 'tenancy', 'region')
+    ) and not oci.config.validate_config(OCI_CREDENTIALS)
+
+
+def __getattr__(name):
+    if name == 'IS_OCI_CREDENTIALS_VALID':
+        return is_oci_credentials_valid()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 # CSV FILES PATH
@@ -58,6 +72,49 @@ LOCAL = os.getcwd()
 SPOTIFY_DATA_TRACKS = LOCAL + '/data.csv'
 SPOTIFY_DATA_ARTISTS = LOCAL + '/artists.csv'
 SPOTIFY_DATA_LISTENERS = LOCAL + '/listeners.csv'
+SPOTIFY_DATA_MOST_STREAMED = LOCAL + '/spotify_most_streamed.csv'
+
+# BANCO DO SPOTIFY: 'postgres' (SPOTIFY_DB_URI) ou um banco embarcado,
+# 'duckdb' (colunar, requer duckdb-engine) ou 'sqlite', montado em CACHE_DIR
+# a partir dos arquivos tratados em SPOTIFY_DATA_DIR
+SPOTIFY_BACKEND = os.environ.get('SPOTIFY_BACKEND', 'postgres')
+SPOTIFY_DATA_DIR = os.environ.get('SPOTIFY_DATA_DIR', LOCAL + '/spotify_data')
+
+# CACHES LOCAIS
+CACHE_DIR = os.environ.get('GENBI_CACHE_DIR', LOCAL + '/.cache')
+SCHEMA_CACHE_TTL = int(os.environ.get('SCHEMA_CACHE_TTL', 600))
+ANSWER_CACHE_TTL = int(os.environ.get('ANSWER_CACHE_TTL', 7 * 24 * 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', 1000))
+# Similaridade mínima (0-1) para reaproveitar a SQL de uma pergunta parecida;
+# 0 desliga o match semântico e mantém só o match exato.
+ANSWER_CACHE_SIMILARITY = float(os.environ.get('ANSWER_CACHE_SIMILARITY', 0.9))
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 900))
+RESULT_CACHE_MAX_BYTES = int(
+    os.environ.get('RESULT_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+)
+PLOT_CACHE_MAX_ENTRIES = int(os.environ.get('PLOT_CACHE_MAX_ENTRIES', 500))
+
+# EXECUÇÃO ISOLADA DO CÓDIGO DE PLOTAGEM GERADO
+PLOT_POOL_WORKERS = int(os.environ.get('PLOT_POOL_WORKERS', 2))
+PLOT_TIMEOUT = int(os.environ.get('PLOT_TIMEOUT', 30))
+PLOT_MEMORY_LIMIT_MB = int(os.environ.get('PLOT_MEMORY_LIMIT_MB', 1024))
+
+# PLOTAGEM: 'code' (código matplotlib gerado pela LLM) ou 'spec' (spec JSON
+# desenhada localmente, com downsampling para resultados grandes)
+PLOT_MODE = os.environ.get('PLOT_MODE', 'code')
+PLOT_MAX_POINTS = int(os.environ.get('PLOT_MAX_POINTS', 2000))
+
+# Com GENBI_WARM_UP=1 o app carrega LLM, bancos, catálogos e agentes em
+# background logo na subida, em vez de na primeira pergunta.
+WARM_UP = os.environ.get('GENBI_WARM_UP', '0') == '1'
+
+# LEITURA DE RESULTADOS: 'arrow' (colunar, requer pyarrow) ou 'rows'
+FETCH_MODE = os.environ.get('FETCH_MODE', 'arrow')
+FETCH_ARRAYSIZE = int(os.environ.get('FETCH_ARRAYSIZE', 10000))
+
+# STREAMING DE RESULTADOS EM BLOCOS
+STREAM_CHUNK_ROWS = int(os.environ.get('STREAM_CHUNK_ROWS', 5000))
+STREAM_MAX_ROWS = int(os.environ.get('STREAM_MAX_ROWS', 200000))
 
 system = """You are an agent designed to interact with a SQL database. Given an input question, create a syntactically correct SQL query to run, then look at the results of the query and return the answer.
 You MUST include the original SQL query used to generate the answer in the output.
@@ -101,6 +158,22 @@ Preferably use matplotlib and matplotlib style ggplot. When creating the figure,
 and always generate legends."""
 
 
+PLOT_SPEC_PROMPT = """Here are the columns of a pandas DataFrame (name: dtype):
+{columns}
+And a sample of its first rows:
+{df_head}
+Choose the most suitable chart for this data and describe it as a JSON object with the keys:
+- "chart": one of {charts}
+- "x": column for the x axis (or the category axis)
+- "y": numeric column for the y axis, or null
+- "hue": column used to split the data into colored groups, or null
+- "value": numeric column aggregated into the heatmap cells, or null
+- "aggregation": one of "sum", "mean", "median", "count", "min", "max", or null
+- "title": a short title for the chart
+Use only column names from the list above.
+Return ONLY the JSON object, without explanations or markdown."""
+
+
 ######################################## CONSTANTS FOR CHATDB USING ADB OCI ##############################################
 
 PROMPT = [
@@ -115,3 +188,68 @@ PROMPT = [
 
 ACTIONS = ['showsql', 'chat', 'narrate']
 PROFILE = 'OCI_COHERE_COMMAND_R_PLUS'
+
+# POOL DE SESSÕES DO ORACLE-ADB
+ORACLE_POOL_MIN = int(os.environ.get('ORACLE_POOL_MIN', 1))
+ORACLE_POOL_MAX = int(os.environ.get('ORACLE_POOL_MAX', 4))
+ORACLE_POOL_INCREMENT = int(os.environ.get('ORACLE_POOL_INCREMENT', 1))
+ORACLE_POOL_PING_INTERVAL = int(os.environ.get('ORACLE_POOL_PING_INTERVAL', 60))
+ORACLE_POOL_WAIT_TIMEOUT = int(os.environ.get('ORACLE_POOL_WAIT_TIMEOUT', 30000))
+
+# CONTEXTO DOS PROMPTS: orçamento (tokens aproximados) do schema enviado ao
+# agente, com só as tabelas relevantes à pergunta (0 envia o schema todo),
+# e da amostra de DataFrame enviada nos prompts de plotagem
+SCHEMA_CONTEXT_MAX_TOKENS = int(os.environ.get('SCHEMA_CONTEXT_MAX_TOKENS', 1500))
+FRAME_PREVIEW_MAX_TOKENS = int(os.environ.get('FRAME_PREVIEW_MAX_TOKENS', 400))
+
+# VALIDAÇÃO LOCAL DA SQL GERADA: confere tabelas e colunas com o catálogo em
+# cache (corrigindo caixa, aspas e schema) antes de mandar a query ao banco,
+# no lugar da checagem por LLM do agente (requer sqlglot)
+SQL_VALIDATION = os.environ.get('GENBI_SQL_VALIDATION', '1') == '1'
+
+# CAMINHO RÁPIDO DO ask_postgres: uma única chamada ao LLM gera a SQL com o
+# contexto de schema em cache; o agente completo só roda quando ela vem
+# vazia ou falha
+SQL_FAST_PATH = os.environ.get('GENBI_SQL_FAST_PATH', '1') == '1'
+
+# PERFIS DE COLUNAS: linhas amostradas por tabela e intervalo (s) do job de
+# atualização em background (0 desliga o job; o perfil só é feito sob demanda)
+COLUMN_STATS_SAMPLE_ROWS = int(os.environ.get('COLUMN_STATS_SAMPLE_ROWS', 20000))
+COLUMN_STATS_REFRESH = int(os.environ.get('COLUMN_STATS_REFRESH', 3600))
+
+# EXECUÇÃO EM LOTE: perguntas processadas em paralelo e limite de chamadas
+# por minuto a cada provedor de LLM (0 desliga o limite)
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 4))
+BATCH_OPENAI_RPM = float(os.environ.get('BATCH_OPENAI_RPM', 60))
+BATCH_SELECT_AI_RPM = float(os.environ.get('BATCH_SELECT_AI_RPM', 30))
+
+# GUARDA DE CUSTO DAS QUERIES GERADAS: custo (unidades do otimizador) e
+# linhas estimadas pelo EXPLAIN, e timeout por statement em ms (0 desliga)
+QUERY_GUARD = os.environ.get('GENBI_QUERY_GUARD', '1') == '1'
+QUERY_MAX_COST = float(os.environ.get('QUERY_MAX_COST', 5_000_000))
+QUERY_MAX_ROWS = int(os.environ.get('QUERY_MAX_ROWS', STREAM_MAX_ROWS))
+QUERY_STATEMENT_TIMEOUT_MS = int(
+    os.environ.get('QUERY_STATEMENT_TIMEOUT_MS', 30000)
+)
+
+# ROLLUPS: agregados materializados usados no lugar das tabelas base quando
+# o resultado é equivalente, e intervalo (s) entre verificações de mudança
+# nas tabelas base
+ROLLUPS = os.environ.get('GENBI_ROLLUPS', '1') == '1'
+ROLLUP_CHECK_INTERVAL = int(os.environ.get('ROLLUP_CHECK_INTERVAL', 60))
+
+# LOG DE QUERIES EXECUTADAS (base do index_advisor, só Postgres/locais):
+# liga/desliga e tamanho máximo do arquivo antes de rotacionar
+QUERY_LOG = os.environ.get('GENBI_QUERY_LOG', '1') == '1'
+QUERY_LOG_PATH = os.environ.get(
+    'GENBI_QUERY_LOG_PATH', os.path.join(CACHE_DIR, 'query_log.jsonl')
+)
+QUERY_LOG_MAX_BYTES = int(
+    os.environ.get('QUERY_LOG_MAX_BYTES', 64 * 1024 * 1024)
+)
+
+# TRACING: fração das perguntas com spans registrados (0 desliga) e formato
+# de exportação: 'jsonl', 'openmetrics', 'both' ou 'none'
+TRACE_SAMPLE_RATE = float(os.environ.get('GENBI_TRACE_SAMPLE_RATE', 0.1))
+TRACE_EXPORT = os.environ.get('GENBI_TRACE_EXPORT', 'jsonl')
+TRACE_DIR = os.environ.get('GENBI_TRACE_DIR', LOCAL + '/.traces')
@@ -0,0 +1,207 @@
+# Banco embarcado do Spotify: as mesmas tabelas do Postgres num arquivo
+# local (DuckDB, colunar, ou SQLite) carregado dos arquivos tratados de
+# spotify_data/, para a demo e para uso offline sem round-trips de rede.
+import json
+import logging
+import os
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine, event
+from constants import CACHE_DIR, SPOTIFY_DATA_DIR
+
+
+ENGINES = ('duckdb', 'sqlite')
+SCHEMA = 'public'
+SQLITE_CHUNK_ROWS = 50_000
+
+# Arquivos de cada tabela, em ordem de preferência: saídas do
+# spotify_data_preprocess (Parquet tipado, depois CSV) e, para o dataset
+# que ainda não foi tratado, o CSV original com separador de milhar.
+SOURCES = {
+    'tracks': [
+        'data_tracks_preprocessed.parquet',
+        'data_tracks_preprocessed.csv',
+    ],
+    'artists': ['artists_preprocessed.parquet', 'artists_preprocessed.csv'],
+    'listeners': [
+        'listeners_preprocessed.parquet',
+        'listeners_preprocessed.csv',
+    ],
+    'most_streamed': [
+        'most_streamed_preprocessed.parquet',
+        'most_streamed_preprocessed.csv',
+        'spotify_most_streamed.csv',
+    ],
+}
+
+
+def database_path(kind):
+    return os.path.join(CACHE_DIR, f'spotify.{kind}')
+
+
+def find_sources(data_dir=SPOTIFY_DATA_DIR):
+    sources = {}
+    for table, candidates in SOURCES.items():
+        for name in candidates:
+            path = os.path.join(data_dir, name)
+            if os.path.exists(path):
+                sources[table] = path
+                break
+    return sources
+
+
+def _signature(sources):
+    signature = {}
+    for table, path in sources.items():
+        stat = os.stat(path)
+        signature[table] = [
+            os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+        ]
+    return signature
+
+
+def _read_signature(path):
+    try:
+        with open(path + '.json', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _read_frames(source):
+    if source.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(source).iter_batches(SQLITE_CHUNK_ROWS):
+            yield batch.to_pandas()
+        return
+    yield from pd.read_csv(source, thousands=',', chunksize=SQLITE_CHUNK_ROWS)
+
+
+def _load_duckdb(path, sources):
+    import duckdb
+
+    conn = duckdb.connect(path)
+    try:
+        conn.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+        for table, source in sources.items():
+            target = f'{SCHEMA}.{_quote(table)}'
+            if source.endswith('.parquet'):
+                # read_parquet lê em paralelo e direto para o formato
+                # colunar, sem passar pelo pandas.
+                conn.execute(
+                    f'CREATE TABLE {target} AS SELECT * FROM read_parquet(?)',
+                    [source],
+                )
+                continue
+            # O read_csv do DuckDB não entende separador de milhar entre
+            # aspas ("3,783,983,806"); os CSVs passam pelo pandas.
+            for i, chunk in enumerate(_read_frames(source)):
+                conn.register('_chunk', chunk)
+                if i == 0:
+                    conn.execute(
+                        f'CREATE TABLE {target} AS SELECT * FROM _chunk'
+                    )
+                else:
+                    conn.execute(f'INSERT INTO {target} SELECT * FROM _chunk')
+                conn.unregister('_chunk')
+    finally:
+        conn.close()
+
+
+def _load_sqlite(path, sources):
+    import sqlite3
+
+    with sqlite3.connect(path) as conn:
+        for table, source in sources.items():
+            for chunk in _read_frames(source):
+                chunk.to_sql(table, conn, if_exists='append', index=False)
+
+
+def build_embedded_database(kind, data_dir=SPOTIFY_DATA_DIR, path=None):
+    """Monta o arquivo do banco embarcado se os arquivos de origem mudaram
+    desde a última montagem; devolve o caminho e se foi reconstruído."""
+    if kind not in ENGINES:
+        raise ValueError(f'Banco embarcado desconhecido: {kind}')
+    path = path or database_path(kind)
+    sources = find_sources(data_dir)
+    if not sources:
+        raise FileNotFoundError(
+            f'Nenhum arquivo do Spotify em {data_dir}: rode '
+            'spotify_data_preprocess antes.'
+        )
+    signature = _signature(sources)
+    if os.path.exists(path) and _read_signature(path) == signature:
+        return path, False
+
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # Montado num arquivo temporário e trocado no fim: uma carga interrompida
+    # não deixa um banco pela metade com a assinatura já gravada.
+    tmp = f'{path}.{os.getpid()}.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        (_load_duckdb if kind == 'duckdb' else _load_sqlite)(tmp, sources)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    with open(path + '.json', 'w', encoding='utf-8') as f:
+        json.dump(signature, f, indent=2)
+    logging.info(
+        f'Banco embarcado {kind} montado em {path} com {len(sources)} '
+        f'tabelas em {time.perf_counter() - start:.2f}s.'
+    )
+    return path, True
+
+
+def create_embedded_engine(kind, path):
+    if kind == 'duckdb':
+        engine = create_engine(f'duckdb:///{path}')
+
+        @event.listens_for(engine, 'connect')
+        def set_search_path(dbapi_connection, connection_record):
+            # Queries sem schema (JOINs gerados pelo agente) resolvem para
+            # as tabelas do Spotify, como no search_path do Postgres.
+            dbapi_connection.execute(f"SET search_path = '{SCHEMA}'")
+
+        return engine
+
+    engine = create_engine('sqlite://')
+
+    @event.listens_for(engine, 'connect')
+    def attach_public(dbapi_connection, connection_record):
+        dbapi_connection.execute(
+            f'ATTACH DATABASE ? AS {SCHEMA}', (os.path.abspath(path),)
+        )
+
+    return engine
+
+
+def create_embedded_database(kind, data_dir=SPOTIFY_DATA_DIR, path=None):
+    """SQLDatabase sobre o banco embarcado, com o mesmo schema 'public' do
+    Postgres para que prompts, cache e rollups funcionem sem mudanças."""
+    from langchain_community.utilities import SQLDatabase
+
+    path, rebuilt = build_embedded_database(kind, data_dir, path)
+    engine = create_embedded_engine(kind, path)
+    if rebuilt:
+        _refresh_rollups(engine)
+    return SQLDatabase(engine, schema=SCHEMA, lazy_table_reflection=True)
+
+
+def _refresh_rollups(engine):
+    # O arquivo novo não tem as tabelas dos rollups definidos antes.
+    from rollups import refresh_rollups
+
+    try:
+        refresh_rollups(engine, SCHEMA, force=True)
+    except Exception as e:
+        logging.error(f'Erro ao atualizar os rollups do banco embarcado: {e}')
+
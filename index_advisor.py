@@ -0,0 +1,422 @@
+import argparse
+import logging
+import math
+import statistics
+import time
+from collections import Counter, defaultdict
+
+from sqlalchemy import Column, Index, MetaData, Table, create_engine, inspect
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+
+from column_stats import STATS_CACHE
+from constants import SPOTIFY_DATABASE_URI, SQLALCHEMY_DATABASE_URI
+from query_log import read_query_log
+
+
+# Peso de cada uso de coluna na estimativa: um índice ajuda mais num filtro
+# do que numa junção (o planner pode preferir hash join) ou numa ordenação.
+KIND_WEIGHTS = {'filter': 1.0, 'range': 1.0, 'join': 0.7, 'order': 0.4}
+# Seletividade assumida quando a coluna ainda não tem perfil calculado.
+DEFAULT_SELECTIVITY = 0.1
+# Filtros de intervalo (>, <, BETWEEN) não dependem do número de valores
+# distintos; mesmo padrão do planner do Postgres (DEFAULT_INEQ_SEL).
+RANGE_SELECTIVITY = 1 / 3
+# Tabelas menores que isso cabem em poucas páginas: índice não compensa.
+MIN_TABLE_ROWS = 1000
+
+SQLGLOT_DIALECTS = {'postgresql': 'postgres', 'oracle': 'oracle'}
+
+
+def _sqlglot():
+    try:
+        import sqlglot
+    except ImportError as e:
+        raise RuntimeError(
+            'O index_advisor requer sqlglot (pip install .[advisor]).'
+        ) from e
+    return sqlglot
+
+
+def _url_key(engine):
+    # Mesmo formato de schema_cache.database_key, usado no log de queries.
+    return engine.url.render_as_string(hide_password=True)
+
+
+# ------------------------------------------------------------------------
+# Uso de colunas nas queries
+# ------------------------------------------------------------------------
+
+
+def column_usage(query, dialect, table_columns):
+    """[(tabela, coluna, tipo de uso)] de uma query; tipo é 'filter'
+    (WHERE), 'range' (WHERE com >, <, BETWEEN), 'join' (ON) ou 'order'
+    (ORDER BY / GROUP BY)."""
+    sqlglot = _sqlglot()
+    from sqlglot import exp
+    from sqlglot.optimizer.scope import traverse_scope
+
+    try:
+        expression = sqlglot.parse_one(
+            query, read=SQLGLOT_DIALECTS.get(dialect, dialect)
+        )
+        scopes = traverse_scope(expression)
+    except Exception as e:
+        logging.debug(f'Query ignorada pelo advisor ({e}): {query[:200]}')
+        return []
+
+    kinds = {
+        exp.Where: 'filter',
+        exp.Join: 'join',
+        exp.Order: 'order',
+        exp.Group: 'order',
+    }
+    ranges = (exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between)
+    usage = []
+    for scope in scopes:
+        tables = {
+            alias: source.name
+            for alias, source in scope.sources.items()
+            if isinstance(source, exp.Table)
+        }
+        for column in scope.columns:
+            # scope.columns inclui as colunas de subqueries; cada uma é
+            # contada só no seu próprio SELECT.
+            if column.find_ancestor(exp.Select) is not scope.expression:
+                continue
+            clause = column.find_ancestor(
+                exp.Where, exp.Join, exp.Order, exp.Group, exp.Select
+            )
+            kind = kinds.get(type(clause))
+            if kind is None:
+                continue
+            if kind == 'filter' and isinstance(column.parent, ranges):
+                kind = 'range'
+            table = _resolve(column, tables, table_columns)
+            if table is not None:
+                usage.append((table, column.name, kind))
+    return usage
+
+
+def _resolve(column, tables, table_columns):
+    if column.table:
+        return tables.get(column.table)
+    candidates = [
+        table
+        for table in tables.values()
+        if column.name in table_columns.get(table, ())
+    ]
+    if len(candidates) == 1:
+        return candidates[0]
+    if len(tables) == 1 and not table_columns:
+        return next(iter(tables.values()))
+    return None
+
+
+def workload_usage(entries, table_columns):
+    """Agrega o uso de colunas do log: execuções, tipos e latência."""
+    usage = defaultdict(
+        lambda: dict(kinds=Counter(), executions=0, latency_ms=0.0)
+    )
+    total_latency = 0.0
+    for entry in entries:
+        if entry.get('error'):
+            continue
+        latency = entry.get('latency_ms') or 0.0
+        total_latency += latency
+        seen = set()
+        for table, column, kind in column_usage(
+            entry['query'], entry.get('dialect'), table_columns
+        ):
+            item = usage[(table, column)]
+            item['kinds'][kind] += 1
+            if (table, column) not in seen:
+                seen.add((table, column))
+                item['executions'] += 1
+                item['latency_ms'] += latency
+    return usage, total_latency
+
+
+# ------------------------------------------------------------------------
+# Índices existentes e propostas
+# ------------------------------------------------------------------------
+
+
+def _table_columns(inspector, schema):
+    return {
+        table: {
+            column['name'] for column in inspector.get_columns(table, schema)
+        }
+        for table in inspector.get_table_names(schema)
+    }
+
+
+def existing_indexes(inspector, schema, tables):
+    """{tabela: [colunas de cada índice]} incluindo a chave primária."""
+    indexes = {}
+    for table in tables:
+        found = [
+            list(index['column_names'])
+            for index in inspector.get_indexes(table, schema)
+        ]
+        primary = inspector.get_pk_constraint(table, schema)
+        if primary and primary.get('constrained_columns'):
+            found.append(list(primary['constrained_columns']))
+        indexes[table] = found
+    return indexes
+
+
+def _is_indexed(indexes, column):
+    # Só a coluna líder de um índice btree serve de ponto de entrada.
+    return any(columns and columns[0] == column for columns in indexes)
+
+
+def _table_rows(engine, schema, tables):
+    rows = {}
+    with engine.connect() as conn:
+        preparer = conn.dialect.identifier_preparer
+        for table in tables:
+            try:
+                rows[table] = conn.execute(
+                    text(
+                        f'SELECT count(*) FROM {preparer.quote(schema)}.'
+                        f'{preparer.quote(table)}'
+                    )
+                ).scalar()
+            except Exception as e:
+                logging.warning(f'Sem contagem de linhas para {table}: {e}')
+                rows[table] = 0
+    return rows
+
+
+def _selectivity(stats, table, column, kind='filter'):
+    if kind == 'range':
+        return RANGE_SELECTIVITY
+    profile = ((stats or {}).get('tables', {}).get(table) or {}).get(
+        'columns', {}
+    ).get(column)
+    if profile and profile.get('distinct'):
+        return 1 / profile['distinct']
+    return DEFAULT_SELECTIVITY
+
+
+def index_name(table, column):
+    return f'{table}_{column}_idx'.lower().replace(' ', '_')[:63]
+
+
+def index_ddl(engine, schema, table, column, concurrently=True):
+    target = Table(table, MetaData(), Column(column), schema=schema)
+    options = {}
+    if concurrently and engine.dialect.name == 'postgresql':
+        options['postgresql_concurrently'] = True
+    index = Index(index_name(table, column), target.c[column], **options)
+    return index, str(CreateIndex(index).compile(dialect=engine.dialect))
+
+
+def advise(
+    engine, schema='public', entries=None, top=10, min_rows=MIN_TABLE_ROWS
+):
+    """Propostas de índice para as colunas mais usadas no log de queries do
+    banco que ainda não têm índice, ordenadas pelo benefício estimado.
+
+    Cobre os bancos acessados via SQLAlchemy (Postgres e os locais): as
+    entradas são filtradas pela URL do engine. As queries do Oracle-ADB
+    ficam no log sob a chave 'oracle-adb' só para consulta; lá a
+    indexação é do próprio ADB (automatic indexing).
+    """
+    database = _url_key(engine)
+    if entries is None:
+        entries = list(read_query_log(database=database))
+    inspector = inspect(engine)
+    table_columns = _table_columns(inspector, schema)
+    usage, total_latency = workload_usage(entries, table_columns)
+
+    tables = sorted({table for table, _ in usage if table in table_columns})
+    indexes = existing_indexes(inspector, schema, tables)
+    stats = STATS_CACHE.get((database, schema))
+    rows = _table_rows(engine, schema, tables)
+
+    proposals = []
+    for (table, column), item in usage.items():
+        if table not in table_columns or column not in table_columns[table]:
+            continue
+        if _is_indexed(indexes[table], column) or rows[table] < min_rows:
+            continue
+        # Média dos usos: igualdade por 1/distintos, intervalo pelo padrão.
+        selectivity = sum(
+            _selectivity(stats, table, column, kind) * count
+            for kind, count in item['kinds'].items()
+        ) / sum(item['kinds'].values())
+        # Linhas que deixam de ser lidas por execução: varredura inteira
+        # contra o caminho do índice (~log2 N páginas + linhas que casam).
+        saved = max(
+            0.0,
+            rows[table] - rows[table] * selectivity - math.log2(rows[table]),
+        )
+        weight = sum(
+            KIND_WEIGHTS[kind] * count for kind, count in item['kinds'].items()
+        ) / sum(item['kinds'].values())
+        _, ddl = index_ddl(engine, schema, table, column)
+        proposals.append(
+            dict(
+                table=table,
+                column=column,
+                kinds=dict(item['kinds']),
+                executions=item['executions'],
+                latency_share=round(item['latency_ms'] / total_latency, 4)
+                if total_latency
+                else None,
+                table_rows=rows[table],
+                selectivity=round(selectivity, 6),
+                estimated_rows_saved=round(item['executions'] * weight * saved),
+                ddl=ddl,
+            )
+        )
+
+    proposals.sort(key=lambda p: p['estimated_rows_saved'], reverse=True)
+    return proposals[:top]
+
+
+# ------------------------------------------------------------------------
+# Avaliação num banco local
+# ------------------------------------------------------------------------
+
+
+def _replay_queries(entries, dialect, limit=50):
+    """Queries distintas do log (as mais frequentes), traduzidas para o
+    dialeto do banco onde o workload vai ser repetido."""
+    sqlglot = _sqlglot()
+    counts = Counter(
+        (entry['query'], entry.get('dialect'))
+        for entry in entries
+        if not entry.get('error')
+    )
+    queries = []
+    for (query, source_dialect), _ in counts.most_common(limit):
+        try:
+            query = sqlglot.transpile(
+                query,
+                read=SQLGLOT_DIALECTS.get(source_dialect, source_dialect),
+                write=SQLGLOT_DIALECTS.get(dialect, dialect),
+            )[0]
+        except Exception as e:
+            logging.debug(f'Query não traduzida ({e}), usada como está.')
+        queries.append(query)
+    return queries
+
+
+def replay(engine, queries, repeat=3):
+    """Mediana em ms de cada query (None quando ela falha no banco)."""
+    timings = {}
+    with engine.connect() as conn:
+        for query in queries:
+            samples = []
+            try:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    conn.exec_driver_sql(query).fetchall()
+                    samples.append(1000 * (time.perf_counter() - start))
+            except Exception as e:
+                logging.debug(f'Query falhou no replay ({e}): {query[:200]}')
+                conn.rollback()
+                timings[query] = None
+                continue
+            timings[query] = statistics.median(samples)
+    return timings
+
+
+def evaluate(engine, proposals, entries, schema='public', repeat=3, keep=False):
+    """Cria os índices propostos no banco (local), repete o workload do log
+    antes e depois e devolve os tempos. Sem keep, os índices são removidos
+    no fim."""
+    queries = _replay_queries(entries, engine.dialect.name)
+    before = replay(engine, queries, repeat)
+
+    created = []
+    with engine.begin() as conn:
+        for proposal in proposals:
+            index, _ = index_ddl(
+                engine,
+                schema,
+                proposal['table'],
+                proposal['column'],
+                concurrently=False,
+            )
+            index.create(conn, checkfirst=True)
+            created.append(index)
+    try:
+        after = replay(engine, queries, repeat)
+    finally:
+        if not keep:
+            with engine.begin() as conn:
+                for index in created:
+                    index.drop(conn, checkfirst=True)
+
+    compared = [
+        dict(query=query, before_ms=before[query], after_ms=after[query])
+        for query in queries
+        if before[query] is not None and after[query] is not None
+    ]
+    return dict(
+        queries=compared,
+        failed=sum(1 for q in queries if before[q] is None),
+        before_ms=round(sum(q['before_ms'] for q in compared), 3),
+        after_ms=round(sum(q['after_ms'] for q in compared), 3),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Sugere índices a partir do log de queries geradas.'
+    )
+    parser.add_argument(
+        '--uri',
+        action='append',
+        help='banco analisado (padrão: Spotify e migration)',
+    )
+    parser.add_argument('--schema', default='public')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument(
+        '--evaluate',
+        metavar='URI',
+        help='banco local onde aplicar os índices e repetir o workload',
+    )
+    parser.add_argument(
+        '--keep', action='store_true', help='mantém os índices avaliados'
+    )
+    args = parser.parse_args(argv)
+
+    uris = args.uri or [
+        uri for uri in (SPOTIFY_DATABASE_URI, SQLALCHEMY_DATABASE_URI) if uri
+    ]
+    for uri in uris:
+        engine = create_engine(uri)
+        entries = list(read_query_log(database=_url_key(engine)))
+        proposals = advise(engine, args.schema, entries, args.top)
+        print(f'{_url_key(engine)}: {len(entries)} queries no log')
+        for p in proposals:
+            print(
+                f'  {p["ddl"]};  -- {p["executions"]} execuções, '
+                f'{p["kinds"]}, ~{p["estimated_rows_saved"]:,} linhas poupadas'
+            )
+
+        if args.evaluate and proposals:
+            local = create_engine(args.evaluate)
+            result = evaluate(
+                local, proposals, entries, args.schema, keep=args.keep
+            )
+            print(
+                f'  workload local: {result["before_ms"]:.1f}ms -> '
+                f'{result["after_ms"]:.1f}ms '
+                f'({len(result["queries"])} queries, '
+                f'{result["failed"]} falharam)'
+            )
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+    )
+    main()
@@ -0,0 +1,153 @@
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import oracledb
+from constants import (
+    ORACLE_POOL_MIN,
+    ORACLE_POOL_MAX,
+    ORACLE_POOL_INCREMENT,
+    ORACLE_POOL_PING_INTERVAL,
+    ORACLE_POOL_WAIT_TIMEOUT,
+)
+from wallet_credentials import (
+    username,
+    password,
+    config,
+    wallet_path,
+    wallet_password,
+    DSN,
+)
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_STATS_LOCK = threading.Lock()
+_STATS = {
+    'acquires': 0,
+    'acquire_seconds': 0.0,
+    'max_acquire_seconds': 0.0,
+    'dropped_sessions': 0,
+    'failed_health_checks': 0,
+}
+
+
+def connect_params():
+    return dict(
+        user=username,
+        password=password,
+        dsn=DSN,
+        config_dir=config,
+        wallet_location=wallet_path,
+        wallet_password=wallet_password,
+    )
+
+
+def create_pool(
+    min_sessions=ORACLE_POOL_MIN,
+    max_sessions=ORACLE_POOL_MAX,
+    increment=ORACLE_POOL_INCREMENT,
+    ping_interval=ORACLE_POOL_PING_INTERVAL,
+    wait_timeout=ORACLE_POOL_WAIT_TIMEOUT,
+):
+    # ping_interval faz o pool testar sessões ociosas antes de entregá-las,
+    # então conexões derrubadas pelo ADB são trocadas sem erro para o caller.
+    return oracledb.create_pool(
+        min=min_sessions,
+        max=max_sessions,
+        increment=increment,
+        ping_interval=ping_interval,
+        getmode=oracledb.POOL_GETMODE_TIMEDWAIT,
+        wait_timeout=wait_timeout,
+        **connect_params(),
+    )
+
+
+def get_pool():
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                logging.info(
+                    'Creating Oracle-ADB session pool (min=%s, max=%s, increment=%s).',
+                    ORACLE_POOL_MIN,
+                    ORACLE_POOL_MAX,
+                    ORACLE_POOL_INCREMENT,
+                )
+                _POOL = create_pool()
+                atexit.register(close_pool)
+    return _POOL
+
+
+def close_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            try:
+                _POOL.close(force=True)
+            except oracledb.Error as e:
+                logging.warning('Error closing Oracle-ADB session pool: %s', e)
+            _POOL = None
+
+
+@contextmanager
+def acquire_connection():
+    pool = get_pool()
+    start = time.perf_counter()
+    connection = pool.acquire()
+    elapsed = time.perf_counter() - start
+
+    with _STATS_LOCK:
+        _STATS['acquires'] += 1
+        _STATS['acquire_seconds'] += elapsed
+        _STATS['max_acquire_seconds'] = max(
+            _STATS['max_acquire_seconds'], elapsed
+        )
+
+    try:
+        yield connection
+    finally:
+        if connection.is_healthy():
+            pool.release(connection)
+        else:
+            logging.warning('Dropping unhealthy Oracle-ADB session.')
+            with _STATS_LOCK:
+                _STATS['dropped_sessions'] += 1
+            pool.drop(connection)
+
+
+def check_pool_health():
+    try:
+        with acquire_connection() as connection:
+            connection.ping()
+        return True
+    except oracledb.Error as e:
+        logging.error('Oracle-ADB pool health check failed: %s', e)
+        with _STATS_LOCK:
+            _STATS['failed_health_checks'] += 1
+        return False
+
+
+def pool_stats():
+    with _STATS_LOCK:
+        stats = dict(_STATS)
+
+    acquires = stats['acquires']
+    stats['avg_acquire_ms'] = (
+        1000 * stats['acquire_seconds'] / acquires if acquires else 0.0
+    )
+    stats['max_acquire_ms'] = 1000 * stats.pop('max_acquire_seconds')
+    stats.pop('acquire_seconds')
+
+    pool = _POOL
+    if pool is not None:
+        stats.update(
+            opened=pool.opened,
+            busy=pool.busy,
+            min=pool.min,
+            max=pool.max,
+            increment=pool.increment,
+        )
+    return stats
@@ -0,0 +1,63 @@
+import hashlib
+import math
+import os
+
+import pandas as pd
+from caching import PersistentCache
+from constants import CACHE_DIR, PLOT_CACHE_MAX_ENTRIES
+
+
+# Cardinalidade estimada sobre no máximo esta quantidade de linhas.
+CARDINALITY_SAMPLE_ROWS = 10000
+
+PLOT_CACHE = PersistentCache(
+    'plot_code',
+    path=os.path.join(CACHE_DIR, 'plot_code.pkl'),
+    max_entries=PLOT_CACHE_MAX_ENTRIES,
+)
+
+
+def template_version(template: str) -> str:
+    return hashlib.sha1(template.encode('utf-8')).hexdigest()[:12]
+
+
+def _cardinality_bucket(series, rows):
+    distinct = series.nunique(dropna=True)
+    if distinct <= 1:
+        return 'constant'
+    if distinct <= 20:
+        return 'low'
+    if distinct <= 0.5 * rows:
+        return 'medium'
+    return 'high'
+
+
+def frame_signature(df: pd.DataFrame):
+    sample = df
+    if len(df) > CARDINALITY_SAMPLE_ROWS:
+        sample = df.sample(CARDINALITY_SAMPLE_ROWS, random_state=0)
+
+    columns = tuple(
+        (
+            str(column),
+            str(sample.iloc[:, i].dtype),
+            _cardinality_bucket(sample.iloc[:, i], len(sample)),
+        )
+        for i, column in enumerate(df.columns)
+    )
+    # Linhas em faixas de potência de 2: 100 e 120 linhas caem na mesma.
+    rows_bucket = int(math.log2(len(df))) if len(df) else -1
+    return columns, rows_bucket
+
+
+def get_plot_code(df, scope):
+    return PLOT_CACHE.get((frame_signature(df), scope))
+
+
+def put_plot_code(df, scope, code):
+    PLOT_CACHE.put((frame_signature(df), scope), code)
+    PLOT_CACHE.save()
+
+
+def plot_cache_stats():
+    return PLOT_CACHE.stats()
@@ -0,0 +1,251 @@
+import io
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from constants import PLOT_POOL_WORKERS, PLOT_TIMEOUT, PLOT_MEMORY_LIMIT_MB
+from tracing import span
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+class PlotExecutionError(Exception):
+    pass
+
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+# Fila pela qual os workers avisam que começaram um job; o prazo de cada
+# plot conta a partir daí, não do submit (o job pode esperar na fila do pool).
+_STARTS = None
+_STARTED = {}
+_JOB_IDS = itertools.count()
+
+# Lado do worker: a mesma fila, recebida no initializer.
+_WORKER_STARTS = None
+
+# Margem além do timeout do próprio worker antes de matar o processo.
+KILL_GRACE_SECONDS = 5
+
+
+# ------------------------------------------------------------------------
+# Lado do worker
+# ------------------------------------------------------------------------
+
+
+def _limit_memory(limit_mb):
+    try:
+        import resource
+
+        with open('/proc/self/statm') as f:
+            baseline = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+        # O limite vale para o que o snippet alocar além das bibliotecas
+        # que o worker já carregou.
+        limit = baseline + limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, OSError, ValueError) as e:
+        logging.warning(f'Limite de memória do worker não aplicado: {e}')
+
+
+def _init_worker(memory_limit_mb, starts=None):
+    global _WORKER_STARTS
+    _WORKER_STARTS = starts
+
+    import matplotlib
+
+    matplotlib.use('Agg')
+    import matplotlib.pyplot  # noqa: F401
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+    import seaborn  # noqa: F401
+
+    if memory_limit_mb:
+        _limit_memory(memory_limit_mb)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _on_alarm(signum, frame):
+    raise PlotExecutionError('Plot code exceeded its time limit.')
+
+
+def _load_frame(payload):
+    kind, data = payload
+    if kind == 'arrow':
+        return pa.ipc.open_stream(data).read_pandas()
+    return pickle.loads(data)
+
+
+def _render(job, code, payload, fmt, timeout):
+    import signal
+
+    if _WORKER_STARTS is not None:
+        _WORKER_STARTS.put(job)
+
+    import matplotlib.pyplot as plt
+    import numpy as np
+    import pandas as pd
+    import seaborn as sns
+
+    has_alarm = hasattr(signal, 'SIGALRM')
+    if has_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.alarm(timeout)
+
+    try:
+        namespace = {
+            'df': _load_frame(payload),
+            'pd': pd,
+            'np': np,
+            'plt': plt,
+            'sns': sns,
+        }
+        exec(code, namespace)
+
+        fig = namespace.get('fig')
+        if not isinstance(fig, plt.Figure):
+            fig = plt.gcf()
+        if not any(ax.has_data() for ax in fig.axes):
+            return None
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt, bbox_inches='tight')
+        return buffer.getvalue()
+    finally:
+        if has_alarm:
+            signal.alarm(0)
+        plt.close('all')
+
+
+# ------------------------------------------------------------------------
+# Lado do servidor
+# ------------------------------------------------------------------------
+
+
+def _dump_frame(df):
+    if pa is not None:
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return 'arrow', sink.getvalue().to_pybytes()
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            logging.debug(f'DataFrame não serializável em Arrow: {e}')
+    return 'pickle', pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _watch_starts(starts):
+    while True:
+        job = starts.get()
+        if job is None:
+            return
+        started = _STARTED.get(job)
+        if started is not None:
+            started.set()
+
+
+def get_executor():
+    global _EXECUTOR, _STARTS
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                # spawn: o servidor do Streamlit tem threads, e fork herdaria
+                # locks em estado inconsistente.
+                context = multiprocessing.get_context('spawn')
+                _STARTS = context.SimpleQueue()
+                threading.Thread(
+                    target=_watch_starts, args=(_STARTS,), daemon=True
+                ).start()
+                _EXECUTOR = ProcessPoolExecutor(
+                    max_workers=PLOT_POOL_WORKERS,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(PLOT_MEMORY_LIMIT_MB, _STARTS),
+                )
+    return _EXECUTOR
+
+
+def _stop_watching(starts):
+    if starts is not None:
+        starts.put(None)
+
+
+def warm_up():
+    executor = get_executor()
+    futures = [executor.submit(_ping) for _ in range(PLOT_POOL_WORKERS)]
+    return [future.result() for future in futures]
+
+
+def _reset_executor(executor):
+    global _EXECUTOR, _STARTS
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is executor:
+            _EXECUTOR = None
+            _stop_watching(_STARTS)
+            _STARTS = None
+    for process in list(getattr(executor, '_processes', {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown():
+    global _EXECUTOR, _STARTS
+    with _EXECUTOR_LOCK:
+        executor, _EXECUTOR = _EXECUTOR, None
+        starts, _STARTS = _STARTS, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+    _stop_watching(starts)
+
+
+def render_plot(code, df, fmt='png', timeout=PLOT_TIMEOUT):
+    with span('plot.render', mode='code', rows=len(df)) as render_span:
+        image = _render_in_pool(code, df, fmt, timeout)
+        render_span.set(bytes=len(image or b''))
+        return image
+
+
+def _render_in_pool(code, df, fmt, timeout):
+    executor = get_executor()
+    job = next(_JOB_IDS)
+    started = _STARTED[job] = threading.Event()
+    try:
+        future = executor.submit(
+            _render, job, code, _dump_frame(df), fmt, timeout
+        )
+        # Enquanto o job espera na fila não há o que matar; um job que termina
+        # sem começar (pool quebrado, cancelado) também libera a espera.
+        future.add_done_callback(lambda _: started.set())
+        started.wait()
+        done, _ = wait([future], timeout=timeout + KILL_GRACE_SECONDS)
+    finally:
+        _STARTED.pop(job, None)
+    if not done:
+        logging.error('Worker de plotagem travado, reiniciando o pool.')
+        _reset_executor(executor)
+        raise PlotExecutionError('Plot code exceeded its time limit.')
+
+    try:
+        return future.result()
+    except PlotExecutionError:
+        raise
+    except BrokenProcessPool as e:
+        logging.error(f'Worker de plotagem morreu, reiniciando o pool: {e}')
+        _reset_executor(executor)
+        raise PlotExecutionError('Plot worker crashed.') from e
+    except MemoryError as e:
+        raise PlotExecutionError('Plot code exceeded its memory limit.') from e
+    except Exception as e:
+        raise PlotExecutionError(f'Error executing plot code: {e}') from e
@@ -0,0 +1,415 @@
+import io
+import json
+import re
+
+import numpy as np
+import pandas as pd
+from constants import PLOT_MAX_POINTS
+from plot_executor import PlotExecutionError
+from tracing import span
+
+
+CHARTS = ['bar', 'line', 'scatter', 'histogram', 'box', 'heatmap']
+AGGREGATIONS = ['sum', 'mean', 'median', 'count', 'min', 'max']
+
+MAX_BARS = 30
+MAX_GROUPS = 8
+MAX_HEATMAP_CELLS = 30
+HISTOGRAM_BINS = 50
+DENSITY_BINS = 200
+FIGSIZE = (11, 7)
+
+
+def describe_columns(df: pd.DataFrame) -> str:
+    return '\n'.join(
+        f'{column}: {dtype}' for column, dtype in df.dtypes.items()
+    )
+
+
+def _is_numeric(series: pd.Series) -> bool:
+    if pd.api.types.is_numeric_dtype(series):
+        return True
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return True
+    # Colunas object com números (Decimal do Postgres, por exemplo) são
+    # convertidas na hora de desenhar.
+    sample = series.dropna().head(1000)
+    return bool(pd.to_numeric(sample, errors='coerce').notna().any())
+
+
+def _check_columns(spec: dict, df: pd.DataFrame):
+    """Confere as colunas que cada tipo de gráfico exige, para que um spec
+    aceito aqui não falhe só na hora de desenhar."""
+    chart, x, y, value = spec['chart'], spec['x'], spec['y'], spec['value']
+
+    def numeric(key, name):
+        if not _is_numeric(df[name]):
+            raise ValueError(
+                f'Chart {chart!r} needs a numeric {key} column; '
+                f'{name!r} is {df[name].dtype}.'
+            )
+
+    counting = spec['aggregation'] == 'count'
+    if chart != 'heatmap' and x is None:
+        raise ValueError(f'Chart {chart!r} needs an x column.')
+    if spec['hue'] is not None and spec['hue'] in (x, y):
+        raise ValueError(f'Chart {chart!r} needs a hue different from x/y.')
+    if chart in ('bar', 'line') and y is not None and not counting:
+        numeric('y', y)
+    elif chart == 'scatter':
+        if y is None:
+            raise ValueError("Chart 'scatter' needs a y column.")
+        if x == y:
+            raise ValueError("Chart 'scatter' needs different x and y.")
+        numeric('x', x)
+        numeric('y', y)
+    elif chart == 'histogram':
+        numeric('x', x)
+    elif chart == 'box' and y is not None:
+        numeric('y', y)
+    elif chart == 'box':
+        numeric('x', x)
+    elif chart == 'heatmap':
+        if x is not None and x == y:
+            raise ValueError("Chart 'heatmap' needs different x and y.")
+        if x is not None and y is not None:
+            if value is not None and not counting:
+                numeric('value', value)
+        elif len(df.select_dtypes('number').columns) < 2:
+            raise ValueError(
+                "Chart 'heatmap' needs x and y, or at least two numeric "
+                'columns for a correlation matrix.'
+            )
+
+
+def parse_plot_spec(text: str, df: pd.DataFrame) -> dict:
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    if not match:
+        raise ValueError('No JSON object found in the LLM response.')
+    raw = json.loads(match.group(0))
+
+    chart = str(raw.get('chart', '')).lower()
+    if chart not in CHARTS:
+        raise ValueError(f'Unsupported chart type: {chart!r}.')
+
+    columns = {str(column).lower(): column for column in df.columns}
+
+    def column(key):
+        name = raw.get(key)
+        if name in (None, '', 'null'):
+            return None
+        if name in df.columns:
+            return name
+        if str(name).lower() in columns:
+            return columns[str(name).lower()]
+        raise ValueError(f'Unknown column for {key!r}: {name!r}.')
+
+    aggregation = raw.get('aggregation')
+    aggregation = str(aggregation).lower() if aggregation else None
+    if aggregation not in AGGREGATIONS:
+        aggregation = None
+
+    spec = dict(
+        chart=chart,
+        x=column('x'),
+        y=column('y'),
+        hue=column('hue'),
+        value=column('value'),
+        aggregation=aggregation,
+        title=str(raw.get('title') or ''),
+    )
+    _check_columns(spec, df)
+    return spec
+
+
+# ------------------------------------------------------------------------
+# Redução dos dados antes de desenhar
+# ------------------------------------------------------------------------
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int):
+    """Largest-Triangle-Three-Buckets: mantém a forma visual da série."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    previous = 0
+
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        area = np.abs(
+            (x[previous] - avg_x) * (bucket_y - y[previous])
+            - (x[previous] - bucket_x) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        keep[i + 1] = previous
+
+    return x[keep], y[keep]
+
+
+def _numeric_axis(series: pd.Series) -> np.ndarray:
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=float)
+
+
+def _aggregate(df, by, y, aggregation):
+    if y is None or aggregation == 'count':
+        return df.groupby(by, observed=True).size()
+    return df.groupby(by, observed=True)[y].agg(aggregation or 'sum')
+
+
+def _top_groups(df, hue):
+    if hue is None:
+        return [(None, df)]
+    top = df[hue].value_counts().index[:MAX_GROUPS]
+    return [(group, df[df[hue] == group]) for group in top]
+
+
+# ------------------------------------------------------------------------
+# Desenho
+# ------------------------------------------------------------------------
+
+
+def _draw_bar(ax, df, spec, max_points):
+    x, y, hue = spec['x'], spec['y'], spec['hue']
+    if hue is None:
+        values = _aggregate(df, x, y, spec['aggregation'])
+        values = values.sort_values(ascending=False).head(MAX_BARS)[::-1]
+        ax.barh(
+            values.index.astype(str), values.to_numpy(), label=y or 'count'
+        )
+    else:
+        values = _aggregate(df, [x, hue], y, spec['aggregation'])
+        values = values.unstack(hue)
+        top_x = values.sum(axis=1).sort_values(ascending=False)
+        top_x = top_x.index[:MAX_BARS]
+        top_hue = values.sum(axis=0).sort_values(ascending=False).index
+        values = values.loc[top_x[::-1], top_hue[:MAX_GROUPS]].fillna(0)
+        positions = np.arange(len(values))
+        height = 0.8 / max(1, len(values.columns))
+        for i, group in enumerate(values.columns):
+            ax.barh(
+                positions + i * height,
+                values[group].to_numpy(),
+                height=height,
+                label=str(group),
+            )
+        ax.set_yticks(positions + 0.4 - height / 2)
+        ax.set_yticklabels(values.index.astype(str))
+    ax.set_ylabel(x)
+    ax.set_xlabel(y or 'count')
+
+
+def _draw_line(ax, df, spec, max_points):
+    x, y = spec['x'], spec['y']
+    groups = _top_groups(df, spec['hue'])
+    per_group = max(3, max_points // len(groups))
+
+    for group, data in groups:
+        if y is None or spec['aggregation']:
+            series = _aggregate(data, x, y, spec['aggregation'])
+        else:
+            series = data[[x, y]].dropna().set_index(x)[y]
+        series = series.sort_index()
+        index = series.index.to_series()
+
+        categorical = not (
+            pd.api.types.is_numeric_dtype(index)
+            or pd.api.types.is_datetime64_any_dtype(index)
+        )
+        if categorical:
+            xs = np.arange(len(series), dtype=float)
+        else:
+            xs = _numeric_axis(index)
+        ys = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float)
+        valid = ~(np.isnan(xs) | np.isnan(ys))
+        xs, ys = lttb(xs[valid], ys[valid], per_group)
+
+        if pd.api.types.is_datetime64_any_dtype(index):
+            xs = pd.to_datetime(xs)
+        ax.plot(xs, ys, label=y if group is None else str(group))
+
+        if categorical and group is None:
+            ticks = np.linspace(0, len(series) - 1, min(len(series), 20))
+            ticks = ticks.astype(int)
+            ax.set_xticks(ticks)
+            ax.set_xticklabels(series.index[ticks].astype(str), rotation=90)
+    ax.set_xlabel(x)
+    ax.set_ylabel(y or 'count')
+
+
+def _draw_scatter(ax, df, spec, max_points):
+    x, y, hue = spec['x'], spec['y'], spec['hue']
+    if y is None:
+        raise ValueError('Scatter plots need a y column.')
+    data = df[list(dict.fromkeys(c for c in (x, y, hue) if c is not None))]
+    data = data.dropna()
+    xs, ys = _numeric_axis(data[x]), _numeric_axis(data[y])
+    valid = ~(np.isnan(xs) | np.isnan(ys))
+    data, xs, ys = data[valid], xs[valid], ys[valid]
+
+    if len(data) > max_points and hue is None:
+        # Muitos pontos: densidade em grade fixa em vez de um marcador por
+        # linha, então o custo do desenho não depende do número de linhas.
+        counts, x_edges, y_edges = np.histogram2d(
+            xs, ys, bins=DENSITY_BINS
+        )
+        mesh = ax.pcolormesh(
+            x_edges, y_edges, np.ma.masked_equal(counts.T, 0), cmap='viridis'
+        )
+        ax.figure.colorbar(mesh, ax=ax, label='rows')
+    else:
+        if len(data) > max_points:
+            rng = np.random.default_rng(0)
+            index = rng.choice(len(data), size=max_points, replace=False)
+            data, xs, ys = data.iloc[index], xs[index], ys[index]
+        for group, _ in _top_groups(data, hue):
+            mask = (
+                np.ones(len(data), dtype=bool)
+                if group is None
+                else (data[hue] == group).to_numpy()
+            )
+            ax.scatter(
+                xs[mask],
+                ys[mask],
+                s=12,
+                alpha=0.7,
+                label=y if group is None else str(group),
+            )
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+
+
+def _draw_histogram(ax, df, spec, max_points):
+    x = spec['x']
+    for group, data in _top_groups(df, spec['hue']):
+        values = _numeric_axis(data[x])
+        values = values[~np.isnan(values)]
+        if not len(values):
+            continue
+        counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+        ax.stairs(
+            counts,
+            edges,
+            fill=group is None,
+            label=x if group is None else str(group),
+        )
+    ax.set_xlabel(x)
+    ax.set_ylabel('count')
+
+
+def _draw_box(ax, df, spec, max_points):
+    x, y = spec['x'], spec['y']
+    if y is None:
+        column, groups = x, [(x, df)]
+    else:
+        column = y
+        top = df[x].value_counts().index[:MAX_BARS]
+        groups = [(group, df[df[x] == group]) for group in top]
+
+    # Só os quartis e os extremos dos bigodes vão para o matplotlib, nunca
+    # as linhas inteiras.
+    stats = []
+    for label, data in groups:
+        values = _numeric_axis(data[column])
+        values = values[~np.isnan(values)]
+        if not len(values):
+            continue
+        q1, med, q3 = np.percentile(values, [25, 50, 75])
+        iqr = q3 - q1
+        low, high = q1 - 1.5 * iqr, q3 + 1.5 * iqr
+        inside = values[(values >= low) & (values <= high)]
+        stats.append(
+            dict(
+                label=str(label),
+                q1=q1,
+                med=med,
+                q3=q3,
+                whislo=inside.min(),
+                whishi=inside.max(),
+                fliers=[],
+            )
+        )
+    if not stats:
+        raise ValueError(f'No numeric values in {column!r} to plot.')
+    ax.bxp(stats, showfliers=False)
+    ax.set_ylabel(column)
+
+
+def _draw_heatmap(ax, df, spec, max_points):
+    x, y, value = spec['x'], spec['y'], spec['value']
+    if x is None or y is None:
+        matrix = df.select_dtypes('number').corr()
+        title = 'correlation'
+    else:
+        top_x = df[x].value_counts().index[:MAX_HEATMAP_CELLS]
+        top_y = df[y].value_counts().index[:MAX_HEATMAP_CELLS]
+        data = df[df[x].isin(top_x) & df[y].isin(top_y)]
+        matrix = (
+            _aggregate(data, [y, x], value, spec['aggregation'])
+            .unstack(x)
+            .astype(float)
+        )
+        title = value or 'count'
+
+    image = ax.imshow(matrix.to_numpy(), aspect='auto', cmap='viridis')
+    ax.set_xticks(range(len(matrix.columns)))
+    ax.set_xticklabels(matrix.columns.astype(str), rotation=90)
+    ax.set_yticks(range(len(matrix.index)))
+    ax.set_yticklabels(matrix.index.astype(str))
+    ax.grid(False)
+    ax.figure.colorbar(image, ax=ax, label=title)
+
+
+DRAWERS = {
+    'bar': _draw_bar,
+    'line': _draw_line,
+    'scatter': _draw_scatter,
+    'histogram': _draw_histogram,
+    'box': _draw_box,
+    'heatmap': _draw_heatmap,
+}
+
+
+def render_plot_spec(df, spec, max_points=PLOT_MAX_POINTS):
+    import matplotlib.style
+    from matplotlib.figure import Figure
+
+    # Figure direto (sem pyplot) não toca no estado global do matplotlib,
+    # então várias sessões podem desenhar ao mesmo tempo.
+    with matplotlib.style.context('ggplot'):
+        fig = Figure(figsize=FIGSIZE)
+        ax = fig.add_subplot()
+        DRAWERS[spec['chart']](ax, df, spec, max_points)
+        if spec.get('title'):
+            ax.set_title(spec['title'])
+        if ax.get_legend_handles_labels()[0]:
+            ax.legend()
+        fig.tight_layout()
+    return fig
+
+
+def render_plot_spec_png(df, spec, max_points=PLOT_MAX_POINTS):
+    with span(
+        'plot.render', mode='spec', chart=spec['chart'], rows=len(df)
+    ) as render_span:
+        try:
+            fig = render_plot_spec(df, spec, max_points)
+        except Exception as e:
+            # Mesmo contrato do modo de código: quem chama trata um único
+            # tipo de erro de desenho.
+            raise PlotExecutionError(f'Error rendering plot spec: {e}') from e
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+        render_span.set(bytes=buffer.tell())
+        return buffer.getvalue()
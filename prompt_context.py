@@ -0,0 +1,263 @@
+import logging
+import math
+import re
+import threading
+from collections import Counter
+
+from answer_cache import normalize_question
+from column_stats import format_table_profile, get_column_stats
+from constants import SCHEMA_CONTEXT_MAX_TOKENS, FRAME_PREVIEW_MAX_TOKENS
+from schema_cache import database_key, format_table_info, get_schema_catalog
+from tracing import span
+
+
+NGRAM_SIZE = 3
+# Similaridade mínima de trigramas para uma palavra da pergunta casar com um
+# termo do schema ("artistas" ~ "artist", "diarios" ~ "daily" não).
+TERM_SIMILARITY = 0.45
+# Tabelas com score abaixo desta fração do melhor ficam de fora.
+MIN_RELATIVE_SCORE = 0.2
+MAX_SAMPLE_TERMS = 200
+
+NAME_WEIGHT = 3.0
+COLUMN_WEIGHT = 2.0
+SAMPLE_WEIGHT = 1.0
+
+STOPWORDS = frozenset(
+    """
+    the and for with what which who how many much show list from that this
+    are have has per all top each give
+    que qual quais quem como quanto quantos quantas mostre liste lista com
+    por para pelo pela pelos pelas dos das nos nas uma uns umas mais menos
+    entre sobre cada todos todas tem ter sao seus suas
+    """.split()
+)
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    # Aproximação usual de ~4 caracteres por token; suficiente para orçamento.
+    return len(text) // 4 + 1
+
+
+def _words(text):
+    words = normalize_question(
+        re.sub(r'([a-z])([A-Z])', r'\1 \2', str(text))
+    ).replace('_', ' ')
+    return [w for w in words.split() if len(w) >= 3 and not w.isdigit()]
+
+
+def _trigrams(word):
+    padded = f' {word} '
+    return Counter(padded[i : i + NGRAM_SIZE] for i in range(len(padded) - 2))
+
+
+def _similarity(a, b):
+    dot = sum(count * b.get(gram, 0) for gram, count in a.items())
+    if not dot:
+        return 0.0
+    norm_a = math.sqrt(sum(v * v for v in a.values()))
+    norm_b = math.sqrt(sum(v * v for v in b.values()))
+    return dot / (norm_a * norm_b)
+
+
+# ------------------------------------------------------------------------
+# Índice do schema
+# ------------------------------------------------------------------------
+
+
+def build_index(catalog, stats=None):
+    """Termos de cada tabela (nome, colunas e valores de amostra ou os mais
+    frequentes do perfil) com peso."""
+    index = {}
+    for table, info in catalog['tables'].items():
+        terms = {}
+
+        def add(text, weight):
+            for word in _words(text):
+                if terms.get(word, (0, None))[0] < weight:
+                    terms[word] = (weight, _trigrams(word))
+
+        add(table, NAME_WEIGHT)
+        for column, _ in info['columns']:
+            add(column, COLUMN_WEIGHT)
+        values = [v for row in info['sample'] for v in row.values()]
+        profile = _table_stats(stats, table)
+        if profile is not None:
+            values += [
+                value
+                for column in profile['columns'].values()
+                for value, _ in column['top']
+            ]
+        for value in [v for v in values if isinstance(v, str)][
+            :MAX_SAMPLE_TERMS
+        ]:
+            add(value, SAMPLE_WEIGHT)
+        index[table] = terms
+    return index
+
+
+def get_index(db, schema, catalog, stats=None):
+    key = (
+        database_key(db),
+        schema,
+        catalog['fingerprint'],
+        stats['updated_at'] if stats else None,
+    )
+    index = _INDEXES.get(key)
+    if index is None:
+        index = build_index(catalog, stats)
+        with _INDEXES_LOCK:
+            if len(_INDEXES) > 32:
+                _INDEXES.clear()
+            _INDEXES[key] = index
+    return index
+
+
+def rank_tables(index, question):
+    words = [w for w in dict.fromkeys(_words(question)) if w not in STOPWORDS]
+    matches = {table: {} for table in index}
+
+    for word in words:
+        grams = _trigrams(word)
+        for table, terms in index.items():
+            best = 0.0
+            for term, (weight, term_grams) in terms.items():
+                similarity = 1.0 if term == word else _similarity(
+                    grams, term_grams
+                )
+                if similarity >= TERM_SIMILARITY:
+                    best = max(best, similarity * weight)
+            if best:
+                matches[table][word] = best
+
+    # Palavras que casam com todas as tabelas pesam pouco (IDF).
+    n_tables = len(index)
+    scores = {}
+    for table, found in matches.items():
+        scores[table] = sum(
+            score
+            * math.log(
+                1 + n_tables / sum(1 for m in matches.values() if word in m)
+            )
+            for word, score in found.items()
+        )
+    return scores
+
+
+def _table_stats(stats, table):
+    if not stats:
+        return None
+    return stats['tables'].get(table)
+
+
+def _table_block(catalog, stats, table, sample_limit):
+    # O perfil das colunas (quando o job já calculou) substitui as linhas de
+    # amostra: menor e diz mais sobre faixas e valores frequentes.
+    profile = _table_stats(stats, table)
+    if profile is not None:
+        return format_table_profile(table, profile)
+    return format_table_info(
+        {'tables': {table: catalog['tables'][table]}}, sample_limit
+    )
+
+
+def format_schema(catalog, stats=None, tables=None, sample_limit=6):
+    tables = list(catalog['tables']) if tables is None else tables
+    return ''.join(
+        _table_block(catalog, stats, table, sample_limit) for table in tables
+    )
+
+
+def select_tables(catalog, stats, index, question, max_tokens, sample_limit):
+    """Tabelas mais relevantes para a pergunta que cabem no orçamento, ou
+    None quando a pergunta não dá sinal nenhum (usa-se o schema inteiro)."""
+    scores = rank_tables(index, question)
+    top = max(scores.values(), default=0.0)
+    if top <= 0:
+        return None
+
+    chosen, used = [], 0
+    for table in sorted(scores, key=scores.get, reverse=True):
+        if scores[table] < MIN_RELATIVE_SCORE * top:
+            break
+        cost = estimate_tokens(
+            _table_block(catalog, stats, table, sample_limit)
+        )
+        if chosen and used + cost > max_tokens:
+            continue
+        chosen.append(table)
+        used += cost
+    return chosen
+
+
+def schema_context(
+    db,
+    schema='public',
+    question=None,
+    max_tokens=SCHEMA_CONTEXT_MAX_TOKENS,
+    sample_limit=6,
+):
+    """Devolve (table_info, tabelas escolhidas ou None para o schema todo)."""
+    catalog = get_schema_catalog(db, schema, sample_limit)
+    stats = get_column_stats(db, schema)
+    if stats is not None and stats['fingerprint'] != catalog['fingerprint']:
+        stats = None
+    full = format_schema(catalog, stats, sample_limit=sample_limit)
+
+    with span('schema.context', schema=schema) as context_span:
+        tables = None
+        if question and max_tokens and estimate_tokens(full) > max_tokens:
+            try:
+                index = get_index(db, schema, catalog, stats)
+                tables = select_tables(
+                    catalog, stats, index, question, max_tokens, sample_limit
+                )
+            except Exception as e:
+                logging.error(f'Erro ao selecionar tabelas relevantes: {e}')
+                tables = None
+
+        if tables is None:
+            info = full
+        else:
+            info = format_schema(catalog, stats, tables, sample_limit)
+        context_span.set(
+            profiles=stats is not None,
+            tables=len(tables) if tables is not None else len(catalog['tables']),
+            tokens=estimate_tokens(info),
+            full_tokens=estimate_tokens(full),
+        )
+    return info, tables
+
+
+# ------------------------------------------------------------------------
+# Amostra de DataFrame para os prompts de plotagem
+# ------------------------------------------------------------------------
+
+
+def frame_preview(
+    df, rows=10, max_tokens=FRAME_PREVIEW_MAX_TOKENS, max_chars=40, **kwargs
+):
+    """df.head(rows).to_string(), com textos longos cortados e menos linhas
+    quando a amostra passa do orçamento de tokens."""
+    head = df.head(rows).copy()
+    # Por posição: JOINs (a.id, b.id) geram colunas com o mesmo nome.
+    for i in range(head.shape[1]):
+        column = head.iloc[:, i]
+        if column.dtype == object:
+            head.isetitem(
+                i,
+                column.map(
+                    lambda v: v[: max_chars - 1] + '…'
+                    if isinstance(v, str) and len(v) > max_chars
+                    else v
+                ),
+            )
+
+    text = head.to_string(**kwargs)
+    while len(head) > 3 and estimate_tokens(text) > max_tokens:
+        head = head.iloc[: max(3, len(head) // 2)]
+        text = head.to_string(**kwargs)
+    return text
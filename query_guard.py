@@ -0,0 +1,203 @@
+import json
+import logging
+import uuid
+from contextlib import contextmanager
+
+from constants import (
+    QUERY_GUARD,
+    QUERY_MAX_COST,
+    QUERY_MAX_ROWS,
+    QUERY_STATEMENT_TIMEOUT_MS,
+)
+from tracing import span
+
+
+class QueryRejected(Exception):
+    """A query gerada passou do orçamento de custo do EXPLAIN."""
+
+    def __init__(self, decision):
+        super().__init__(decision['reason'])
+        self.decision = decision
+
+
+def _strip(query):
+    return query.strip().rstrip(';').strip()
+
+
+# ------------------------------------------------------------------------
+# Estimativas do otimizador
+# ------------------------------------------------------------------------
+
+
+def estimate_postgres(engine, query):
+    # Cursor cru, como no COPY do arrow_fetch: sem parâmetros, o psycopg2
+    # não interpreta '%' e ':' dentro da query.
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {query}')
+        plan = cursor.fetchone()[0]
+        cursor.close()
+        raw.rollback()
+    finally:
+        raw.close()
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]['Plan']
+    return float(root['Total Cost']), int(root['Plan Rows'])
+
+
+def estimate_oracle(connection, query):
+    statement_id = f'genbi_{uuid.uuid4().hex[:16]}'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {query}"
+        )
+        try:
+            cursor.execute(
+                'SELECT cost, cardinality FROM plan_table '
+                'WHERE statement_id = :statement_id AND id = 0',
+                statement_id=statement_id,
+            )
+            cost, rows = cursor.fetchone()
+        finally:
+            cursor.execute(
+                'DELETE FROM plan_table WHERE statement_id = :statement_id',
+                statement_id=statement_id,
+            )
+    return float(cost or 0), int(rows or 0)
+
+
+def limit_query(query, dialect, limit):
+    # Quebra de linha antes do ')', como no arrow_fetch: um comentário '--'
+    # no fim da query não engole o resto do SQL.
+    if dialect == 'oracle':
+        return f'SELECT * FROM ({query}\n) FETCH FIRST {limit} ROWS ONLY'
+    return f'SELECT * FROM ({query}\n) AS _guarded LIMIT {limit}'
+
+
+# ------------------------------------------------------------------------
+# Admissão
+# ------------------------------------------------------------------------
+
+
+def review_query(
+    query, dialect, estimate, max_cost=QUERY_MAX_COST, max_rows=QUERY_MAX_ROWS
+):
+    """Decide se a query roda como está, com LIMIT, ou se é recusada.
+
+    estimate(query) devolve (custo, linhas) do EXPLAIN. A decisão é um dict
+    com action ('allow', 'limit' ou 'reject'), a query final e o motivo.
+    """
+    query = _strip(query)
+    decision = dict(
+        action='allow',
+        dialect=dialect,
+        original=query,
+        query=query,
+        cost=None,
+        rows=None,
+        reason=None,
+    )
+
+    try:
+        cost, rows = estimate(query)
+    except Exception as e:
+        # Se nem o EXPLAIN passa, a própria query vai falhar com uma
+        # mensagem de erro melhor; a guarda não decide nada aqui.
+        logging.debug(f'EXPLAIN falhou, query liberada sem estimativa: {e}')
+        return decision
+    decision.update(cost=cost, rows=rows)
+
+    if rows > max_rows:
+        limited = limit_query(query, dialect, max_rows)
+        decision.update(
+            action='limit',
+            query=limited,
+            reason=(
+                f'Estimated {rows:,} rows, over the budget of {max_rows:,}: '
+                f'results were limited to {max_rows:,} rows.'
+            ),
+        )
+        try:
+            cost, _ = estimate(limited)
+            decision['cost'] = cost
+        except Exception as e:
+            logging.debug(f'EXPLAIN da query com LIMIT falhou: {e}')
+
+    if cost > max_cost:
+        decision.update(
+            action='reject',
+            query=None,
+            reason=(
+                f'Estimated cost {cost:,.0f} is over the budget of '
+                f'{max_cost:,.0f}; the query was not executed. '
+                f'Try filtering or aggregating the data further.'
+            ),
+        )
+    return decision
+
+
+def _admit(query, dialect, estimate):
+    with span('sql.guard', dialect=dialect) as guard_span:
+        decision = review_query(query, dialect, estimate)
+        guard_span.set(
+            action=decision['action'],
+            cost=decision['cost'],
+            estimated_rows=decision['rows'],
+        )
+
+    if decision['action'] == 'reject':
+        logging.warning(f'Query recusada pela guarda: {decision["reason"]}')
+        raise QueryRejected(decision)
+    if decision['action'] == 'limit':
+        logging.warning(f'Query limitada pela guarda: {decision["reason"]}')
+    return decision['query'], decision
+
+
+# As duas devolvem (query final, decisão). A decisão é None com a guarda
+# desligada; quem executa a query a leva junto com o resultado.
+
+
+def guard_postgres_query(engine, query):
+    if not QUERY_GUARD or engine.dialect.name != 'postgresql':
+        return query, None
+    return _admit(query, 'postgresql', lambda q: estimate_postgres(engine, q))
+
+
+def guard_oracle_query(connection, query):
+    if not QUERY_GUARD:
+        return query, None
+    return _admit(query, 'oracle', lambda q: estimate_oracle(connection, q))
+
+
+# ------------------------------------------------------------------------
+# Timeouts por statement
+# ------------------------------------------------------------------------
+
+
+def postgres_engine_args(uri, timeout_ms=QUERY_STATEMENT_TIMEOUT_MS):
+    # statement_timeout vale para a sessão inteira desde o login, então
+    # cobre também o COPY, os cursores server-side e as ferramentas do agente.
+    if not timeout_ms or not uri.startswith('postgresql'):
+        return {}
+    return {
+        'connect_args': {'options': f'-c statement_timeout={timeout_ms}'}
+    }
+
+
+@contextmanager
+def oracle_call_timeout(connection, timeout_ms=QUERY_STATEMENT_TIMEOUT_MS):
+    # call_timeout limita cada round-trip da sessão; é restaurado na saída
+    # porque as chamadas ao Select AI usam a mesma sessão e demoram mais.
+    if not timeout_ms or not hasattr(connection, 'call_timeout'):
+        yield connection
+        return
+
+    previous = connection.call_timeout
+    connection.call_timeout = timeout_ms
+    try:
+        yield connection
+    finally:
+        connection.call_timeout = previous
@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from constants import QUERY_LOG, QUERY_LOG_PATH, QUERY_LOG_MAX_BYTES
+
+
+_LOCK = threading.Lock()
+
+
+def _rotate(path, max_bytes):
+    try:
+        if os.path.getsize(path) < max_bytes:
+            return
+    except OSError:
+        return
+    os.replace(path, path + '.1')
+
+
+def record_query(
+    database,
+    dialect,
+    query,
+    latency_ms=None,
+    rows=None,
+    source=None,
+    schema=None,
+    error=None,
+    path=QUERY_LOG_PATH,
+):
+    """Acrescenta uma execução ao log de queries; nunca propaga erros para
+    quem executou a query."""
+    if not QUERY_LOG or not query:
+        return
+    entry = dict(
+        at=time.time(),
+        database=database,
+        dialect=dialect,
+        schema=schema,
+        source=source,
+        query=query.strip(),
+        latency_ms=None if latency_ms is None else round(latency_ms, 3),
+        rows=rows,
+        error=error,
+    )
+    try:
+        with _LOCK:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            _rotate(path, QUERY_LOG_MAX_BYTES)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, default=str) + '\n')
+    except Exception as e:
+        logging.warning(f'Erro ao gravar o log de queries: {e}')
+
+
+def read_query_log(path=QUERY_LOG_PATH, database=None, include_rotated=True):
+    """Execuções registradas, das mais antigas às mais novas."""
+    paths = [path + '.1', path] if include_rotated else [path]
+    for current in paths:
+        if not os.path.exists(current):
+            continue
+        with open(current, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if database is None or entry.get('database') == database:
+                    yield entry
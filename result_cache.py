@@ -0,0 +1,80 @@
+import re
+
+import pandas as pd
+from caching import PersistentCache
+from constants import RESULT_CACHE_TTL, RESULT_CACHE_MAX_BYTES
+
+
+# Colunas de texto com poucos valores distintos (até esta fração das linhas)
+# são guardadas como category: um código inteiro por linha mais o dicionário.
+CATEGORY_MAX_RATIO = 0.5
+
+_QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+
+def normalize_sql(query: str) -> str:
+    parts = _QUOTED.split(query.strip().rstrip(';').strip())
+    return ''.join(
+        part if i % 2 else ' '.join(part.split())
+        for i, part in enumerate(parts)
+    )
+
+
+def compact_frame(df: pd.DataFrame):
+    original_dtypes = {}
+    columns = {}
+    for position, column in enumerate(df.columns):
+        series = df.iloc[:, position]
+        if series.dtype == object and len(series):
+            distinct = series.nunique(dropna=True)
+            if distinct <= CATEGORY_MAX_RATIO * len(series):
+                original_dtypes[position] = series.dtype
+                series = series.astype('category')
+        columns[position] = series
+
+    compact = pd.DataFrame(columns, index=df.index)
+    compact.columns = df.columns
+    # attrs (o rollup que serviu a query, por exemplo) não sobrevivem à
+    # reconstrução do frame; vão à parte na entrada do cache.
+    return compact, original_dtypes, dict(df.attrs)
+
+
+def restore_frame(entry) -> pd.DataFrame:
+    compact, original_dtypes, attrs = entry
+    df = compact.copy()
+    for position, dtype in original_dtypes.items():
+        df.isetitem(position, df.iloc[:, position].astype(dtype))
+    df.attrs = dict(attrs)
+    return df
+
+
+def frame_nbytes(entry) -> int:
+    compact = entry[0]
+    return int(compact.memory_usage(deep=True, index=True).sum())
+
+
+RESULT_CACHE = PersistentCache(
+    'result_cache',
+    ttl=RESULT_CACHE_TTL,
+    max_bytes=RESULT_CACHE_MAX_BYTES,
+    sizeof=frame_nbytes,
+)
+
+
+def result_key(database, schema, query):
+    return (database, schema, normalize_sql(query))
+
+
+def get_result(database, schema, query):
+    entry = RESULT_CACHE.get(result_key(database, schema, query))
+    return restore_frame(entry) if entry is not None else None
+
+
+def put_result(database, schema, query, df, ttl=None):
+    return RESULT_CACHE.put(
+        result_key(database, schema, query), compact_frame(df), ttl=ttl
+    )
+
+
+def result_cache_stats():
+    return RESULT_CACHE.stats()
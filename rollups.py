@@ -0,0 +1,589 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy import types as sqltypes
+
+from caching import PersistentCache
+from column_stats import change_counters
+from constants import (
+    CACHE_DIR,
+    ROLLUPS,
+    ROLLUP_CHECK_INTERVAL,
+    SPOTIFY_DATABASE_URI,
+)
+from query_log import read_query_log
+from tracing import span
+
+
+TABLE_PREFIX = 'genbi_rollup_'
+ROWS_COLUMN = '_rows'
+# Agregados guardados por coluna medida; AVG é recomposto de sum/count.
+MEASURES = ('sum', 'count', 'min', 'max')
+SQLGLOT_DIALECTS = {'postgresql': 'postgres', 'oracle': 'oracle'}
+
+ROLLUP_CACHE = PersistentCache(
+    'rollups', path=os.path.join(CACHE_DIR, 'rollups.pkl')
+)
+
+_CHECKED_AT = {}
+_LOCK = threading.Lock()
+
+
+def _database(engine):
+    # Mesmo formato de schema_cache.database_key.
+    return engine.url.render_as_string(hide_password=True)
+
+
+def _sqlglot():
+    try:
+        import sqlglot
+    except ImportError:
+        return None
+    return sqlglot
+
+
+def measure_column(kind, column):
+    return f'{kind}_{column}'
+
+
+# ------------------------------------------------------------------------
+# Definição e atualização
+# ------------------------------------------------------------------------
+
+
+def _registry_mtime():
+    try:
+        return os.stat(ROLLUP_CACHE.path).st_mtime_ns
+    except OSError:
+        return None
+
+
+_REGISTRY_MTIME = _registry_mtime()
+
+
+def _sync_registry():
+    """Relê o registro do disco quando outro processo (o loader do
+    Spotify, a CLI) o gravou: sem isso o app compararia os contadores com
+    versões antigas e trataria os rollups refeitos como desatualizados."""
+    global _REGISTRY_MTIME
+    mtime = _registry_mtime()
+    if mtime is None or mtime == _REGISTRY_MTIME:
+        return
+    with _LOCK:
+        if mtime == _REGISTRY_MTIME:
+            return
+        ROLLUP_CACHE.load()
+        _REGISTRY_MTIME = mtime
+        _CHECKED_AT.clear()
+
+
+def get_rollups(engine, schema='public'):
+    _sync_registry()
+    return ROLLUP_CACHE.get((_database(engine), schema)) or {}
+
+
+def _save_rollups(engine, schema, updates, removed=()):
+    # Relê o registro antes de gravar: só os rollups alterados aqui são
+    # sobrescritos, não as versões que outro processo gravou nesse meio
+    # tempo (durante o build_rollup, por exemplo).
+    global _REGISTRY_MTIME
+    rollups = dict(get_rollups(engine, schema))
+    rollups.update(updates)
+    for name in removed:
+        rollups.pop(name, None)
+    with _LOCK:
+        ROLLUP_CACHE.put((_database(engine), schema), rollups)
+        ROLLUP_CACHE.save()
+        _REGISTRY_MTIME = _registry_mtime()
+
+
+def _build_sql(preparer, schema, definition, target):
+    quote = preparer.quote
+    group = [quote(c) for c in definition['group_by']]
+    measures = [f'COUNT(*) AS {quote(ROWS_COLUMN)}']
+    for column in definition['measures']:
+        for kind in MEASURES:
+            if kind == 'sum' and column not in definition['numeric']:
+                continue
+            measures.append(
+                f'{kind.upper()}({quote(column)}) AS '
+                f'{quote(measure_column(kind, column))}'
+            )
+    select = ', '.join(group + measures)
+    sql = (
+        f'CREATE TABLE {quote(schema)}.{quote(target)} AS SELECT {select} '
+        f'FROM {quote(schema)}.{quote(definition["source"])}'
+    )
+    if group:
+        sql += f' GROUP BY {", ".join(group)}'
+    return sql
+
+
+def build_rollup(engine, definition, schema='public'):
+    """(Re)cria a tabela do rollup numa tabela nova e troca as duas numa
+    transação, como o loader do Spotify: quem consulta nunca vê o rollup
+    pela metade."""
+    table = definition['table']
+    staging = f'{table}__new'
+    with engine.begin() as conn:
+        quote = conn.dialect.identifier_preparer.quote
+        counters = change_counters(conn, schema, [definition['source']])
+        conn.exec_driver_sql(
+            f'DROP TABLE IF EXISTS {quote(schema)}.{quote(staging)}'
+        )
+        conn.exec_driver_sql(
+            _build_sql(
+                conn.dialect.identifier_preparer, schema, definition, staging
+            )
+        )
+        conn.exec_driver_sql(
+            f'DROP TABLE IF EXISTS {quote(schema)}.{quote(table)}'
+        )
+        conn.exec_driver_sql(
+            f'ALTER TABLE {quote(schema)}.{quote(staging)} '
+            f'RENAME TO {quote(table)}'
+        )
+        rows = conn.exec_driver_sql(
+            f'SELECT count(*) FROM {quote(schema)}.{quote(table)}'
+        ).scalar()
+        types = _column_types(conn, schema, table)
+    return dict(
+        definition,
+        version=counters.get(definition['source'], (None, 0))[0],
+        refreshed_at=time.time(),
+        rows=rows,
+        types=types,
+    )
+
+
+def _column_types(conn, schema, table):
+    """{coluna: tipo no dialeto do banco} da tabela do rollup; a reescrita
+    devolve cada agregado ao tipo que ele teria na tabela base."""
+    types = {}
+    for column in inspect(conn).get_columns(table, schema):
+        try:
+            types[column['name']] = column['type'].compile(
+                dialect=conn.dialect
+            )
+        except Exception:
+            types[column['name']] = None
+    return types
+
+
+def define_rollup(
+    engine, source, group_by, measures, schema='public', name=None
+):
+    """Registra e materializa um rollup de `source` agrupado por
+    `group_by`, com sum/count/min/max de cada coluna de `measures`."""
+    name = name or '_'.join([source, *group_by]).lower().replace(' ', '_')
+    types = {
+        c['name']: c['type'] for c in inspect(engine).get_columns(source, schema)
+    }
+    definition = dict(
+        name=name,
+        table=(TABLE_PREFIX + name)[:63],
+        source=source,
+        group_by=list(group_by),
+        measures=list(measures),
+        # SUM (e AVG) só para colunas numéricas; as demais guardam
+        # count/min/max.
+        numeric=[
+            c
+            for c in measures
+            if isinstance(types.get(c), (sqltypes.Integer, sqltypes.Numeric))
+        ],
+    )
+    built = build_rollup(engine, definition, schema)
+    _save_rollups(engine, schema, {name: built})
+    logging.info(
+        f'Rollup {name} criado sobre {source}: {built["rows"]} linhas.'
+    )
+    return built
+
+
+def drop_rollup(engine, name, schema='public'):
+    definition = get_rollups(engine, schema).get(name)
+    if definition is None:
+        return
+    with engine.begin() as conn:
+        quote = conn.dialect.identifier_preparer.quote
+        conn.exec_driver_sql(
+            f'DROP TABLE IF EXISTS {quote(schema)}.{quote(definition["table"])}'
+        )
+    _save_rollups(engine, schema, {}, removed=[name])
+
+
+def refresh_rollups(engine, schema='public', tables=None, force=False):
+    """Reconstrói só os rollups cujas tabelas base mudaram (contador de
+    mudanças do Postgres; contagem de linhas nos outros bancos)."""
+    rollups = dict(get_rollups(engine, schema))
+    if tables is not None:
+        tables = set(tables)
+    with engine.connect() as conn:
+        counters = change_counters(
+            conn, schema, sorted({r['source'] for r in rollups.values()})
+        )
+
+    refreshed = []
+    for name, definition in rollups.items():
+        if tables is not None and definition['source'] not in tables:
+            continue
+        current = counters.get(definition['source'], (None, 0))[0]
+        if not force and current == definition.get('version'):
+            continue
+        try:
+            rollups[name] = build_rollup(engine, definition, schema)
+            refreshed.append(name)
+        except Exception as e:
+            logging.error(f'Erro ao atualizar o rollup {name}: {e}')
+    if refreshed:
+        _save_rollups(
+            engine, schema, {name: rollups[name] for name in refreshed}
+        )
+        logging.info(f'Rollups atualizados: {", ".join(refreshed)}.')
+    with _LOCK:
+        _CHECKED_AT.pop((_database(engine), schema), None)
+    return refreshed
+
+
+def suggest_rollups(entries, table_columns, min_count=3):
+    """Agrupamentos frequentes no log de queries, como definições prontas
+    para define_rollup: (tabela, colunas de grupo, colunas agregadas)."""
+    usage = Counter()
+    measures = {}
+    for entry in entries:
+        if entry.get('error'):
+            continue
+        shape = _aggregate_shape(
+            entry['query'], entry.get('dialect'), table_columns
+        )
+        if shape is None:
+            continue
+        source, group_by, measured = shape
+        key = (source, group_by)
+        usage[key] += 1
+        measures.setdefault(key, set()).update(measured)
+    return [
+        dict(
+            source=source,
+            group_by=list(group_by),
+            measures=sorted(measures[(source, group_by)]),
+            queries=count,
+        )
+        for (source, group_by), count in usage.most_common()
+        if count >= min_count
+    ]
+
+
+# ------------------------------------------------------------------------
+# Reescrita de queries
+# ------------------------------------------------------------------------
+
+
+def _parse_aggregate(query, dialect):
+    """Árvore do SELECT agregado sobre uma única tabela, ou None quando a
+    query tem junções, subqueries, janelas ou não agrega nada."""
+    sqlglot = _sqlglot()
+    if sqlglot is None:
+        return None
+    from sqlglot import exp
+
+    try:
+        tree = sqlglot.parse_one(
+            query, read=SQLGLOT_DIALECTS.get(dialect, dialect)
+        )
+    except Exception:
+        return None
+    if not isinstance(tree, exp.Select) or tree.args.get('joins'):
+        return None
+    if tree.find(exp.Subquery, exp.Window, exp.Union):
+        return None
+    tables = list(tree.find_all(exp.Table))
+    if len(tables) != 1 or not tree.find(exp.AggFunc):
+        return None
+    return tree
+
+
+def _aggregate_shape(query, dialect, table_columns):
+    tree = _parse_aggregate(query, dialect)
+    if tree is None:
+        return None
+    from sqlglot import exp
+
+    source = tree.find(exp.Table).name
+    group = tree.args.get('group')
+    group_by = tuple(
+        sorted(
+            {c.name for c in group.find_all(exp.Column)} if group else ()
+        )
+    )
+    measured = {
+        c.name
+        for agg in tree.find_all(exp.AggFunc)
+        for c in agg.find_all(exp.Column)
+    }
+    known = table_columns.get(source)
+    if known is not None and not set(group_by) | measured <= known:
+        return None
+    return source, group_by, measured
+
+
+def _fresh_rollups(engine, schema):
+    """Rollups cujas tabelas base não mudaram desde a última atualização;
+    os contadores são lidos no máximo a cada ROLLUP_CHECK_INTERVAL s."""
+    rollups = get_rollups(engine, schema)
+    if not rollups:
+        return []
+    key = (_database(engine), schema)
+    with _LOCK:
+        checked = _CHECKED_AT.get(key)
+    if checked is None or time.time() - checked[0] > ROLLUP_CHECK_INTERVAL:
+        with engine.connect() as conn:
+            counters = change_counters(
+                conn, schema, sorted({r['source'] for r in rollups.values()})
+            )
+        stale = {
+            name
+            for name, r in rollups.items()
+            if counters.get(r['source'], (None, 0))[0] != r.get('version')
+        }
+        if stale:
+            logging.warning(
+                f'Rollups desatualizados ignorados: {", ".join(sorted(stale))}.'
+            )
+        checked = (time.time(), stale)
+        with _LOCK:
+            _CHECKED_AT[key] = checked
+    return [r for name, r in rollups.items() if name not in checked[1]]
+
+
+def _rewrite_with(tree, rollup, dialect, schema='public'):
+    """Aplica o rollup à árvore (in place) se a query só agrupa/filtra por
+    colunas do grupo e só agrega colunas medidas; devolve True se aplicou.
+
+    O resultado precisa ser igual ao da query original, inclusive nos nomes
+    e tipos das colunas; quando isso não dá para garantir, não reescreve.
+    """
+    from sqlglot import exp
+
+    read = SQLGLOT_DIALECTS.get(dialect, dialect)
+    table = tree.find(exp.Table)
+    if table.name.lower() != rollup['source'].lower():
+        return False
+    if table.db and table.db.lower() != (schema or 'public').lower():
+        return False
+    # Projeções agregadas sem alias: o nome da coluna é o que o banco daria
+    # à query original. Só é previsível no Postgres e para um agregado
+    # simples ("count", "sum", ...); nos demais casos a query fica como está.
+    names = {}
+    for i, projection in enumerate(tree.expressions):
+        if projection.alias or not projection.find(exp.AggFunc):
+            continue
+        if dialect != 'postgresql' or not isinstance(projection, exp.AggFunc):
+            return False
+        names[i] = projection.key
+
+    group = {c.lower() for c in rollup['group_by']}
+    measured = {c.lower(): c for c in rollup['measures']}
+    numeric = {c.lower() for c in rollup['numeric']}
+    aliases = {e.alias.lower() for e in tree.expressions if e.alias}
+
+    for column in tree.find_all(exp.Column):
+        if column.find_ancestor(exp.AggFunc) is not None:
+            continue
+        name = column.name.lower()
+        if name in group:
+            continue
+        # Aliases da projeção só valem no ORDER BY; no WHERE e no GROUP BY o
+        # nome se refere à coluna da tabela base.
+        if name in aliases and column.find_ancestor(exp.Order) is not None:
+            continue
+        return False
+
+    types = rollup.get('types') or {}
+
+    def typed(expression, type_name):
+        return exp.cast(expression, _data_type(type_name, read))
+
+    def count_of(column):
+        # SUM de nenhuma linha é NULL, COUNT é 0: sem o COALESCE um filtro
+        # que não casa com nada daria resultados diferentes. O SUM de
+        # contagens vira numeric/HUGEINT; o CAST devolve o BIGINT do COUNT.
+        return typed(
+            exp.Coalesce(
+                this=exp.Sum(this=exp.column(column, quoted=True)),
+                expressions=[exp.Literal.number(0)],
+            ),
+            'BIGINT',
+        )
+
+    replacements = []
+    for agg in tree.find_all(exp.AggFunc):
+        argument = agg.this
+        if isinstance(agg, exp.Count) and isinstance(argument, exp.Star):
+            replacements.append((agg, count_of(ROWS_COLUMN)))
+            continue
+        if not isinstance(argument, exp.Column):
+            return False
+        column = measured.get(argument.name.lower())
+        if column is None:
+            return False
+        if isinstance(agg, (exp.Sum, exp.Avg)) and column.lower() not in numeric:
+            return False
+
+        def stored(kind):
+            return exp.column(measure_column(kind, column), quoted=True)
+
+        if isinstance(agg, exp.Sum):
+            # SUM de somas guardadas muda o tipo (bigint -> numeric no
+            # Postgres); volta ao tipo da soma original, guardada no rollup.
+            sum_type = types.get(measure_column('sum', column))
+            if dialect == 'sqlite':
+                # Tipagem dinâmica: soma de inteiros continua inteira.
+                new = exp.Sum(this=stored('sum'))
+            elif _data_type(sum_type, read) is None:
+                return False
+            else:
+                new = typed(exp.Sum(this=stored('sum')), sum_type)
+        elif isinstance(agg, exp.Count):
+            new = count_of(measure_column('count', column))
+        elif isinstance(agg, exp.Min):
+            new = exp.Min(this=stored('min'))
+        elif isinstance(agg, exp.Max):
+            new = exp.Max(this=stored('max'))
+        elif isinstance(agg, exp.Avg):
+            if dialect == 'postgresql':
+                average = _average_type(
+                    types.get(measure_column('min', column))
+                )
+                if average is None:
+                    return False
+            else:
+                average = 'DOUBLE'
+            new = exp.Div(
+                this=typed(exp.Sum(this=stored('sum')), average),
+                expression=exp.Nullif(
+                    this=typed(exp.Sum(this=stored('count')), average),
+                    expression=exp.Literal.number(0),
+                ),
+            )
+        else:
+            return False
+        replacements.append((agg, new))
+
+    for i, name in names.items():
+        tree.expressions[i] = exp.alias_(
+            tree.expressions[i], name, quoted=True, copy=False
+        )
+
+    for old, new in replacements:
+        old.replace(new)
+    if not table.alias:
+        table.set('alias', exp.TableAlias(this=exp.to_identifier(table.name)))
+    table.set('this', exp.to_identifier(rollup['table']))
+    return True
+
+
+def _data_type(type_name, read):
+    from sqlglot import exp
+
+    if not type_name:
+        return None
+    try:
+        return exp.DataType.build(type_name, dialect=read)
+    except Exception:
+        return None
+
+
+def _average_type(source_type):
+    # AVG no Postgres: double precision para colunas float, numeric para
+    # inteiros e numeric (o tipo da coluna original sai do min guardado).
+    if not source_type:
+        return None
+    if source_type.upper() in ('REAL', 'FLOAT', 'DOUBLE PRECISION'):
+        return 'DOUBLE PRECISION'
+    return 'NUMERIC'
+
+
+def rewrite_query(engine, query, schema='public'):
+    """Devolve (query, nome do rollup ou None). A query só é reescrita
+    quando um rollup atualizado dá exatamente o mesmo resultado."""
+    if not ROLLUPS:
+        return query, None
+    try:
+        rollups = _fresh_rollups(engine, schema or 'public')
+    except Exception as e:
+        logging.debug(f'Rollups indisponíveis: {e}')
+        return query, None
+    if not rollups:
+        return query, None
+
+    dialect = engine.dialect.name
+    with span('sql.rollup') as rollup_span:
+        for rollup in rollups:
+            tree = _parse_aggregate(query, dialect)
+            if tree is None:
+                break
+            if _rewrite_with(tree, rollup, dialect, schema):
+                rewritten = tree.sql(SQLGLOT_DIALECTS.get(dialect, dialect))
+                rollup_span.set(rollup=rollup['name'])
+                logging.info(f'Query servida pelo rollup {rollup["name"]}.')
+                return rewritten, rollup['name']
+    return query, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Gerencia os rollups (agregados materializados).'
+    )
+    parser.add_argument('command', choices=('suggest', 'list', 'refresh'))
+    parser.add_argument('--uri', default=SPOTIFY_DATABASE_URI)
+    parser.add_argument('--schema', default='public')
+    parser.add_argument(
+        '--create',
+        action='store_true',
+        help='com suggest: materializa os rollups sugeridos',
+    )
+    parser.add_argument('--force', action='store_true')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.uri)
+    if args.command == 'suggest':
+        inspector = inspect(engine)
+        table_columns = {
+            table: {c['name'] for c in inspector.get_columns(table, args.schema)}
+            for table in inspector.get_table_names(args.schema)
+        }
+        entries = read_query_log(database=_database(engine))
+        for suggestion in suggest_rollups(entries, table_columns):
+            print(suggestion)
+            if args.create:
+                define_rollup(
+                    engine,
+                    suggestion['source'],
+                    suggestion['group_by'],
+                    suggestion['measures'],
+                    args.schema,
+                )
+    elif args.command == 'list':
+        for name, rollup in get_rollups(engine, args.schema).items():
+            print(
+                f'{name}: {rollup["source"]} por {rollup["group_by"]}, '
+                f'{rollup["rows"]} linhas'
+            )
+    else:
+        print(refresh_rollups(engine, args.schema, force=args.force))
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+    )
+    main()
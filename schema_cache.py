@@ -0,0 +1,261 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import inspect, text
+from caching import PersistentCache
+from constants import CACHE_DIR, SCHEMA_CACHE_TTL
+from tracing import span
+
+
+SAMPLE_LIMIT = 6
+SAMPLE_BATCH_SIZE = 50
+
+CATALOG_QUERY = """
+SELECT c.table_name, c.column_name, c.data_type
+FROM information_schema.columns c
+JOIN information_schema.tables t
+  ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+WHERE t.table_type = 'BASE TABLE' AND c.table_schema = :schema
+ORDER BY c.table_name, c.ordinal_position
+"""
+
+FINGERPRINT_QUERY = """
+SELECT md5(string_agg(
+    c.table_name || '.' || c.column_name || ':' || c.data_type, ','
+    ORDER BY c.table_name, c.ordinal_position
+))
+FROM information_schema.columns c
+JOIN information_schema.tables t
+  ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+WHERE t.table_type = 'BASE TABLE' AND c.table_schema = :schema
+"""
+
+# Catálogo do usuário do Oracle-ADB (as tabelas que o Select AI enxerga),
+# usado para validar a SQL gerada antes de executá-la.
+ORACLE_CATALOG_QUERY = """
+SELECT table_name, column_name, LOWER(data_type)
+FROM user_tab_columns
+ORDER BY table_name, column_id
+"""
+
+SCHEMA_CACHE = PersistentCache(
+    'schema_catalog',
+    ttl=SCHEMA_CACHE_TTL,
+    path=os.path.join(CACHE_DIR, 'schema_catalog.pkl'),
+)
+
+
+def database_key(db):
+    return db._engine.url.render_as_string(hide_password=True)
+
+
+def _fingerprint_rows(rows):
+    payload = ','.join(
+        f'{table}.{column}:{dtype}' for table, column, dtype in rows
+    )
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+
+def _is_postgres(db):
+    return db._engine.dialect.name == 'postgresql'
+
+
+def _inspect_catalog_rows(conn, schema):
+    # Outros dialetos (SQLite/DuckDB locais) não têm o mesmo
+    # information_schema; o inspector do SQLAlchemy cobre todos eles.
+    inspector = inspect(conn)
+    return [
+        (table, column['name'], str(column['type']).lower())
+        for table in sorted(inspector.get_table_names(schema=schema))
+        for column in inspector.get_columns(table, schema=schema)
+    ]
+
+
+def fetch_schema_fingerprint(db, schema='public'):
+    if not _is_postgres(db):
+        with db._engine.connect() as conn:
+            return _fingerprint_rows(_inspect_catalog_rows(conn, schema))
+
+    with db._engine.connect() as conn:
+        fingerprint = conn.execute(
+            text(FINGERPRINT_QUERY), {'schema': schema}
+        ).scalar()
+    # Schema vazio: string_agg retorna NULL, mesmo hash do catálogo vazio.
+    return fingerprint or _fingerprint_rows([])
+
+
+def _fetch_catalog_rows(conn, schema):
+    return [
+        tuple(row)
+        for row in conn.execute(text(CATALOG_QUERY), {'schema': schema})
+    ]
+
+
+def _fetch_samples_per_table(conn, schema, tables, sample_limit):
+    quote = conn.dialect.identifier_preparer.quote
+    samples = {}
+    for table in tables:
+        result = conn.execute(
+            text(
+                f'SELECT * FROM {quote(schema)}.{quote(table)} '
+                f'LIMIT {int(sample_limit)}'
+            )
+        )
+        columns = list(result.keys())
+        samples[table] = [dict(zip(columns, row)) for row in result]
+    return samples
+
+
+def _fetch_samples(conn, schema, tables, sample_limit):
+    if conn.dialect.name != 'postgresql':
+        return _fetch_samples_per_table(conn, schema, tables, sample_limit)
+
+    quote = conn.dialect.identifier_preparer.quote
+    samples = {table: [] for table in tables}
+
+    for start in range(0, len(tables), SAMPLE_BATCH_SIZE):
+        batch = tables[start : start + SAMPLE_BATCH_SIZE]
+        selects = []
+        params = {'limit': sample_limit}
+        for i, table in enumerate(batch):
+            params[f't{i}'] = table
+            selects.append(
+                f'(SELECT CAST(:t{i} AS text) AS table_name, '
+                f'row_to_json(s)::text AS row '
+                f'FROM (SELECT * FROM {quote(schema)}.{quote(table)} '
+                f'LIMIT :limit) s)'
+            )
+        statement = text('\nUNION ALL\n'.join(selects))
+        for table, row in conn.execute(statement, params):
+            samples[table].append(json.loads(row))
+
+    return samples
+
+
+def build_schema_catalog(db, schema='public', sample_limit=SAMPLE_LIMIT):
+    start = time.perf_counter()
+    with db._engine.connect() as conn:
+        if _is_postgres(db):
+            rows = _fetch_catalog_rows(conn, schema)
+        else:
+            rows = _inspect_catalog_rows(conn, schema)
+
+        tables = {}
+        for table, column, dtype in rows:
+            tables.setdefault(table, {'columns': [], 'sample': []})
+            tables[table]['columns'].append((column, dtype))
+
+        try:
+            samples = _fetch_samples(conn, schema, list(tables), sample_limit)
+        except Exception as e:
+            logging.error(f'Erro ao obter amostras do schema {schema}: {e}')
+            samples = {}
+
+    for table, sample in samples.items():
+        tables[table]['sample'] = sample
+
+    catalog = dict(
+        schema=schema,
+        tables=tables,
+        fingerprint=_fingerprint_rows(rows),
+        sample_limit=sample_limit,
+        built_at=time.time(),
+    )
+    logging.info(
+        f'Catálogo do schema {schema} construído com {len(tables)} tabelas '
+        f'em {time.perf_counter() - start:.2f}s.'
+    )
+    return catalog
+
+
+def get_schema_catalog(
+    db, schema='public', sample_limit=SAMPLE_LIMIT, refresh=False
+):
+    key = (database_key(db), schema)
+
+    with span('schema.catalog', schema=schema) as catalog_span:
+        if not refresh:
+            catalog = SCHEMA_CACHE.get(key)
+            if catalog is not None and catalog['sample_limit'] >= sample_limit:
+                catalog_span.set(cache='hit')
+                return catalog
+
+            # TTL vencido: um único SELECT no information_schema decide se o
+            # catálogo salvo ainda vale, sem reamostrar as tabelas.
+            stale = SCHEMA_CACHE.get(key, allow_stale=True)
+            if stale is not None and stale['sample_limit'] >= sample_limit:
+                try:
+                    with span('schema.fingerprint'):
+                        fingerprint = fetch_schema_fingerprint(db, schema)
+                    if stale['fingerprint'] == fingerprint:
+                        SCHEMA_CACHE.touch(key)
+                        catalog_span.set(cache='revalidated')
+                        return stale
+                    logging.info(
+                        f'Schema {schema} mudou, reconstruindo catálogo.'
+                    )
+                except Exception as e:
+                    logging.error(
+                        f'Erro ao verificar o fingerprint do schema: {e}'
+                    )
+                    catalog_span.set(cache='stale')
+                    return stale
+
+        catalog_span.set(cache='miss')
+        with span('schema.introspect') as introspect_span:
+            catalog = build_schema_catalog(db, schema, sample_limit)
+            introspect_span.set(tables=len(catalog['tables']))
+        SCHEMA_CACHE.put(key, catalog)
+        SCHEMA_CACHE.save()
+        return catalog
+
+
+def get_oracle_catalog(connection, refresh=False):
+    """Catálogo (sem amostras) do usuário da sessão do Oracle-ADB, no mesmo
+    formato de get_schema_catalog e com o mesmo TTL."""
+    user = getattr(connection, 'username', None)
+    key = ('oracle-adb', user)
+
+    with span('schema.catalog', dialect='oracle') as catalog_span:
+        catalog = None if refresh else SCHEMA_CACHE.get(key)
+        if catalog is not None:
+            catalog_span.set(cache='hit')
+            return catalog
+
+        catalog_span.set(cache='miss')
+        with connection.cursor() as cursor:
+            cursor.execute(ORACLE_CATALOG_QUERY)
+            rows = [tuple(row) for row in cursor.fetchall()]
+        tables = {}
+        for table, column, dtype in rows:
+            tables.setdefault(table, {'columns': [], 'sample': []})
+            tables[table]['columns'].append((column, dtype))
+        catalog = dict(
+            schema=user,
+            tables=tables,
+            fingerprint=_fingerprint_rows(rows),
+            sample_limit=0,
+            built_at=time.time(),
+        )
+        SCHEMA_CACHE.put(key, catalog)
+        SCHEMA_CACHE.save()
+        return catalog
+
+
+def invalidate_schema_catalog(db, schema='public'):
+    SCHEMA_CACHE.invalidate((database_key(db), schema))
+    SCHEMA_CACHE.save()
+
+
+def format_table_info(catalog, sample_limit=SAMPLE_LIMIT):
+    lines = []
+    for table, info in catalog['tables'].items():
+        lines.append(f'Tabela: {table}')
+        lines.append('\t'.join(column for column, _ in info['columns']))
+        for row in info['sample'][:sample_limit]:
+            lines.append('\t'.join(map(str, row.values())))
+        lines.append('')
+    return '\n'.join(lines) + '\n' if lines else ''
@@ -0,0 +1,318 @@
+import argparse
+import io
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from sqlalchemy import create_engine
+from constants import LOCAL, SPOTIFY_DATABASE_URI
+from rollups import refresh_rollups
+from spotify_data_preprocess import DATASETS
+
+
+POSTGRES_TYPES = {
+    'string': 'text',
+    'object': 'text',
+    'float64': 'double precision',
+    'Int64': 'bigint',
+    'int64': 'bigint',
+    'bool': 'boolean',
+}
+CHUNK_ROWS = 100_000
+
+# Tabela de destino de cada dataset do pré-processamento e colunas com
+# índice (criados depois do COPY, que é bem mais rápido sem eles).
+TABLES = {
+    'tracks': dict(dataset='tracks', indexes=['id', 'year', 'artists']),
+    'artists': dict(dataset='artists', indexes=['Artist']),
+    'listeners': dict(dataset='listeners', indexes=['Artist']),
+    'most_streamed': dict(
+        dataset='most_streamed', indexes=['Artist and Title']
+    ),
+}
+
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _source(data_dir, table):
+    """Parquet tipado do pré-processamento, ou o CSV quando não há pyarrow
+    ou o Parquet não foi gerado."""
+    base = os.path.join(data_dir, DATASETS[TABLES[table]['dataset']]['output'])
+    try:
+        import pyarrow  # noqa: F401
+
+        if os.path.exists(base + '.parquet'):
+            return base + '.parquet'
+    except ImportError:
+        pass
+    if os.path.exists(base + '.csv'):
+        return base + '.csv'
+    return None
+
+
+def _columns(path):
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(path).names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def _csv_chunks(path, dtype, chunk_rows):
+    """Blocos de CSV sem cabeçalho, no formato que o COPY ... (FORMAT csv)
+    lê: vazio sem aspas é NULL."""
+    if path.endswith('.parquet'):
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+
+        options = pa_csv.WriteOptions(include_header=False)
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            buffer = io.BytesIO()
+            pa_csv.write_csv(pa.Table.from_batches([batch]), buffer, options)
+            yield buffer.getvalue()
+        return
+
+    # Sem os dtypes, inteiros com nulos voltariam como float ("1.0") e o
+    # COPY recusaria o valor numa coluna bigint.
+    for chunk in pd.read_csv(path, dtype=dtype, chunksize=chunk_rows):
+        yield chunk.to_csv(header=False, index=False).encode('utf-8')
+
+
+class _ChunkStream(io.RawIOBase):
+    """Arquivo somente-leitura sobre um iterador de bytes, para o
+    copy_expert consumir os blocos sem juntar o arquivo inteiro."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b''
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._pending += chunk
+        if size < 0:
+            data, self._pending = self._pending, b''
+        else:
+            data, self._pending = self._pending[:size], self._pending[size:]
+        self.bytes_read += len(data)
+        return data
+
+
+def _staging_name(table, load_id):
+    return f'{table}__load_{load_id}'
+
+
+def _index_name(table, column, suffix=''):
+    name = f'{table}_{column}_idx{suffix}'.lower().replace(' ', '_')
+    return name[:63]
+
+
+def load_table(engine, table, path, schema, load_id, chunk_rows=CHUNK_ROWS):
+    """Carrega a tabela de staging com COPY e cria índices e estatísticas;
+    devolve (linhas, segundos, bytes). A troca para o nome final é feita
+    depois, junto com as outras tabelas, em swap_tables."""
+    spec = TABLES[table]
+    dtype = DATASETS[spec['dataset']]['dtype']
+    columns = _columns(path)
+    staging = f'{_quote(schema)}.{_quote(_staging_name(table, load_id))}'
+    column_list = ', '.join(_quote(c) for c in columns)
+    definitions = ', '.join(
+        f'{_quote(c)} {POSTGRES_TYPES.get(dtype.get(c, "string"), "text")}'
+        for c in columns
+    )
+
+    start = time.perf_counter()
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        # CREATE + COPY na mesma transação: com wal_level=minimal o Postgres
+        # nem escreve WAL para a tabela nova.
+        cursor.execute(f'CREATE TABLE {staging} ({definitions})')
+        stream = _ChunkStream(_csv_chunks(path, dtype, chunk_rows))
+        cursor.copy_expert(
+            f'COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)',
+            stream,
+            size=1 << 20,
+        )
+        rows = cursor.rowcount
+        raw.commit()
+
+        for column in spec['indexes']:
+            if column in columns:
+                index = _index_name(table, column, '_' + load_id)
+                cursor.execute(
+                    f'CREATE INDEX {_quote(index)} '
+                    f'ON {staging} ({_quote(column)})'
+                )
+        raw.commit()
+        cursor.execute(f'ANALYZE {staging}')
+        raw.commit()
+        cursor.close()
+    except BaseException:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    return rows, time.perf_counter() - start, stream.bytes_read
+
+
+def swap_tables(engine, tables, schema, load_id):
+    """Troca todas as tabelas carregadas numa única transação: quem consulta
+    vê as versões antigas ou as novas, nunca uma carga pela metade."""
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute("SET LOCAL lock_timeout = '10s'")
+        for table in tables:
+            target = f'{_quote(schema)}.{_quote(table)}'
+            cursor.execute(f'DROP TABLE IF EXISTS {target}')
+            cursor.execute(
+                f'ALTER TABLE {_quote(schema)}.'
+                f'{_quote(_staging_name(table, load_id))} '
+                f'RENAME TO {_quote(table)}'
+            )
+            for column in TABLES[table]['indexes']:
+                index = _index_name(table, column, '_' + load_id)
+                cursor.execute(
+                    f'ALTER INDEX IF EXISTS {_quote(schema)}.{_quote(index)} '
+                    f'RENAME TO {_quote(_index_name(table, column))}'
+                )
+        raw.commit()
+        cursor.close()
+    except BaseException:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+
+def drop_staging(engine, tables, schema, load_id):
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        for table in tables:
+            cursor.execute(
+                f'DROP TABLE IF EXISTS {_quote(schema)}.'
+                f'{_quote(_staging_name(table, load_id))}'
+            )
+        raw.commit()
+        cursor.close()
+    finally:
+        raw.close()
+
+
+def load_spotify(
+    uri=SPOTIFY_DATABASE_URI,
+    tables=tuple(TABLES),
+    data_dir=LOCAL,
+    schema='public',
+    workers=None,
+):
+    """Carrega em paralelo (uma conexão por tabela) os arquivos tratados e
+    troca todas as tabelas de uma vez; devolve {tabela: métricas}."""
+    sources = {}
+    for table in tables:
+        path = _source(data_dir, table)
+        if path is None:
+            logging.warning(
+                f'Tabela {table} ignorada: rode spotify_data_preprocess antes.'
+            )
+            continue
+        sources[table] = path
+    if not sources:
+        return {}
+
+    engine = create_engine(uri, pool_size=len(sources), max_overflow=0)
+    load_id = uuid.uuid4().hex[:8]
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(
+            max_workers=workers or len(sources),
+            thread_name_prefix='genbi-load',
+        ) as executor:
+            futures = {
+                table: executor.submit(
+                    load_table, engine, table, path, schema, load_id
+                )
+                for table, path in sources.items()
+            }
+            results = {}
+            for table, future in futures.items():
+                rows, seconds, size = future.result()
+                results[table] = dict(
+                    source=sources[table],
+                    rows=rows,
+                    bytes=size,
+                    seconds=round(seconds, 3),
+                    rows_per_second=round(rows / seconds) if seconds else None,
+                )
+                logging.info(
+                    f'Tabela {table}: {rows} linhas em {seconds:.2f}s '
+                    f'({rows / max(seconds, 1e-9):,.0f} linhas/s).'
+                )
+        swap_tables(engine, list(results), schema, load_id)
+    except BaseException:
+        # Nenhuma tabela é trocada se alguma carga falhou.
+        drop_staging(engine, list(sources), schema, load_id)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        engine.dispose()
+
+    # Os rollups sobre as tabelas trocadas são refeitos logo após a carga,
+    # antes que o ask_postgres os descarte por estarem desatualizados.
+    try:
+        refresh_rollups(engine, schema, tables=list(results), force=True)
+    except Exception as e:
+        logging.error(f'Erro ao atualizar os rollups após a carga: {e}')
+    finally:
+        engine.dispose()
+
+    total = sum(r['rows'] for r in results.values())
+    logging.info(
+        f'{total} linhas em {len(results)} tabelas em {elapsed:.2f}s '
+        f'({total / max(elapsed, 1e-9):,.0f} linhas/s).'
+    )
+    return results
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+    )
+    parser = argparse.ArgumentParser(
+        description='Carrega os dados tratados do Spotify no Postgres '
+        '(SPOTIFY_DB_URI) com COPY e troca atômica das tabelas.'
+    )
+    parser.add_argument(
+        'tables', nargs='*', help=f'padrão: todas ({", ".join(TABLES)})'
+    )
+    parser.add_argument('--data-dir', default=LOCAL)
+    parser.add_argument('--schema', default='public')
+    parser.add_argument('--uri', default=SPOTIFY_DATABASE_URI)
+    args = parser.parse_args()
+    unknown = set(args.tables) - set(TABLES)
+    if unknown:
+        parser.error(f'tabelas desconhecidas: {", ".join(sorted(unknown))}')
+    if not args.uri:
+        parser.error('defina SPOTIFY_DB_URI ou use --uri.')
+
+    load_spotify(
+        args.uri,
+        args.tables or list(TABLES),
+        data_dir=args.data_dir,
+        schema=args.schema,
+    )
@@ -1,54 +1,320 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 from constants import (
     LOCAL,
     SPOTIFY_DATA_TRACKS,
     SPOTIFY_DATA_ARTISTS,
     SPOTIFY_DATA_LISTENERS,
+    SPOTIFY_DATA_MOST_STREAMED,
 )
 
 
-df_tracks = pd.read_csv(SPOTIFY_DATA_TRACKS)
-df_artists = pd.read_csv(SPOTIFY_DATA_ARTISTS)
-df_listeners = pd.read_csv(SPOTIFY_DATA_LISTENERS)
+# Mudanças nas regras abaixo devem incrementar a versão: o manifest guarda
+# hash da fonte + versão, e só reprocessa quando um dos dois muda.
+PIPELINE_VERSION = 2
+CHUNK_ROWS = 200_000
+MANIFEST_NAME = '.preprocess_manifest.json'
 
 
-df_tracks['year'] = (
-    pd.to_numeric(df_tracks['year'], errors='coerce').fillna(0).astype(int)
-)
-df_tracks['artists'] = (
-    df_tracks['artists']
-    .astype(str)
-    .str.replace('[', '')
-    .str.replace(']', '')
-    .str.replace("'", '')
-)
-df_tracks = df_tracks.drop(['release_date'], axis=1)
+def _clean_tracks(df):
+    df['year'] = (
+        pd.to_numeric(df['year'], errors='coerce').fillna(0).astype('int64')
+    )
+    df['artists'] = df['artists'].str.replace(r"[\[\]']", '', regex=True)
+    return df.drop(columns=['release_date'], errors='ignore')
+
+
+# source: CSV de entrada; dtype: tipos finais das colunas. Os números vêm
+# com separador de milhar ("85,041.3") e são lidos já como número pelo
+# parser do read_csv (thousands=',').
+DATASETS = {
+    'tracks': dict(
+        source=SPOTIFY_DATA_TRACKS,
+        output='data_tracks_preprocessed',
+        dtype={
+            'id': 'string',
+            'name': 'string',
+            'artists': 'string',
+            'release_date': 'string',
+            'year': 'Int64',
+            'valence': 'float64',
+            'acousticness': 'float64',
+            'danceability': 'float64',
+            'energy': 'float64',
+            'instrumentalness': 'float64',
+            'liveness': 'float64',
+            'loudness': 'float64',
+            'speechiness': 'float64',
+            'tempo': 'float64',
+            'duration_ms': 'Int64',
+            'explicit': 'Int64',
+            'key': 'Int64',
+            'mode': 'Int64',
+            'popularity': 'Int64',
+        },
+        clean=_clean_tracks,
+    ),
+    'artists': dict(
+        source=SPOTIFY_DATA_ARTISTS,
+        output='artists_preprocessed',
+        dtype={
+            'Artist': 'string',
+            'Streams': 'float64',
+            'Daily': 'float64',
+            'As lead': 'float64',
+            'Solo': 'float64',
+            'As feature': 'float64',
+        },
+    ),
+    'listeners': dict(
+        source=SPOTIFY_DATA_LISTENERS,
+        output='listeners_preprocessed',
+        dtype={
+            'Artist': 'string',
+            'Listeners': 'Int64',
+            'Daily Trend': 'Int64',
+            'Peak': 'Int64',
+            'PkListeners': 'Int64',
+        },
+    ),
+    'most_streamed': dict(
+        source=SPOTIFY_DATA_MOST_STREAMED,
+        output='most_streamed_preprocessed',
+        dtype={
+            'Artist and Title': 'string',
+            'Streams': 'Int64',
+            'Daily': 'float64',
+        },
+    ),
+}
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def _is_numeric(dtype):
+    return dtype not in ('string', 'object')
+
+
+def _read_chunks(source, dtype, chunk_rows):
+    # Só as colunas de texto vão como dtype para o parser; as numéricas são
+    # inferidas por ele (já sem o separador de milhar) e convertidas depois,
+    # para que um valor inválido vire NaN em vez de abortar a leitura.
+    text_dtype = {c: t for c, t in dtype.items() if not _is_numeric(t)}
+    return pd.read_csv(
+        source, thousands=',', dtype=text_dtype, chunksize=chunk_rows
+    )
+
+
+def _coerce(chunk, dtype):
+    for column, kind in dtype.items():
+        if column not in chunk.columns or not _is_numeric(kind):
+            continue
+        values = chunk[column]
+        if not pd.api.types.is_numeric_dtype(values):
+            values = pd.to_numeric(
+                values.astype('string').str.replace(',', '', regex=False),
+                errors='coerce',
+            )
+        if kind == 'Int64':
+            # Valores com fração não cabem em Int64; viram nulos, como no
+            # to_numeric(errors='coerce') da versão anterior.
+            values = values.where(values.isna() | (values % 1 == 0))
+        chunk[column] = values.astype(kind)
+    return chunk
+
+
+class _Outputs:
+    """Grava os chunks em Parquet (pyarrow) e/ou CSV sem juntar o arquivo."""
+
+    def __init__(self, base, formats):
+        self.paths = {fmt: f'{base}.{fmt}' for fmt in formats}
+        self._parquet = None
+        self._schema = None
+        self._csv_header = True
+
+    def write(self, chunk):
+        if 'parquet' in self.paths:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._parquet is None:
+                self._schema = table.schema
+                self._parquet = pq.ParquetWriter(
+                    self.paths['parquet'] + '.tmp', self._schema
+                )
+            self._parquet.write_table(table.cast(self._schema))
+        if 'csv' in self.paths:
+            chunk.to_csv(
+                self.paths['csv'] + '.tmp',
+                mode='w' if self._csv_header else 'a',
+                header=self._csv_header,
+                index=False,
+            )
+            self._csv_header = False
+
+    def commit(self):
+        # Arquivos .tmp trocados só no fim: uma execução interrompida não
+        # deixa uma saída pela metade com hash de fonte já registrado.
+        if self._parquet is not None:
+            self._parquet.close()
+        for path in self.paths.values():
+            os.replace(path + '.tmp', path)
+
+    def abort(self):
+        if self._parquet is not None:
+            self._parquet.close()
+        for path in self.paths.values():
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+
+
+def process_dataset(name, output_dir, formats, chunk_rows=CHUNK_ROWS):
+    """Lê, limpa e grava um dataset em chunks; devolve (linhas, saídas)."""
+    spec = DATASETS[name]
+    outputs = _Outputs(os.path.join(output_dir, spec['output']), formats)
+    rows = 0
+    try:
+        for chunk in _read_chunks(spec['source'], spec['dtype'], chunk_rows):
+            chunk = _coerce(chunk, spec['dtype'])
+            if 'clean' in spec:
+                chunk = spec['clean'](chunk)
+            outputs.write(chunk)
+            rows += len(chunk)
+        if not rows:
+            raise ValueError(f'{spec["source"]} não tem linhas.')
+    except BaseException:
+        outputs.abort()
+        raise
+    outputs.commit()
+    return rows, sorted(outputs.paths.values())
+
+
+def _load_manifest(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
 
-cols_to_convert = ['Streams', 'Daily', 'As lead', 'Solo', 'As feature']
-for col in cols_to_convert:
-    df_artists[col] = df_artists[col].astype(str)
-    df_artists[col] = df_artists[col].str.replace(',', '')
-    df_artists[col] = pd.to_numeric(df_artists[col], errors='coerce')
+def _is_current(entry, digest, formats):
+    return (
+        entry is not None
+        and entry.get('hash') == digest
+        and entry.get('version') == PIPELINE_VERSION
+        and set(entry.get('formats', [])) >= set(formats)
+        and all(os.path.exists(path) for path in entry.get('outputs', []))
+    )
 
 
-cols = ['Listeners', 'Daily Trend', 'PkListeners']
-for col in cols:
-    df_listeners[col] = df_listeners[col].astype(str)
-    df_listeners[col] = df_listeners[col].str.replace(',', '')
-    df_listeners[col] = pd.to_numeric(df_listeners[col], errors='coerce')
+def preprocess(
+    names=tuple(DATASETS),
+    output_dir=LOCAL,
+    formats=('parquet',),
+    force=False,
+    workers=None,
+):
+    """Processa em paralelo (um processo por dataset) os datasets cuja fonte
+    mudou desde a última execução; devolve {dataset: status}."""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = _load_manifest(manifest_path)
 
+    pending = {}
+    results = {}
+    for name in names:
+        source = DATASETS[name]['source']
+        if not os.path.exists(source):
+            logging.warning(f'Dataset {name} ignorado: {source} não existe.')
+            results[name] = 'missing'
+            continue
+        digest = file_hash(source)
+        if not force and _is_current(manifest.get(name), digest, formats):
+            logging.info(f'Dataset {name} sem mudanças, reaproveitado.')
+            results[name] = 'unchanged'
+            continue
+        pending[name] = digest
 
-output_file = LOCAL + '/data_tracks_preprocessed.csv'
-output_file2 = LOCAL + '/artists_preprocessed.csv'
-output_file3 = LOCAL + '/listeners_preprocessed.csv'
+    if pending:
+        with ProcessPoolExecutor(
+            max_workers=workers or min(len(pending), os.cpu_count() or 1)
+        ) as executor:
+            futures = {
+                name: executor.submit(
+                    process_dataset, name, output_dir, formats
+                )
+                for name in pending
+            }
+            for name, future in futures.items():
+                try:
+                    rows, paths = future.result()
+                except Exception as e:
+                    logging.error(f'Erro ao processar o dataset {name}: {e}')
+                    results[name] = 'error'
+                    continue
+                manifest[name] = dict(
+                    hash=pending[name],
+                    version=PIPELINE_VERSION,
+                    formats=sorted(formats),
+                    outputs=paths,
+                    rows=rows,
+                    processed_at=time.time(),
+                )
+                results[name] = 'processed'
+                logging.info(
+                    f'Dataset {name}: {rows} linhas salvas em '
+                    f'{", ".join(paths)}.'
+                )
 
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+    return results
 
-df_tracks.to_csv(output_file, index=False)
-df_artists.to_csv(output_file2, index=False)
-df_listeners.to_csv(output_file3, index=False)
 
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+    )
+    parser = argparse.ArgumentParser(
+        description='Trata os CSVs do Spotify e salva em Parquet (e CSV).'
+    )
+    parser.add_argument(
+        'datasets', nargs='*', help=f'padrão: todos ({", ".join(DATASETS)})'
+    )
+    parser.add_argument('--output-dir', default=LOCAL)
+    parser.add_argument(
+        '--csv', action='store_true', help='também grava os CSVs tratados'
+    )
+    parser.add_argument(
+        '--force', action='store_true', help='reprocessa mesmo sem mudanças'
+    )
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+    unknown = set(args.datasets) - set(DATASETS)
+    if unknown:
+        parser.error(f'datasets desconhecidos: {", ".join(sorted(unknown))}')
 
-print('Dados tratados das músicas do spotify salvos em:', output_file)
-print('Dados tratados dos streams artistas e salvos em:', output_file2)
-print('Dados tratados dos ouvintes por artistas e salvos em:', output_file3)
+    start = time.perf_counter()
+    results = preprocess(
+        args.datasets or list(DATASETS),
+        output_dir=args.output_dir,
+        formats=('parquet', 'csv') if args.csv else ('parquet',),
+        force=args.force,
+        workers=args.workers,
+    )
+    print(
+        f'Pré-processamento em {time.perf_counter() - start:.2f}s:',
+        ', '.join(f'{name}={status}' for name, status in results.items()),
+    )
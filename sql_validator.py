@@ -0,0 +1,367 @@
+import difflib
+import logging
+import re
+
+from caching import PersistentCache
+from constants import SQL_VALIDATION
+from tracing import span
+
+
+SQLGLOT_DIALECTS = {'postgresql': 'postgres', 'oracle': 'oracle'}
+# Objetos que existem sem estar no catálogo do usuário.
+PSEUDO_TABLES = {'dual'}
+PSEUDO_COLUMNS = {
+    'rownum',
+    'rowid',
+    'level',
+    'sysdate',
+    'systimestamp',
+    'user',
+    'current_date',
+    'current_timestamp',
+}
+# Identificadores entre crases (MySQL) ou colchetes (SQL Server), que o LLM
+# às vezes gera; viram aspas duplas na segunda tentativa.
+FOREIGN_QUOTES = re.compile(r'`([^`]+)`|\[([A-Za-z_][\w ]*)\]')
+# Literais e identificadores já entre aspas ficam intactos no reparo textual.
+QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+# Queries já validadas, pelo fingerprint do catálogo: a mesma query do
+# cache de resultados ou do histórico não é parseada de novo.
+VALIDATED = PersistentCache('sql-validation', max_entries=1024)
+
+
+class InvalidQuery(ValueError):
+    """A query referencia tabelas ou colunas que não existem no catálogo."""
+
+    def __init__(self, problems):
+        super().__init__('; '.join(problems))
+        self.problems = problems
+
+
+def _sqlglot():
+    try:
+        import sqlglot
+    except ImportError:
+        return None
+    return sqlglot
+
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+# ------------------------------------------------------------------------
+# Resolução contra o catálogo
+# ------------------------------------------------------------------------
+
+
+def _effective(identifier, dialect):
+    # Como o banco enxerga o nome: sem aspas, o Postgres converte para
+    # minúsculas e o Oracle para maiúsculas.
+    name = identifier.this
+    if identifier.quoted:
+        return name
+    if dialect == 'oracle':
+        return name.upper()
+    if dialect == 'postgres':
+        return name.lower()
+    return None  # SQLite/DuckDB: sem distinção de caixa
+
+
+def _lookup(identifier, names, dialect):
+    """Nome do catálogo que o identificador deveria referenciar (ou None) e
+    se ele precisa ser reescrito para chegar lá."""
+    effective = _effective(identifier, dialect)
+    if effective is not None and effective in names:
+        return effective, False
+    matches = [n for n in names if n.lower() == identifier.this.lower()]
+    if not matches:
+        return None, False
+    if effective is None:
+        return matches[0], False
+    return matches[0], True
+
+
+def _fix(identifier, name, fixes, kind):
+    fixes.append(f'{kind} {identifier.sql()} -> {_quote(name)}')
+    identifier.set('this', name)
+    identifier.set('quoted', True)
+
+
+def _unknown(kind, name, candidates):
+    close = difflib.get_close_matches(name, list(candidates), n=3)
+    hint = f' (did you mean {", ".join(close)}?)' if close else ''
+    return f'unknown {kind} {name}{hint}'
+
+
+def _table_sources(scope, catalog_tables):
+    """{alias: nome no catálogo} das tabelas do catálogo visíveis no escopo
+    e nos escopos de fora (subqueries correlacionadas). Fontes que não dá
+    para conferir (subqueries, funções, outros schemas) marcam o escopo
+    como opaco."""
+    sources = {}
+    visible = set()
+    derived = False
+    current = scope
+    while current is not None:
+        for alias, source in current.sources.items():
+            if alias.lower() in visible:
+                continue
+            visible.add(alias.lower())
+            name = catalog_tables.get(id(source))
+            if name is not None:
+                sources[alias.lower()] = name
+            else:
+                derived = derived or current is scope
+        current = current.parent
+    return sources, visible, derived
+
+
+def _resolve(tree, catalog, dialect, schema, qualify):
+    from sqlglot import exp
+    from sqlglot.optimizer.scope import traverse_scope
+
+    tables = catalog['tables']
+    columns = {
+        table: [column for column, _ in info['columns']]
+        for table, info in tables.items()
+    }
+    fixes, problems = [], []
+    catalog_tables = {}
+
+    scopes = list(traverse_scope(tree))
+    for scope in scopes:
+        for source in scope.sources.values():
+            if not isinstance(source, exp.Table):
+                continue
+            if id(source) in catalog_tables:
+                continue
+            if not isinstance(source.this, exp.Identifier):
+                continue  # função de tabela: generate_series(...)
+            if source.name.lower() in PSEUDO_TABLES:
+                continue
+            if source.db and source.db.lower() != (schema or '').lower():
+                continue  # outro schema/owner: fora do catálogo
+            name, rewrite = _lookup(source.this, tables, dialect)
+            if name is None:
+                problems.append(_unknown('table', source.name, tables))
+                continue
+            if rewrite:
+                _fix(source.this, name, fixes, 'table')
+            if qualify and schema and not source.db:
+                source.set('db', exp.to_identifier(schema))
+            catalog_tables[id(source)] = name
+
+    for scope in scopes:
+        if not isinstance(scope.expression, exp.Select):
+            continue  # UNION/INTERSECT: as colunas estão nos SELECTs
+        sources, visible, derived = _table_sources(scope, catalog_tables)
+        aliases = {
+            e.alias.lower() for e in scope.expression.expressions if e.alias
+        }
+        # scope.columns deixa de fora as referências do ORDER BY/HAVING a
+        # colunas projetadas (ORDER BY streams); elas precisam da mesma
+        # correção de caixa que a projeção recebe.
+        in_scope = {id(column) for column in scope.columns}
+        for column in scope.expression.find_all(exp.Column):
+            # Colunas de subqueries são resolvidas no escopo delas.
+            owner = column.find_ancestor(exp.Select, exp.SetOperation)
+            if owner is not scope.expression:
+                continue
+            if isinstance(column.this, exp.Star):
+                continue
+            if (
+                id(column) not in in_scope
+                and not column.table
+                and column.name.lower() in aliases
+            ):
+                continue  # ORDER BY de um alias da projeção
+            if column.table:
+                if column.table.lower() not in visible:
+                    problems.append(_unknown('table', column.table, visible))
+                    continue
+                table = sources.get(column.table.lower())
+                candidates = [table] if table else []
+            else:
+                candidates = list(dict.fromkeys(sources.values()))
+            if not candidates:
+                continue  # só fontes derivadas: sem como conferir
+
+            for table in candidates:
+                resolved, rewrite = _lookup(
+                    column.this, columns[table], dialect
+                )
+                if resolved is not None:
+                    if rewrite:
+                        _fix(column.this, resolved, fixes, 'column')
+                    break
+            else:
+                if column.table:
+                    known = columns[candidates[0]]
+                    problems.append(_unknown('column', column.name, known))
+                elif column.name.lower() in PSEUDO_COLUMNS | aliases:
+                    continue
+                elif not derived:
+                    known = [c for t in candidates for c in columns[t]]
+                    problems.append(_unknown('column', column.name, known))
+    return fixes, problems
+
+
+# ------------------------------------------------------------------------
+# Validação e reparo
+# ------------------------------------------------------------------------
+
+
+def _spaced_names(catalog):
+    names = {
+        name
+        for info in catalog['tables'].values()
+        for name, _ in info['columns']
+        if not re.fullmatch(r'\w+', name)
+    }
+    return sorted(names, key=len, reverse=True)
+
+
+def repair_text(query, catalog):
+    """Põe entre aspas os nomes do catálogo com espaços ou símbolos que vieram
+    sem aspas (As lead, Daily Trend) ou com crases/colchetes."""
+    names = _spaced_names(catalog)
+    pattern = None
+    if names:
+        pattern = re.compile(
+            r'(?<![\w"])('
+            + '|'.join(r'\s+'.join(map(re.escape, n.split())) for n in names)
+            + r')(?![\w"])',
+            re.I,
+        )
+    by_key = {' '.join(n.lower().split()): n for n in names}
+
+    def quote_name(match):
+        found = match.group(1)
+        return _quote(by_key.get(' '.join(found.lower().split()), found))
+
+    parts = QUOTED.split(query)
+    for i in range(0, len(parts), 2):
+        parts[i] = FOREIGN_QUOTES.sub(
+            lambda m: _quote(m.group(1) or m.group(2)), parts[i]
+        )
+        if pattern is not None:
+            parts[i] = pattern.sub(quote_name, parts[i])
+    return ''.join(parts)
+
+
+def _attempt(query, catalog, dialect, schema, qualify):
+    sqlglot = _sqlglot()
+    from sqlglot import exp
+
+    try:
+        tree = sqlglot.parse_one(query, read=dialect)
+    except sqlglot.errors.SqlglotError as e:
+        return None, [], [f'syntax error: {str(e).splitlines()[0]}']
+    if not isinstance(tree, exp.Query):
+        return None, [], []  # só SELECT/WITH são conferidos
+    fixes, problems = _resolve(tree, catalog, dialect, schema, qualify)
+    return tree, fixes, problems
+
+
+def validate_query(query, catalog, dialect, schema=None, qualify=False):
+    """Confere tabelas e colunas da query com o catálogo, corrigindo caixa,
+    aspas e (com qualify=True) o schema das tabelas.
+
+    Devolve (query, correções); a query original volta intacta quando não
+    há nada a corrigir. Levanta InvalidQuery para objetos desconhecidos ou
+    SQL que não faz parse mesmo depois do reparo.
+    """
+    dialect = SQLGLOT_DIALECTS.get(dialect, dialect)
+    query = query.strip().rstrip(';').strip()
+    tree, fixes, problems = _attempt(query, catalog, dialect, schema, qualify)
+    if problems:
+        repaired = repair_text(query, catalog)
+        if repaired != query:
+            retry = _attempt(repaired, catalog, dialect, schema, qualify)
+            if not retry[2]:
+                tree, fixes, problems = retry
+                fixes.insert(0, 'quoted identifiers with spaces')
+    if problems:
+        raise InvalidQuery(problems)
+    if tree is None:
+        return query, []
+    if not fixes and not (qualify and schema):
+        return query, []
+    fixed = tree.sql(dialect=dialect)
+    return fixed, list(dict.fromkeys(fixes)) if fixed != query else []
+
+
+def _qualify_query(query, schema):
+    # Sem sqlglot: o prefixo ingênuo de sempre no primeiro FROM.
+    if schema:
+        return query.replace('FROM ', f'FROM {schema}.')
+    return query
+
+
+def _checked(query, get_catalog, dialect, schema=None, qualify=False):
+    if not SQL_VALIDATION or _sqlglot() is None:
+        return _qualify_query(query, schema) if qualify else query
+    try:
+        catalog = get_catalog()
+    except Exception as e:
+        logging.warning(f'Catálogo indisponível, query não validada: {e}')
+        return _qualify_query(query, schema) if qualify else query
+
+    key = (query, dialect, schema, qualify, catalog.get('fingerprint'))
+    cached = VALIDATED.get(key)
+    if cached is not None:
+        return cached
+
+    with span('sql.validate', dialect=dialect) as validate_span:
+        try:
+            checked, fixes = validate_query(
+                query, catalog, dialect, schema, qualify
+            )
+        except InvalidQuery as e:
+            validate_span.set(outcome='invalid', problems=len(e.problems))
+            logging.error(f'Query recusada pela validação local: {e}')
+            raise
+        except Exception as e:
+            # Construção que o validador não entende: a query segue sem
+            # validação e o banco dá a palavra final.
+            validate_span.set(outcome='error')
+            logging.warning(
+                f'Erro na validação local, query segue sem ela: {e}'
+            )
+            return _qualify_query(query, schema) if qualify else query
+        validate_span.set(outcome='ok', fixes=len(fixes))
+    if fixes:
+        logging.info(f'Query corrigida localmente: {"; ".join(fixes)}.')
+    if key[-1] is not None:
+        VALIDATED.put(key, checked)
+    return checked
+
+
+def check_postgres_query(db, query, schema=None):
+    """Valida a query contra o catálogo em cache do banco e qualifica as
+    tabelas com `schema` (quando passado)."""
+    from schema_cache import get_schema_catalog
+
+    catalog_schema = schema or db._schema or 'public'
+    return _checked(
+        query,
+        lambda: get_schema_catalog(db, catalog_schema),
+        db._engine.dialect.name,
+        catalog_schema,
+        qualify=schema is not None,
+    )
+
+
+def check_oracle_query(connection, query):
+    """Valida a query contra as tabelas do usuário da sessão; tabelas de
+    outros owners ("SH"."CUSTOMERS") ficam para o ADB conferir."""
+    from schema_cache import get_oracle_catalog
+
+    return _checked(
+        query,
+        lambda: get_oracle_catalog(connection),
+        'oracle',
+        getattr(connection, 'username', None),
+    )
@@ -0,0 +1,316 @@
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from constants import TRACE_SAMPLE_RATE, TRACE_EXPORT, TRACE_DIR
+
+
+TRACES_PATH = os.path.join(TRACE_DIR, 'traces.jsonl')
+METRICS_PATH = os.path.join(TRACE_DIR, 'metrics.prom')
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+# Atributos numéricos somados em contadores no export OpenMetrics.
+COUNTED_ATTRIBUTES = (
+    'prompt_tokens',
+    'completion_tokens',
+    'rows',
+    'bytes',
+)
+
+
+class Span:
+    __slots__ = (
+        'trace',
+        'span_id',
+        'parent_id',
+        'name',
+        'attrs',
+        'start',
+        'end',
+    )
+
+    def __init__(self, trace, name, parent_id, attrs):
+        self.trace = trace
+        self.span_id = len(trace.spans)
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end = None
+        trace.spans.append(self)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+
+class _NoopSpan:
+    """Devolvido quando a pergunta não foi amostrada: não registra nada."""
+
+    trace = None
+
+    def set(self, **attrs):
+        pass
+
+    def finish(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, name):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.started_at = time.time()
+        self.spans = []
+
+    @property
+    def root(self):
+        return self.spans[0]
+
+    def to_dict(self):
+        origin = self.root.start
+        return dict(
+            trace_id=self.trace_id,
+            name=self.name,
+            started_at=self.started_at,
+            duration_ms=round(1000 * self.root.duration, 3),
+            spans=[
+                dict(
+                    span_id=s.span_id,
+                    parent_id=s.parent_id,
+                    name=s.name,
+                    offset_ms=round(1000 * (s.start - origin), 3),
+                    duration_ms=round(1000 * s.duration, 3),
+                    attrs=s.attrs,
+                )
+                for s in self.spans
+            ],
+        )
+
+
+_CURRENT_SPAN = ContextVar('genbi_current_span', default=None)
+
+RECENT_TRACES = deque(maxlen=50)
+
+
+def current_span():
+    return _CURRENT_SPAN.get()
+
+
+def start_span(name, parent=None, **attrs):
+    """Abre um span sem context manager (usado pelos callbacks do LangChain,
+    que recebem início e fim em chamadas separadas). Feche com finish()."""
+    parent = parent if parent is not None else _CURRENT_SPAN.get()
+    if parent is None or parent is NOOP_SPAN:
+        return NOOP_SPAN
+    return Span(parent.trace, name, parent.span_id, attrs)
+
+
+@contextmanager
+def span(name, **attrs):
+    parent = _CURRENT_SPAN.get()
+    if parent is None or parent is NOOP_SPAN:
+        # Fora de um trace amostrado o custo é só esta verificação.
+        yield NOOP_SPAN
+        return
+
+    child = Span(parent.trace, name, parent.span_id, attrs)
+    token = _CURRENT_SPAN.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attrs['error'] = type(e).__name__
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        child.finish()
+
+
+@contextmanager
+def trace(name, sample=None, keep=False, **attrs):
+    """Abre um trace para uma pergunta. Dentro de outro trace vira um span.
+
+    A decisão de amostragem é tomada aqui, uma vez por pergunta; sample=True
+    força o registro e a exportação. keep=True registra os spans mesmo sem
+    amostragem, só em memória (o painel de tempos do app usa isso): a
+    exportação continua seguindo GENBI_TRACE_SAMPLE_RATE.
+    """
+    if _CURRENT_SPAN.get() is not None:
+        with span(name, **attrs) as child:
+            yield child
+        return
+
+    if sample is None:
+        sample = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    if not sample and not keep:
+        token = _CURRENT_SPAN.set(NOOP_SPAN)
+        try:
+            yield NOOP_SPAN
+        finally:
+            _CURRENT_SPAN.reset(token)
+        return
+
+    root = Span(Trace(name), name, None, attrs)
+    token = _CURRENT_SPAN.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.attrs['error'] = type(e).__name__
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        root.finish()
+        if sample:
+            _record(root.trace)
+
+
+# ------------------------------------------------------------------------
+# Exportação
+# ------------------------------------------------------------------------
+
+_EXPORT_LOCK = threading.Lock()
+_DURATIONS = defaultdict(lambda: [0] * (len(DURATION_BUCKETS) + 1))
+_DURATION_SUMS = defaultdict(float)
+_COUNTERS = defaultdict(float)
+
+
+def _record(finished):
+    RECENT_TRACES.append(finished)
+    if TRACE_EXPORT == 'none':
+        return
+    try:
+        with _EXPORT_LOCK:
+            if TRACE_EXPORT in ('jsonl', 'both'):
+                _append_jsonl(finished)
+            if TRACE_EXPORT in ('openmetrics', 'both'):
+                _aggregate(finished)
+                _write_openmetrics()
+    except Exception as e:
+        logging.warning(f'Erro ao exportar trace {finished.trace_id}: {e}')
+
+
+def _append_jsonl(finished):
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    with open(TRACES_PATH, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(finished.to_dict(), default=str) + '\n')
+
+
+def _aggregate(finished):
+    for s in finished.spans:
+        buckets = _DURATIONS[s.name]
+        duration = s.duration
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                buckets[i] += 1
+        buckets[-1] += 1
+        _DURATION_SUMS[s.name] += duration
+        for attribute in COUNTED_ATTRIBUTES:
+            value = s.attrs.get(attribute)
+            if isinstance(value, (int, float)):
+                _COUNTERS[(s.name, attribute)] += value
+    _COUNTERS[(finished.name, 'traces')] += 1
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _write_openmetrics():
+    lines = [
+        '# TYPE genbi_span_duration_seconds histogram',
+        '# UNIT genbi_span_duration_seconds seconds',
+        '# HELP genbi_span_duration_seconds Span durations of sampled traces.',
+    ]
+    for name in sorted(_DURATIONS):
+        buckets = _DURATIONS[name]
+        for bound, count in zip(DURATION_BUCKETS, buckets):
+            lines.append(
+                f'genbi_span_duration_seconds_bucket'
+                f'{{span="{_label(name)}",le="{bound}"}} {count}'
+            )
+        lines.append(
+            f'genbi_span_duration_seconds_bucket'
+            f'{{span="{_label(name)}",le="+Inf"}} {buckets[-1]}'
+        )
+        lines.append(
+            f'genbi_span_duration_seconds_count'
+            f'{{span="{_label(name)}"}} {buckets[-1]}'
+        )
+        lines.append(
+            f'genbi_span_duration_seconds_sum'
+            f'{{span="{_label(name)}"}} {_DURATION_SUMS[name]:.6f}'
+        )
+
+    lines.append('# TYPE genbi_span_attribute counter')
+    lines.append(
+        '# HELP genbi_span_attribute Sum of numeric span attributes '
+        '(tokens, rows, bytes) over sampled traces.'
+    )
+    for (name, attribute), value in sorted(_COUNTERS.items()):
+        lines.append(
+            f'genbi_span_attribute_total{{span="{_label(name)}",'
+            f'attribute="{_label(attribute)}"}} {value:g}'
+        )
+    lines.append('# EOF')
+
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=TRACE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, METRICS_PATH)
+
+
+def last_trace(name=None):
+    for finished in reversed(RECENT_TRACES):
+        if name is None or finished.name == name:
+            return finished
+    return None
+
+
+def timing_breakdown(finished):
+    """Linhas (span, início, duração, atributos) para exibir uma pergunta."""
+    depth = {}
+    rows = []
+    origin = finished.root.start
+    for s in finished.spans:
+        depth[s.span_id] = (
+            0 if s.parent_id is None else depth[s.parent_id] + 1
+        )
+        rows.append(
+            dict(
+                span='  ' * depth[s.span_id] + s.name,
+                start_ms=round(1000 * (s.start - origin), 1),
+                duration_ms=round(1000 * s.duration, 1),
+                attrs=', '.join(f'{k}={v}' for k, v in s.attrs.items()),
+            )
+        )
+    return rows
+
+
+def record_frame(target, df):
+    # memory_usage rasa: barata mesmo para colunas de texto grandes.
+    if target is not NOOP_SPAN and df is not None:
+        target.set(
+            rows=len(df), bytes=int(df.memory_usage(index=True).sum())
+        )
@@ -1,96 +1,155 @@
 import logging
 import os
-import oci
-import pandas as pd
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
 import constants as c
 from dotenv import load_dotenv
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langchain_community.agent_toolkits import create_sql_agent
-from langchain_community.chat_models import ChatOCIGenAI
-from langchain_core.messages import SystemMessage
-from langchain.callbacks.base import BaseCallbackHandler
-from langchain_openai import ChatOpenAI
+from langchain_core.callbacks import BaseCallbackHandler
+from schema_cache import (
+    database_key,
+    get_schema_catalog,
+)
+from prompt_context import schema_context
+from tracing import current_span, span, start_span
 
 
 load_dotenv()
 
 
 def get_tables(db, schema='public'):
-    query = f"""
-    SELECT table_name
-    FROM information_schema.tables
-    WHERE table_type = 'BASE TABLE' AND table_schema = '{schema}'
-    """
     try:
-        df = pd.read_sql(query, db._engine)
-        tables = df['table_name'].values.tolist()
-        return tables
+        return list(get_schema_catalog(db, schema)['tables'])
     except Exception as e:
         logging.error(f'Erro ao obter tabelas do banco de dados: {e}')
         return []
 
 
-def get_columns_for_table(db, table_name):
-    query = f"""
-    SELECT column_name
-    FROM information_schema.columns
-    WHERE table_name = '{table_name}'
-    """
+def get_columns_for_table(db, table_name, schema='public'):
     try:
-        df = pd.read_sql(query, db._engine)
-        return df['column_name'].tolist()
+        table = get_schema_catalog(db, schema)['tables'].get(table_name)
+        return [column for column, _ in table['columns']] if table else []
     except Exception as e:
         logging.error(f'Erro ao obter colunas para a tabela {table_name}: {e}')
         return []
 
 
 def get_schema_tables_and_columns(db, schema='public'):
-    tables_and_columns = {}
-    tables = get_tables(db, schema)
-    for table in tables:
-        columns = get_columns_for_table(db, table)
-        tables_and_columns[table] = columns
-    return tables_and_columns
+    catalog = get_schema_catalog(db, schema)
+    return {
+        table: [column for column, _ in info['columns']]
+        for table, info in catalog['tables'].items()
+    }
 
 
 def get_table_headers(db, schema='public', sample_limit=6):
-
-    table_info_str = ''
-    tables_and_columns = get_schema_tables_and_columns(db, schema)
-
-    for table, columns in tables_and_columns.items():
-        query = f"""
-        SELECT *
-        FROM {schema}.{table}
-        LIMIT {sample_limit}
-        """
-        try:
-            df = pd.read_sql(query, db._engine)
-            table_info_str += f'Tabela: {table}\n'
-            table_info_str += '\t'.join(df.columns) + '\n'
-
-            for index, row in df.iterrows():
-                table_info_str += '\t'.join(map(str, row.values)) + '\n'
-            table_info_str += '\n'
-
-        except Exception as e:
-            logging.error(f'Erro ao obter a amostra da tabela {table}: {e}')
-            table_info_str += f'Tabela: {table} (erro ao obter dados)\n\n'
-    return table_info_str
+    table_info, _ = schema_context(db, schema, sample_limit=sample_limit)
+    return table_info
 
 
 class SQLHandler(BaseCallbackHandler):
     def __init__(self):
         self.sql_result = []
+        # Queries que o agente de fato executou, com latência (log de
+        # queries do index_advisor).
+        self.executions = []
+        self._running = {}
 
     def on_agent_action(self, action, **kwargs):
         if action.tool in ['sql_db_query_checker', 'sql_db_query']:
             self.sql_result.append(action.tool_input)
 
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        if (serialized or {}).get('name') == 'sql_db_query':
+            query = (kwargs.get('inputs') or {}).get('query', input_str)
+            self._running[run_id] = (query, time.perf_counter())
+
+    def _finish(self, run_id, error=None):
+        running = self._running.pop(run_id, None)
+        if running is not None:
+            query, start = running
+            self.executions.append(
+                dict(
+                    query=query,
+                    latency_ms=1000 * (time.perf_counter() - start),
+                    error=error,
+                )
+            )
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, type(error).__name__)
+
+
+def _token_usage(response):
+    usage = (response.llm_output or {}).get('token_usage') or {}
+    if usage:
+        return dict(
+            prompt_tokens=usage.get('prompt_tokens'),
+            completion_tokens=usage.get('completion_tokens'),
+        )
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, 'message', None)
+            metadata = getattr(message, 'usage_metadata', None)
+            if metadata:
+                return dict(
+                    prompt_tokens=metadata.get('input_tokens'),
+                    completion_tokens=metadata.get('output_tokens'),
+                )
+    return {}
+
+
+class TracingHandler(BaseCallbackHandler):
+    """Abre um span para cada chamada ao LLM e a ferramentas do agente,
+    filho do span ativo quando o handler foi criado."""
+
+    def __init__(self):
+        self.parent = current_span()
+        self._spans = {}
+        self.llm_calls = 0
+
+    def _open(self, run_id, name, **attrs):
+        self._spans[run_id] = start_span(name, self.parent, **attrs)
+
+    def _close(self, run_id, **attrs):
+        opened = self._spans.pop(run_id, None)
+        if opened is not None:
+            opened.set(**attrs)
+            opened.finish()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.llm_calls += 1
+        self._open(run_id, 'llm.call', model=(serialized or {}).get('name'))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.llm_calls += 1
+        self._open(run_id, 'llm.call', model=(serialized or {}).get('name'))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._close(run_id, **_token_usage(response))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._close(run_id, error=type(error).__name__)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._open(run_id, f"tool.{(serialized or {}).get('name')}")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._close(run_id, bytes=len(str(output)))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._close(run_id, error=type(error).__name__)
+
 
 def get_llm_model(OPENAI=True):
 
     if OPENAI:
+        from langchain_openai import ChatOpenAI
+
         api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
             raise ValueError(
@@ -101,8 +160,12 @@ def get_llm_model(OPENAI=True):
             api_key=api_key, model='gpt-4o-mini', temperature=0.2
         )
     else:
-        if not c.IS_OCI_CREDENTIALS_VALID:
+        if not c.is_oci_credentials_valid():
             return
+
+        import oci
+        from langchain_community.chat_models import ChatOCIGenAI
+
         client = oci.generative_ai_inference.GenerativeAiInferenceClient(
             config=c.OCI_CREDENTIALS,
             service_endpoint=c.DEFAULT_GENAI_SERVICE_ENDPOINT,
@@ -120,13 +183,75 @@ def get_llm_model(OPENAI=True):
     return model
 
 
-def my_sql_agent(llm, db, db_schema):
-    table_info = get_table_headers(db, db_schema)
-    print(table_info)
-    db_toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+def sql_system_message(db_schema, table_info):
+    from langchain_core.messages import SystemMessage
 
     prompt_formatted = c.system.format(schema=db_schema, table_info=table_info)
-    system_message = SystemMessage(content=prompt_formatted)
+    return SystemMessage(content=prompt_formatted)
+
+
+def local_sql_tools(tools, db, db_schema):
+    """Troca o sql_db_query_checker, que gasta uma chamada ao LLM, pela
+    validação local contra o catálogo em cache, e valida também a query do
+    sql_db_query antes de ela ir ao banco."""
+    from langchain_core.tools import StructuredTool
+    from sql_validator import InvalidQuery, check_postgres_query
+
+    def sql_db_query_checker(query: str) -> str:
+        try:
+            return check_postgres_query(db, query, db_schema)
+        except InvalidQuery as e:
+            return f'Error: {e}'
+
+    def sql_db_query(query: str) -> str:
+        try:
+            query = check_postgres_query(db, query, db_schema)
+        except InvalidQuery as e:
+            return f'Error: {e}'
+        return db.run_no_throw(query)
+
+    local = {f.__name__: f for f in (sql_db_query_checker, sql_db_query)}
+    return [
+        StructuredTool.from_function(
+            func=local[tool.name], name=tool.name, description=tool.description
+        )
+        if tool.name in local
+        else tool
+        for tool in tools
+    ]
+
+
+@lru_cache(maxsize=None)
+def _local_toolkit_class():
+    from langchain_community.agent_toolkits import SQLDatabaseToolkit
+
+    class LocalSQLDatabaseToolkit(SQLDatabaseToolkit):
+        db_schema: str = 'public'
+
+        def get_tools(self):
+            tools = super().get_tools()
+            return local_sql_tools(tools, self.db, self.db_schema)
+
+    return LocalSQLDatabaseToolkit
+
+
+def my_sql_agent(llm, db, db_schema, table_info=None):
+    from langchain_community.agent_toolkits import (
+        SQLDatabaseToolkit,
+        create_sql_agent,
+    )
+
+    if table_info is None:
+        table_info = get_table_headers(db, db_schema)
+    logging.debug(table_info)
+    if c.SQL_VALIDATION:
+        db_toolkit = _local_toolkit_class()(
+            db=db, llm=llm, db_schema=db_schema
+        )
+    else:
+        db_toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+
+    system_message = sql_system_message(db_schema, table_info)
     logging.info(f'Prompt formatado: {system_message}')
 
     my_agent = create_sql_agent(
@@ -140,3 +265,106 @@ def my_sql_agent(llm, db, db_schema):
     )
 
     return my_agent
+
+
+class SQLAgentRegistry:
+    def __init__(self, max_agents=32):
+        # Um agente por conjunto de tabelas escolhido para o contexto; LRU
+        # para não acumular agentes de combinações raras.
+        self.max_agents = max_agents
+        self._agents = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.reuses = 0
+        self.build_seconds = 0.0
+        self.reuse_seconds = 0.0
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, llm, db, db_schema, question=None):
+        with span('agent.get', schema=db_schema) as agent_span:
+            agent, reused = self._get(llm, db, db_schema, question)
+            agent_span.set(reused=reused)
+            return agent
+
+    def _get(self, llm, db, db_schema, question):
+        start = time.perf_counter()
+        # table_info muda com o schema e quando o job de perfis atualiza;
+        # o agente é reconstruído nos dois casos.
+        table_info, tables = schema_context(db, db_schema, question)
+        key = (
+            id(llm),
+            database_key(db),
+            db_schema,
+            tuple(tables) if tables is not None else None,
+        )
+
+        with self._key_lock(key):
+            entry = self._agents.get(key)
+            if entry is not None and entry[0] == table_info:
+                with self._lock:
+                    self._agents.move_to_end(key)
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.reuses += 1
+                    self.reuse_seconds += elapsed
+                logging.info(
+                    f'SQL agent reutilizado para {db_schema} '
+                    f'em {elapsed * 1000:.1f}ms.'
+                )
+                return entry[1], True
+
+            try:
+                with span('agent.build'):
+                    agent = my_sql_agent(llm, db, db_schema, table_info)
+            except Exception:
+                with self._lock:
+                    if key not in self._agents:
+                        self._locks.pop(key, None)
+                raise
+            with self._lock:
+                self._agents[key] = (table_info, agent)
+                self._agents.move_to_end(key)
+                while len(self._agents) > self.max_agents:
+                    # O lock sai junto com o agente: sem isso _locks guarda
+                    # uma entrada por combinação de tabelas já vista.
+                    evicted, _ = self._agents.popitem(last=False)
+                    self._locks.pop(evicted, None)
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.builds += 1
+            self.build_seconds += elapsed
+        logging.info(
+            f'SQL agent construído para {db_schema} em {elapsed * 1000:.1f}ms.'
+        )
+        return agent, False
+
+    def clear(self):
+        with self._lock:
+            self._agents.clear()
+            self._locks.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                agents=len(self._agents),
+                builds=self.builds,
+                reuses=self.reuses,
+                avg_build_ms=1000 * self.build_seconds / self.builds
+                if self.builds
+                else 0.0,
+                avg_reuse_ms=1000 * self.reuse_seconds / self.reuses
+                if self.reuses
+                else 0.0,
+            )
+
+
+AGENT_REGISTRY = SQLAgentRegistry()
+
+
+def get_sql_agent(llm, db, db_schema, question=None):
+    return AGENT_REGISTRY.get(llm, db, db_schema, question)